@@ -131,30 +131,48 @@
       const entity_id = this._eid("button", "generate");
       const m3uId = this._eid("sensor", "m3u_mtime");
       const epgId = this._eid("sensor", "epg_mtime");
-      const beforeM3u = this._stateStr(m3uId);
-      const beforeEpg = this._stateStr(epgId);
+      // 任务结束看 job 主题（last_job_ok 的属性）：内容没变时文件 mtime 保持不变，不能靠时间判断
+      const jobId = this._eid("binary_sensor", "last_job_ok");
+      const beforeJobs = this._state(jobId)?.attributes?.jobs || {};
+      const beforeM3uAt = beforeJobs.m3u?.at;
+      const beforeEpgAt = beforeJobs.epg?.at;
       this._updating = true;
       this._toast("正在一键更新（M3U+EPG）…");
       this._render();
       await this._hass.callService("button", "press", { entity_id });
-      // 等待传感器时间变化（最长约 3 分钟：含台标下载）
+      // 一键更新先跑 m3u 再跑 epg：等到 epg 的新结果发布（最长约 3 分钟：含台标下载）
       for (let i = 0; i < 90; i++) {
         await new Promise((r) => setTimeout(r, 2000));
-        const m3u = this._hass?.states?.[m3uId]?.state;
-        const epg = this._hass?.states?.[epgId]?.state;
-        const m3uChanged = m3u && m3u !== beforeM3u && m3u !== "unknown";
-        const epgChanged = epg && epg !== beforeEpg && epg !== "unknown";
-        if (m3uChanged || epgChanged) {
-          this._updating = false;
+        const jobs = this._state(jobId)?.attributes?.jobs || {};
+        const epgJob = jobs.epg;
+        if (!epgJob || !epgJob.at || epgJob.at === beforeEpgAt) continue;
+        this._updating = false;
+        // jobs 里分别保留每类任务最近一次的结果：m3u 失败不会被随后成功的 epg 盖掉
+        const m3uJob = jobs.m3u;
+        const fails = [];
+        if (!m3uJob || !m3uJob.at || m3uJob.at === beforeM3uAt) {
+          fails.push("M3U 未执行");
+        } else if (m3uJob.rc !== 0) {
+          fails.push(`M3U 退出码 ${m3uJob.rc}`);
+        }
+        if (epgJob.rc !== 0) fails.push(`EPG 退出码 ${epgJob.rc}`);
+        if (fails.length) {
+          this._toast(`更新失败（${fails.join("，")}），请查看日志`);
+        } else {
+          const same =
+            m3uJob.changes?.changed === false && epgJob.changes?.changed === false;
+          const m3u = this._stateStr(m3uId);
+          const epg = this._stateStr(epgId);
           this._toast(
-            `更新完成：M3U ${this._formatUpdateTime(m3u)} / EPG ${this._formatUpdateTime(epg)}`
+            `更新完成：M3U ${this._formatUpdateTime(m3u)} / EPG ${this._formatUpdateTime(epg)}` +
+              (same ? "（内容无变化）" : "")
           );
-          this._render();
-          return;
         }
+        this._render();
+        return;
       }
       this._updating = false;
-      this._toast("已触发更新，请稍后看时间是否变化（任务可能仍在跑）");
+      this._toast("已触发更新，任务可能仍在跑，请稍后查看 IPTV Last Job OK");
       this._render();
     }
 
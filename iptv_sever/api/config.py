@@ -25,6 +25,8 @@ if __package__ in (None, ""):
 API_DIR = Path(__file__).resolve().parent
 IPTV_SEVER_DIR = API_DIR.parent.resolve()
 OUT_DIR = (IPTV_SEVER_DIR / "out").resolve()
+# 运行期缓存（回看分片等）；不放 out/，避免被 /out 静态目录暴露
+CACHE_DIR = Path(os.environ.get("CACHE_DIR") or (IPTV_SEVER_DIR / "cache")).resolve()
 STATE_PATH = (API_DIR / "state.json").resolve()
 LOG_FILE = (API_DIR / "api.log").resolve()
 
@@ -18,11 +18,11 @@ if __package__ in (None, ""):
         sys.path.insert(0, repo_root)
 
 from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
 
 from .config import OUT_DIR, logger
 from .routers import catchup
 from .settings import get_http_bind, get_runtime_config, reload_config
+from .utils.static import PrecompressedStaticFiles
 
 
 def _handle_mqtt_command(data: dict) -> None:
@@ -91,6 +91,18 @@ def _handle_mqtt_command(data: dict) -> None:
             )
         return
 
+    if action == "cancel":
+        from .services.job import cancel_job
+
+        ok = cancel_job(name)
+        if svc:
+            svc.publish(
+                "event",
+                {"ok": ok, "action": "cancel", "name": name},
+                retain=False,
+            )
+        return
+
     if action == "udpxy":
         if name == "start":
             result = udpxy_svc.start_udpxy()
@@ -216,7 +228,8 @@ app = FastAPI(
 )
 
 OUT_DIR.mkdir(parents=True, exist_ok=True)
-app.mount("/out", StaticFiles(directory=str(OUT_DIR)), name="out")
+# epg.xml / m3u 旁边有生成任务写好的 .gz/.br 时按 Accept-Encoding 直接发送
+app.mount("/out", PrecompressedStaticFiles(directory=str(OUT_DIR)), name="out")
 logger.info(f"静态文件: /out -> {OUT_DIR}")
 
 app.include_router(catchup.router)
@@ -227,7 +240,7 @@ async def root():
     return {
         "name": "IPTV Server",
         "version": "3.0.0",
-        "endpoints": ["/health", "/diag", "/out/", "/catchup/"],
+        "endpoints": ["/health", "/diag", "/stats", "/out/", "/catchup/"],
     }
 
 
@@ -236,6 +249,12 @@ async def health():
     return {"status": "ok"}
 
 
+@app.get("/stats")
+async def stats():
+    """运行计数（回看连接池等），便于排查性能问题。"""
+    return {"catchup": catchup.get_catchup_stats()}
+
+
 @app.get("/diag")
 async def diag():
     """网络环境自检（双网卡 / 网关 / DNS / 频道源 / udpxy / 回看）。"""
@@ -9,11 +9,14 @@
   播放器只访问局域网，由服务器经 source_iface 拉 IPTV 内网（10.255）
 """
 
+from typing import AsyncIterator, Callable, Optional
+
 from urllib.parse import unquote
 
 from fastapi import APIRouter, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 
-from ..config import logger
+from ..config import CACHE_DIR, logger
 
 try:
     from iptv_sever.backend.catchup import (
@@ -21,13 +24,37 @@ try:
         convert_catchup_times,
         detect_time_format,
     )
+    from iptv_sever.backend.catchup_cache import (
+        get_cache_stats,
+        get_segment_cache,
+        is_cacheable_segment,
+    )
+    from iptv_sever.backend.catchup_client import (
+        get_pool_stats,
+        get_upstream_pool,
+        open_upstream,
+    )
+    from iptv_sever.backend.catchup_limiter import (
+        LimiterOverloaded,
+        get_limiter,
+        get_limiter_stats,
+    )
+    from iptv_sever.backend.catchup_playlist_cache import (
+        CachedPlaylist,
+        get_playlist_cache,
+        get_playlist_cache_stats,
+        playlist_cache_key,
+    )
+    from iptv_sever.backend.catchup_prefetch import get_prefetch_stats, get_prefetcher
     from iptv_sever.backend.catchup_proxy import (
+        M3U8Rewriter,
         decode_upstream_token,
-        fetch_upstream,
+        get_media_token_stats,
+        get_media_token_table,
         is_allowed_upstream_url,
         looks_like_m3u8,
         looks_like_ts,
-        rewrite_m3u8_to_proxy,
+        parse_byte_range,
     )
 except ImportError as e:
     logger.error(f"导入回放模块失败: {e}")
@@ -53,12 +80,69 @@ except ImportError as e:
     def looks_like_ts(url: str, content_type: str):
         return False
 
-    def rewrite_m3u8_to_proxy(*args, **kwargs):
-        return b""
+    class M3U8Rewriter:
+        def __init__(self, *args, **kwargs):
+            self.media_urls = []
+
+        def feed(self, chunk: bytes) -> bytes:
+            return b""
+
+        def finish(self) -> bytes:
+            return b""
+
+    def parse_byte_range(value: str, size: int):
+        return None
+
+    def get_media_token_table(*args, **kwargs):
+        return None
+
+    def get_media_token_stats():
+        return {}
 
-    def fetch_upstream(*args, **kwargs):
+    async def open_upstream(*args, **kwargs):
         raise RuntimeError("catchup proxy unavailable")
 
+    def get_upstream_pool(*args, **kwargs):
+        return None
+
+    def get_pool_stats():
+        return {}
+
+    def get_segment_cache(*args, **kwargs):
+        return None
+
+    class LimiterOverloaded(Exception):
+        retry_after = 1
+
+    def get_limiter(*args, **kwargs):
+        return None
+
+    def get_limiter_stats():
+        return {}
+
+    def is_cacheable_segment(url: str):
+        return False
+
+    def get_cache_stats():
+        return {}
+
+    def get_prefetcher(*args, **kwargs):
+        return None
+
+    def get_prefetch_stats():
+        return {}
+
+    CachedPlaylist = None
+
+    def get_playlist_cache(*args, **kwargs):
+        return None
+
+    def get_playlist_cache_stats():
+        return {}
+
+    def playlist_cache_key(*args, **kwargs):
+        return ()
+
 
 # 对外直接挂在 /catchup（无 Nginx 反代前缀重写）
 router = APIRouter(tags=["回放代理"])
@@ -102,63 +186,444 @@ def _media_proxy_base(request: Request) -> str:
     return f"{_public_base(request)}/catchup/media"
 
 
-def _filter_headers(headers: dict) -> dict:
+def _client_key(request: Request) -> str:
+    """预取会话按播放器 IP 区分（经反代时取 X-Forwarded-For 第一个）。"""
+    fwd = request.headers.get("x-forwarded-for") or ""
+    if fwd:
+        return fwd.split(",")[0].strip()
+    return request.client.host if request.client else ""
+
+
+def _segment_cache(catchup_cfg: dict):
+    return get_segment_cache(catchup_cfg, disk_dir=str(CACHE_DIR / "segments"))
+
+
+def _upstream_opener(request: Request, *, source_iface: str, catchup_cfg: dict, timeout: float):
+    """url -> 无参协程工厂，给分片缓存/预取共用。"""
+    ua = request.headers.get("user-agent", "Mozilla/5.0")
+
+    def open_for(url: str):
+        return lambda: open_upstream(
+            url,
+            source_iface=source_iface,
+            user_agent=ua,
+            timeout=timeout,
+            on_redirect=lambda u: logger.debug(f"  重定向到: {u}"),
+            pool=get_upstream_pool(catchup_cfg),
+        )
+
+    return open_for
+
+
+def _filter_headers(headers: dict, *, keep_length: bool = False) -> dict:
+    """
+    去掉逐跳头。keep_length=True 表示 body 原样透传，保留上游 Content-Length
+    （播放器靠它算进度/拖动；有 Content-Encoding 时长度不可信，仍去掉）。
+    """
+    lower = {k.lower() for k in (headers or {})}
+    keep = keep_length and "content-encoding" not in lower
     out = {}
     for k, v in (headers or {}).items():
-        if k.lower() in _DROP_HEADERS:
+        kl = k.lower()
+        if kl in _DROP_HEADERS and not (keep and kl == "content-length"):
             continue
         out[k] = v
     return out
 
 
-def _proxy_and_rewrite(
+def _range_headers(request: Request) -> dict:
+    """播放器的 Range / If-Range 原样转给上游。"""
+    out = {}
+    for name in ("Range", "If-Range"):
+        v = request.headers.get(name)
+        if v:
+            out[name] = v
+    return out
+
+
+def _slice_response(body: bytes, *, range_header: str, media_type: str, headers: dict) -> Response:
+    """
+    作用：
+    - 从本地完整副本按 Range 切片：206 + Content-Range；起点越界回 416；Range 不认识回 200 整段。
+    """
+
+    size = len(body)
+    headers = dict(headers)
+    headers["Accept-Ranges"] = "bytes"
+    try:
+        rng = parse_byte_range(range_header, size) if range_header else None
+    except ValueError:
+        headers["Content-Range"] = f"bytes */{size}"
+        return Response(status_code=416, headers=headers)
+    if rng is None:
+        return Response(content=body, status_code=200, headers=headers, media_type=media_type)
+    start, end = rng
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return Response(
+        content=body[start : end + 1],
+        status_code=206,
+        headers=headers,
+        media_type=media_type,
+    )
+
+
+async def _prepend(first: bytes, rest: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    try:
+        if first:
+            yield first
+        async for chunk in rest:
+            yield chunk
+    finally:
+        # 播放器中途断开时也要释放上游连接
+        await rest.aclose()
+
+
+def _register_prefetch(request: Request, catchup_cfg: dict, segments: list) -> None:
+    prefetcher = get_prefetcher(catchup_cfg, _segment_cache(catchup_cfg))
+    if prefetcher is not None:
+        prefetcher.register_playlist(_client_key(request), segments)
+
+
+async def _acquire_permit(request: Request, catchup_cfg: dict):
+    """申请回看上游名额（未启用限流返回 None）；排队满/超时抛 LimiterOverloaded。"""
+    limiter = get_limiter(catchup_cfg)
+    if limiter is None:
+        return None
+    return await limiter.acquire(_client_key(request))
+
+
+async def _release_after(body: AsyncIterator[bytes], permit) -> AsyncIterator[bytes]:
+    try:
+        async for chunk in body:
+            yield chunk
+    finally:
+        permit.release()
+
+
+def _hold_permit(resp: Response, permit) -> Response:
+    """流式响应把名额留到响应体发完；普通响应立即归还。"""
+    if permit is None:
+        return resp
+    if isinstance(resp, StreamingResponse):
+        resp.body_iterator = _release_after(resp.body_iterator, permit)
+    else:
+        permit.release()
+    return resp
+
+
+class _UpstreamStatusError(Exception):
+    """上游返回 4xx/5xx（reject_error_status=True 时）；上游连接已关闭。"""
+
+    def __init__(self, status: int) -> None:
+        super().__init__(f"HTTP {status}")
+        self.status = status
+
+
+def _overloaded_response(e: "LimiterOverloaded") -> Response:
+    logger.warning(f"回看上游繁忙({e})，返回 503")
+    return Response(
+        content=f"回看上游繁忙（{e}），请稍后重试",
+        status_code=503,
+        headers={"Retry-After": str(e.retry_after)},
+        media_type="text/plain; charset=utf-8",
+    )
+
+
+async def _proxy_and_rewrite(
+    upstream_url: str,
+    *,
+    request: Request,
+    source_iface: str,
+    catchup_cfg: dict,
+    timeout: float = 60,
+    on_playlist: Optional[Callable[[str, bytes, dict, list], None]] = None,
+    reject_error_status: bool = False,
+) -> Response:
+    """
+    经并发限流拉上游（见 _fetch_and_rewrite）；名额在响应体发完时归还。
+    """
+    permit = await _acquire_permit(request, catchup_cfg)
+    try:
+        resp = await _fetch_and_rewrite(
+            upstream_url,
+            request=request,
+            source_iface=source_iface,
+            catchup_cfg=catchup_cfg,
+            timeout=timeout,
+            on_playlist=on_playlist,
+            reject_error_status=reject_error_status,
+        )
+    except BaseException:
+        if permit is not None:
+            permit.release()
+        raise
+    return _hold_permit(resp, permit)
+
+
+async def _fetch_and_rewrite(
     upstream_url: str,
     *,
     request: Request,
     source_iface: str,
+    catchup_cfg: dict,
     timeout: float = 60,
+    on_playlist: Optional[Callable[[str, bytes, dict, list], None]] = None,
+    reject_error_status: bool = False,
 ) -> Response:
+    """
+    拉上游：m3u8 读完后改写成 /catchup/media；.ts 等媒体逐块流式转给播放器，
+    不在内存里攒整段，也不阻塞事件循环。
+
+    Range / If-Range 转给上游，206 与 Content-Range/Content-Length 原样回给播放器；
+    HEAD 只转发响应头。
+
+    on_playlist(final_url, body, headers, segments)：上游 200 的 m3u8 改写完成后回调（主播放列表缓存用）。
+    reject_error_status：上游 4xx/5xx 时关闭连接并抛 _UpstreamStatusError，
+    不包装成响应（调用方要换地址重试时用，避免未开始迭代的响应体占着连接和名额）。
+    """
     ua = request.headers.get("user-agent", "Mozilla/5.0")
-    status, headers, body, final_url = fetch_upstream(
+    method = "HEAD" if request.method == "HEAD" else "GET"
+    upstream = await open_upstream(
         upstream_url,
         source_iface=source_iface,
+        method=method,
         user_agent=ua,
+        headers=_range_headers(request),
         timeout=timeout,
         on_redirect=lambda u: logger.debug(f"  重定向到: {u}"),
+        pool=get_upstream_pool(catchup_cfg),
     )
-    ctype = headers.get("Content-Type") or headers.get("content-type") or ""
-    headers = dict(headers)
+    if reject_error_status and upstream.status >= 400:
+        await upstream.aclose()
+        raise _UpstreamStatusError(upstream.status)
+    final_url = upstream.url or upstream_url
+    ctype = upstream.header("content-type")
+    headers = dict(upstream.headers)
+    if looks_like_ts(final_url, ctype):
+        headers = {k: v for k, v in headers.items() if k.lower() != "content-type"}
+        headers["Content-Type"] = "video/mp2t"
+
+    if method == "HEAD":
+        await upstream.aclose()
+        # m3u8 会被改写，上游长度对不上
+        keep = not looks_like_m3u8(ctype, b"")
+        return Response(
+            status_code=upstream.status,
+            headers=_filter_headers(headers, keep_length=keep),
+        )
 
-    if looks_like_m3u8(ctype, body):
+    chunks = upstream.iter_chunks()
+    try:
+        if upstream.status == 206 or looks_like_ts(final_url, ctype):
+            first = b""
+        else:
+            # 需要看开头几个字节判断是否 m3u8（部分 CDN 的 Content-Type 不规范）
+            first = await chunks.__anext__()
+    except StopAsyncIteration:
+        first = b""
+    except BaseException:
+        await chunks.aclose()
+        raise
+
+    if upstream.status != 206 and looks_like_m3u8(ctype, first):
         proxy_base = _media_proxy_base(request)
-        body = rewrite_m3u8_to_proxy(
-            body,
-            playlist_url=final_url or upstream_url,
+        # 边收边改写：不等整段到齐再 decode/split/join
+        rewriter = M3U8Rewriter(
+            playlist_url=final_url,
             proxy_base=proxy_base,
+            tokens=get_media_token_table(catchup_cfg),
         )
+        parts = [rewriter.feed(first)]
+        async for chunk in chunks:
+            parts.append(rewriter.feed(chunk))
+        parts.append(rewriter.finish())
+        body = b"".join(parts)
         headers["Content-Type"] = "application/vnd.apple.mpegurl"
         logger.info(f"  已重写 m3u8 → 经 {proxy_base}")
-    elif looks_like_ts(final_url or upstream_url, ctype):
-        headers["Content-Type"] = "video/mp2t"
+        segments = rewriter.media_urls
+        _register_prefetch(request, catchup_cfg, segments)
+        out_headers = _filter_headers(headers)
+        if on_playlist is not None and upstream.status == 200:
+            on_playlist(final_url, body, dict(out_headers), segments)
+        return Response(
+            content=body,
+            status_code=upstream.status,
+            headers=out_headers,
+            media_type=headers.get("Content-Type"),
+        )
 
-    return Response(
-        content=body,
-        status_code=status,
-        headers=_filter_headers(headers),
+    return StreamingResponse(
+        _prepend(first, chunks),
+        status_code=upstream.status,
+        headers=_filter_headers(headers, keep_length=True),
         media_type=headers.get("Content-Type") or headers.get("content-type"),
     )
 
 
-@router.get("/catchup/media")
-@router.post("/catchup/media")
-async def catchup_media_proxy(
+async def _serve_cached_segment(
+    cache,
+    upstream_url: str,
+    *,
     request: Request,
-    u: str = Query(..., description="上游媒体 URL（base64url）"),
-):
-    """反代 CDN 子 m3u8 / .ts，强制经 source_iface。"""
-    upstream = decode_upstream_token(u)
-    if not upstream:
-        raise HTTPException(status_code=400, detail="缺少参数 u")
+    source_iface: str,
+    catchup_cfg: dict,
+    timeout: float = 60,
+) -> Response:
+    """
+    .ts/.m4s 分片：先查缓存；未命中则经 cache.fetch 拉取（同一分片并发请求只拉一次上游），
+    边拉边转给播放器，拉完写入缓存。开启预取时顺带把后面几片拉进缓存。
+
+    Range/HEAD：命中缓存时本地切片/只回头；未命中时不进缓存，直接转给上游。
+    """
+    open_for = _upstream_opener(
+        request, source_iface=source_iface, catchup_cfg=catchup_cfg, timeout=timeout
+    )
+    prefetcher = get_prefetcher(catchup_cfg, cache)
+    if prefetcher is not None:
+        prefetcher.on_segment(
+            _client_key(request), upstream_url, open_for, limiter=get_limiter(catchup_cfg)
+        )
+
+    range_header = request.headers.get("range") or ""
+    seg = await cache.get(upstream_url)
+    if seg is not None:
+        ctype = seg.content_type
+        if looks_like_ts(upstream_url, ctype):
+            ctype = "video/mp2t"
+        headers = {"X-Cache": "HIT"}
+        if request.method == "HEAD":
+            headers.update({"Accept-Ranges": "bytes", "Content-Length": str(len(seg.body))})
+            return Response(status_code=200, headers=headers, media_type=ctype or None)
+        return _slice_response(
+            seg.body, range_header=range_header, media_type=ctype or None, headers=headers
+        )
+
+    if request.method == "HEAD" or range_header:
+        return await _proxy_and_rewrite(
+            upstream_url,
+            request=request,
+            source_iface=source_iface,
+            catchup_cfg=catchup_cfg,
+            timeout=timeout,
+        )
+
+    # 已有同一分片在拉时直接跟随，不另占上游名额；
+    # 名额交给缓存的后台拉取，上游拉完时归还（播放器中途断开时拉取仍在继续，也仍占着名额）
+    permit = None if cache.peek(upstream_url) else await _acquire_permit(request, catchup_cfg)
+    inflight = cache.fetch(upstream_url, open_for(upstream_url), permit=permit)
+    # 立即登记读者：之后拉取若转为流式，已登记的读者不会丢开头
+    rid = inflight.add_reader()
+    try:
+        await inflight.wait_head(timeout)
+    except BaseException:
+        inflight.remove_reader(rid)
+        raise
+
+    headers = _filter_headers(inflight.headers, keep_length=True)
+    headers["X-Cache"] = "MISS"
+    ctype = inflight.content_type()
+    if looks_like_ts(upstream_url, ctype):
+        ctype = "video/mp2t"
+        headers.pop("Content-Type", None)
+        headers.pop("content-type", None)
+    return StreamingResponse(
+        inflight.iter_body(rid),
+        status_code=inflight.status,
+        headers=headers,
+        media_type=ctype or None,
+    )
+
+
+def get_catchup_stats() -> dict:
+    """回看反代运行计数（/stats 与 MQTT status 用）。"""
+    return {
+        "pool": get_pool_stats(),
+        "cache": get_cache_stats(),
+        "prefetch": get_prefetch_stats(),
+        "playlist": get_playlist_cache_stats(),
+        "tokens": get_media_token_stats(),
+        "limiter": get_limiter_stats(),
+    }
+
+
+async def _resolve_playlist_cached(
+    playlist_cache,
+    target_url: str,
+    *,
+    catchup_path: str,
+    begin_zte: str,
+    end_zte: str,
+    extra_params: dict,
+    request: Request,
+    source_iface: str,
+    catchup_cfg: dict,
+) -> Response:
+    """
+    作用：
+    - 主 m3u8 走短 TTL 缓存：命中直接回改写好的正文；正文过期但重定向目标还在时直接请求最终地址，
+      最终地址失效（4xx/5xx/异常）则丢掉它，回到运营商入口重新走一遍重定向。
+    """
+
+    key = playlist_cache_key(
+        catchup_path, begin_zte, end_zte, extra_params, _media_proxy_base(request)
+    )
+    async with playlist_cache.lock(key):
+        hit = playlist_cache.get(key)
+        if hit is not None:
+            logger.info("  主 m3u8 命中缓存")
+            _register_prefetch(request, catchup_cfg, hit.segments)
+            headers = dict(hit.headers)
+            headers["X-Cache"] = "HIT"
+            return Response(
+                content=hit.body,
+                status_code=200,
+                headers=headers,
+                media_type="application/vnd.apple.mpegurl",
+            )
+
+        redirect = playlist_cache.redirect_for(key)
+
+        def store(final_url: str, body: bytes, headers: dict, segments: list) -> None:
+            playlist_cache.put(
+                key,
+                CachedPlaylist(body=body, headers=headers, final_url=final_url, segments=segments),
+            )
+            if not redirect and final_url != target_url:
+                playlist_cache.set_redirect(key, final_url)
+
+        if redirect:
+            logger.info(f"  使用缓存的重定向地址: {redirect[:160]}")
+            try:
+                return await _proxy_and_rewrite(
+                    redirect,
+                    request=request,
+                    source_iface=source_iface,
+                    catchup_cfg=catchup_cfg,
+                    timeout=30,
+                    on_playlist=store,
+                    reject_error_status=True,
+                )
+            except _UpstreamStatusError as e:
+                logger.info(f"  缓存的重定向地址已失效({e.status})，重新解析")
+            except LimiterOverloaded:
+                raise
+            except Exception as e:
+                logger.info(f"  缓存的重定向地址请求失败，重新解析: {e}")
+            playlist_cache.drop_redirect(key)
+            redirect = ""
+
+        return await _proxy_and_rewrite(
+            target_url,
+            request=request,
+            source_iface=source_iface,
+            catchup_cfg=catchup_cfg,
+            timeout=30,
+            on_playlist=store,
+        )
+
+
+async def _serve_media(request: Request, upstream: str) -> Response:
+    """反代 CDN 子 m3u8 / .ts，强制经 source_iface（支持 Range 与 HEAD）。"""
     if not is_allowed_upstream_url(upstream):
         raise HTTPException(status_code=400, detail="不允许代理该地址")
 
@@ -168,18 +633,78 @@ async def catchup_media_proxy(
     source_iface = cfg.get("source_iface") or ""
     logger.info(f"媒体反代: iface={source_iface or '-'} url={upstream[:160]}")
 
+    catchup_cfg = cfg.get("catchup") or {}
     try:
-        return _proxy_and_rewrite(
+        cache = _segment_cache(catchup_cfg)
+        if cache is not None and is_cacheable_segment(upstream):
+            return await _serve_cached_segment(
+                cache,
+                upstream,
+                request=request,
+                source_iface=source_iface,
+                catchup_cfg=catchup_cfg,
+                timeout=60,
+            )
+        return await _proxy_and_rewrite(
             upstream,
             request=request,
             source_iface=source_iface,
+            catchup_cfg=catchup_cfg,
             timeout=60,
         )
+    except LimiterOverloaded as e:
+        return _overloaded_response(e)
     except Exception as e:
         logger.error(f"媒体反代失败: {e}", exc_info=True)
         raise HTTPException(status_code=502, detail=f"媒体反代失败: {e}")
 
 
+@router.get("/catchup/media")
+@router.head("/catchup/media")
+@router.post("/catchup/media")
+async def catchup_media_proxy(
+    request: Request,
+    u: str = Query(..., description="上游媒体 URL（base64url）"),
+):
+    """
+    旧形式：?u=base64(上游 URL)。
+
+    启用 media_tokens 时 ?u= 可以被客户端随意构造，只放行令牌表发放过的上游目录，其余回 410。
+    """
+    from ..services.state import get_config
+
+    upstream = decode_upstream_token(u)
+    if not upstream:
+        raise HTTPException(status_code=400, detail="缺少参数 u")
+    table = get_media_token_table(get_config().get("catchup") or {})
+    if table is not None and not table.allows_legacy(upstream):
+        logger.warning(f"拒绝未发放的 ?u= 媒体地址: {upstream[:160]}")
+        raise HTTPException(status_code=410, detail="旧形式媒体链接已停用，请重新打开节目")
+    return await _serve_media(request, upstream)
+
+
+@router.get("/catchup/media/{tid}/{rest:path}")
+@router.head("/catchup/media/{tid}/{rest:path}")
+@router.post("/catchup/media/{tid}/{rest:path}")
+async def catchup_media_token_proxy(request: Request, tid: str, rest: str):
+    """令牌形式：/catchup/media/{tid}/{文件名}?{上游 query}，tid 在服务端令牌表里换回上游目录。"""
+    from ..services.state import get_config
+
+    table = get_media_token_table(get_config().get("catchup") or {})
+    prefix = table.resolve(tid) if table is not None else ""
+    if not prefix:
+        raise HTTPException(status_code=404, detail="媒体令牌不存在或已过期，请重新打开节目")
+
+    # 用未解码的原始路径拼回上游地址，避免 %2F 等转义被改写
+    raw_path = (request.scope.get("raw_path") or b"").decode("latin-1")
+    marker = f"/media/{tid}/"
+    i = raw_path.find(marker)
+    raw_rest = raw_path[i + len(marker) :] if i >= 0 else rest
+    query = (request.scope.get("query_string") or b"").decode("latin-1")
+    upstream = prefix + raw_rest + (f"?{query}" if query else "")
+    return await _serve_media(request, upstream)
+
+
 @router.get("/catchup/{catchup_path:path}")
 @router.post("/catchup/{catchup_path:path}")
 async def catchup_proxy(
@@ -306,12 +831,32 @@ async def catchup_proxy(
         )
 
         try:
-            return _proxy_and_rewrite(
+            playlist_cache = get_playlist_cache(catchup_config)
+            if (
+                playlist_cache is not None
+                and request.method == "GET"
+                and not request.headers.get("range")
+            ):
+                return await _resolve_playlist_cached(
+                    playlist_cache,
+                    target_url,
+                    catchup_path=catchup_path,
+                    begin_zte=begin_zte,
+                    end_zte=end_zte,
+                    extra_params=extra_params,
+                    request=request,
+                    source_iface=source_iface,
+                    catchup_cfg=catchup_config,
+                )
+            return await _proxy_and_rewrite(
                 target_url,
                 request=request,
                 source_iface=source_iface,
+                catchup_cfg=catchup_config,
                 timeout=30,
             )
+        except LimiterOverloaded as e:
+            return _overloaded_response(e)
         except Exception as e:
             logger.error(f"转发请求异常: {e}")
             raise HTTPException(status_code=500, detail=f"转发请求失败: {str(e)}")
@@ -19,6 +19,9 @@ _status: Dict[str, Any] = {
     "last_job": "",
     "last_job_rc": None,
     "last_job_at": 0,
+    "last_job_changes": None,
+    # 每类任务最近一次的结果 {m3u: {rc, at, changes}, epg: {...}}：一键生成先 m3u 后 epg，last_job_* 只剩 epg
+    "jobs": {},
 }
 _logs: List[Dict[str, Any]] = []
 _MAX_LOGS = 200
@@ -37,14 +40,18 @@ def get_runtime_status() -> Dict[str, Any]:
             "last_job": _status.get("last_job", ""),
             "last_job_rc": _status.get("last_job_rc"),
             "last_job_at": _status.get("last_job_at", 0),
+            "last_job_changes": _status.get("last_job_changes"),
+            "jobs": {k: dict(v) for k, v in (_status.get("jobs") or {}).items()},
         }
 
 
-def update_job_result(job_type: str, rc: Optional[int]) -> None:
+def update_job_result(job_type: str, rc: Optional[int], changes: Optional[Dict[str, Any]] = None) -> None:
     with _lock:
         _status["last_job"] = job_type
         _status["last_job_rc"] = rc
         _status["last_job_at"] = now_ts()
+        _status["last_job_changes"] = changes
+        _status["jobs"][job_type] = {"rc": rc, "at": _status["last_job_at"], "changes": changes}
 
 
 def update_file_status(kind: str, meta: Dict[str, Any]) -> None:
@@ -6,11 +6,14 @@
 """
 
 import logging
-import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FuturesTimeout
 from pathlib import Path
 from typing import Any, Dict, List
 
-from ..config import IPTV_SEVER_DIR, OUT_DIR
+from ..config import CACHE_DIR, OUT_DIR
 from ..runtime_status import (
     append_runtime_log,
     now_ts,
@@ -22,6 +25,16 @@ from .state import get_config, get_server_base_url, get_status, publish_status_m
 logger = logging.getLogger(__name__)
 
 
+def _catalog_args(cfg: Dict[str, Any]) -> List[str]:
+    # M3U 与 EPG 指向同一快照目录：一轮生成只请求一次频道列表
+    return [
+        "--catalog-cache-dir",
+        str(CACHE_DIR / "catalog"),
+        "--catalog-max-age",
+        str(cfg.get("catalog_max_age_s", 120)),
+    ]
+
+
 def build_m3u_args(
     cfg: Dict[str, Any],
     web_base_url: str = None,
@@ -67,11 +80,23 @@ def build_m3u_args(
     args.extend(["--web-base-url", web_base_url])
     if not cfg.get("logo_skip_existing", True):
         args.append("--no-logo-skip-existing")
+    if cfg.get("logo_workers") is not None:
+        args.extend(["--logo-workers", str(cfg["logo_workers"])])
+    if cfg.get("logo_rate_per_host") is not None:
+        args.extend(["--logo-rate", str(cfg["logo_rate_per_host"])])
+    if cfg.get("logo_revalidate_s") is not None:
+        args.extend(["--logo-revalidate", str(cfg["logo_revalidate_s"])])
+    variant = str(cfg.get("logo_variant") or "").strip().lower()
+    if variant in ("png", "webp"):
+        args.extend(["--logo-variant", variant, "--logo-variant-size", str(int(cfg.get("logo_variant_size") or 128))])
     # 默认同时生成 TiviMate + APTV 两套
     style = str(cfg.get("catchup_style") or "both")
     args.extend(["--catchup-style", style])
     aptv_name = Path(str(cfg.get("output_m3u_aptv") or "iptv-aptv.m3u")).name
     args.extend(["--out-aptv", str(OUT_DIR / aptv_name)])
+    args.extend(_catalog_args(cfg))
+    if not cfg.get("precompress", True):
+        args.append("--no-precompress")
     return args
 
 
@@ -103,16 +128,141 @@ def build_epg_args(cfg: Dict[str, Any], web_base_url: str = None) -> List[str]:
         args.extend(["--days-forward", str(cfg["epg_days_forward"])])
     if cfg.get("epg_days_back") is not None:
         args.extend(["--days-back", str(cfg["epg_days_back"])])
+    if cfg.get("epg_workers") is not None:
+        args.extend(["--workers", str(cfg["epg_workers"])])
+    if cfg.get("epg_rate_per_s") is not None:
+        args.extend(["--rate", str(cfg["epg_rate_per_s"])])
+    if cfg.get("epg_retries") is not None:
+        args.extend(["--retries", str(cfg["epg_retries"])])
+    if cfg.get("epg_cache"):
+        args.extend(["--cache-dir", str(CACHE_DIR / "epg")])
+        args.extend(["--cache-hot-days", str(cfg.get("epg_cache_hot_days", 1))])
+        args.extend(["--cache-hot-ttl", str(cfg.get("epg_cache_hot_ttl_s", 43200))])
+        args.extend(["--cache-ttl", str(cfg.get("epg_cache_ttl_s", 86400))])
+    if cfg.get("epg_pretty") is False:
+        args.append("--no-pretty")
+    args.extend(_catalog_args(cfg))
+    if not cfg.get("precompress", True):
+        args.append("--no-precompress")
     return args
 
 
+# 进程内任务引擎：M3U / EPG 在工作线程里直接调用 backend 的 build()，不再 fork 子进程
+_JOB_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="iptv-job")
+_jobs_lock = threading.Lock()
+# job_type -> {"cancel": Event, "started_at": ts}；线程真正结束时才移除
+_running: Dict[str, Dict[str, Any]] = {}
+
+
+def get_running_jobs() -> Dict[str, Dict[str, Any]]:
+    """正在运行的任务（含已超时/已取消、但工作线程尚未退出的）。"""
+    with _jobs_lock:
+        return {
+            k: {"started_at": v["started_at"], "cancelling": v["cancel"].is_set()}
+            for k, v in _running.items()
+        }
+
+
+def cancel_job(job_type: str) -> bool:
+    """
+    作用：
+    - 请求取消正在运行的任务（协作式：任务在下一个检查点抛 JobCancelled 退出）。
+
+    输出：
+    - bool: 有对应的运行中任务时 True
+    """
+    job_type = (job_type or "").strip().lower()
+    if job_type == "logos":
+        job_type = "m3u"
+    with _jobs_lock:
+        job = _running.get(job_type)
+    if job is None:
+        return False
+    job["cancel"].set()
+    append_runtime_log("WARN", f"已请求取消任务：{job_type}")
+    return True
+
+
+def _run_builder(job_type: str, argv: List[str], cancel: threading.Event) -> Dict[str, Any]:
+    if job_type == "m3u":
+        from iptv_sever.backend.build_m3u import build
+    else:
+        from iptv_sever.backend.build_epg import build
+    try:
+        return build(argv, cancel=cancel)
+    finally:
+        with _jobs_lock:
+            _running.pop(job_type, None)
+
+
+def _job_changes(result: Dict[str, Any]) -> Dict[str, Any]:
+    """build() 结果 → 变化摘要（写进运行时状态，随 MQTT job 主题发布）。"""
+    # m3u: changed 是实际重写的文件列表；epg: changed 是 bool
+    return {"changed": bool(result.get("changed")), **(result.get("diff") or {})}
+
+
+def _describe_changes(job_type: str, changes: Dict[str, Any]) -> str:
+    if not changes.get("changed"):
+        return "内容未变，未重写文件"
+    if changes.get("baseline"):
+        return "已写入（无上次记录，不做对比）"
+    if job_type == "m3u":
+        msg = f"频道新增 {changes.get('added')} / 删除 {changes.get('removed')} / 改名 {changes.get('renamed')}"
+    else:
+        msg = (
+            f"频道新增 {changes.get('added')} / 删除 {changes.get('removed')}，"
+            f"{changes.get('channels_changed')} 个频道节目有变，节目数 {changes.get('programmes_delta', 0):+d}"
+        )
+    examples = changes.get("examples") or {}
+    shown = [f"{k}: {'、'.join(v)}" for k, v in examples.items() if v]
+    if shown:
+        msg += f"（{'; '.join(shown)}）"
+    return msg
+
+
+def _summarize(job_type: str, result: Dict[str, Any]) -> str:
+    if job_type == "m3u":
+        names = "、".join(Path(p).name for p in result.get("written") or [])
+        msg = f"M3U 生成完成：频道 {result.get('channels')}，输出 {names}"
+        logos = result.get("logos")
+        if logos:
+            msg += (
+                f"，logo 下载 {logos.get('downloaded')} / 更新 {logos.get('updated')}"
+                f" / 未变 {logos.get('not_modified')} / 跳过 {logos.get('skipped')}"
+                f" / 失败 {logos.get('failed')}"
+            )
+        return f"{msg}；{_describe_changes(job_type, _job_changes(result))}"
+    fetch = result.get("fetch") or {}
+    msg = (
+        f"EPG 生成完成：频道 {result.get('channels')}，节目 {result.get('programmes')}，"
+        f"抓取 ok={fetch.get('ok')} fail={fetch.get('fail')} 耗时 {fetch.get('elapsed_s')}s"
+    )
+    cache = result.get("cache")
+    if cache:
+        msg += f"，缓存跳过 {cache.get('skipped')} 个频道"
+    return f"{msg}；{_describe_changes(job_type, _job_changes(result))}"
+
+
 def execute_job(
     job_type: str,
     request_host: str = None,
     overrides: Dict[str, Any] = None,
 ) -> Dict[str, Any]:
+    """
+    作用：
+    - 在进程内任务引擎上执行 M3U / EPG / Logo 任务，并等待完成（最长 job_timeout_s 秒）。
+
+    输入：
+    - job_type: m3u | epg | logos
+    - request_host: 保留参数（兼容旧调用）
+    - overrides: 临时覆盖配置项
+
+    输出：
+    - Dict: ok / status / download_url / result（build() 的结构化结果）/ elapsed_s / error
+    """
     from .udpxy import get_udpxy_base_url
     from .state import set_catchup_override
+    from iptv_sever.backend.cancel import JobCancelled
 
     job_type = (job_type or "").strip().lower()
     if job_type not in {"m3u", "epg", "logos"}:
@@ -139,17 +289,13 @@ def execute_job(
     cfg = get_config()
     if overrides:
         cfg = {**cfg, **overrides}
-    append_runtime_log("INFO", f"开始执行任务：{job_type}")
 
     port = int(cfg.get("http_port") or 8088)
     web_base_url = get_server_base_url(cfg, port=port)
     udpxy_base = get_udpxy_base_url(cfg)
     cfg["udpxy_base"] = udpxy_base
 
-    backend_dir = IPTV_SEVER_DIR / "backend"
-
     if job_type == "m3u":
-        script_path = backend_dir / "build_m3u.py"
         epg_filename = Path(cfg.get("epg_out", "epg.xml")).name
         x_tvg_url = f"{web_base_url}/out/{epg_filename}"
         args = build_m3u_args(
@@ -159,120 +305,107 @@ def execute_job(
             udpxy_base=udpxy_base,
         )
     else:
-        script_path = backend_dir / "build_epg.py"
         args = build_epg_args(cfg, web_base_url=web_base_url)
 
-    if not script_path.exists():
-        append_runtime_log("ERROR", f"脚本不存在：{script_path}")
-        update_job_result(job_type, -1)
-        publish_status_mqtt()
+    cancel = threading.Event()
+    with _jobs_lock:
+        if job_type in _running:
+            busy = True
+        else:
+            busy = False
+            _running[job_type] = {"cancel": cancel, "started_at": now_ts()}
+    if busy:
+        append_runtime_log("WARN", f"任务 {job_type} 仍在运行，本次请求忽略")
         return {
             "ok": False,
-            "error": f"脚本不存在：{script_path}",
+            "error": f"任务 {job_type} 仍在运行",
             "status": get_status(),
             "download_url": None,
         }
 
+    append_runtime_log("INFO", f"开始执行任务：{job_type}")
+    append_runtime_log("INFO", f"任务参数：{' '.join(args)}")
+    timeout_s = float(cfg.get("job_timeout_s") or 300)
+    t0 = time.monotonic()
     rc = -1
+    result: Dict[str, Any] = {}
+    error = ""
     try:
-        cmd = ["python3", str(script_path)] + args
-        append_runtime_log("INFO", f"执行命令：{' '.join(cmd)}")
-        result = subprocess.run(
-            cmd,
-            cwd=str(backend_dir),
-            capture_output=True,
-            text=True,
-            timeout=300,
-        )
-        rc = result.returncode
-        update_job_result(job_type, rc)
-
-        if rc == 0:
-            if job_type == "m3u":
-                m3u_filename = Path(cfg.get("output_m3u", "iptv.m3u")).name
-                out_path = OUT_DIR / m3u_filename
-                if out_path.exists():
-                    update_file_status(
-                        "m3u",
-                        {
-                            "exists": True,
-                            "size": out_path.stat().st_size,
-                            "mtime": int(out_path.stat().st_mtime),
-                        },
-                    )
-                aptv_name = Path(cfg.get("output_m3u_aptv") or "iptv-aptv.m3u").name
-                aptv_path = OUT_DIR / aptv_name
-                if aptv_path.exists():
-                    update_file_status(
-                        "m3u_aptv",
-                        {
-                            "exists": True,
-                            "size": aptv_path.stat().st_size,
-                            "mtime": int(aptv_path.stat().st_mtime),
-                        },
-                    )
-                append_runtime_log("OK", "M3U 生成完成（含 TiviMate/APTV 双列表）")
-                try:
-                    from iptv_sever.backend.core import (
-                        extract_channels,
-                        load_channel_categories,
-                    )
-                    from iptv_sever.backend.net import (
-                        build_opener,
-                        get_ipv4_from_iface,
-                    )
-
-                    bind_ip = get_ipv4_from_iface(cfg.get("source_iface", "eth1"))
-                    if bind_ip:
-                        opener = build_opener(bind_ip)
-                        categories = load_channel_categories(
-                            cfg.get("input_url", ""),
-                            opener=opener,
-                            timeout_s=cfg.get("timeout_s", 10.0),
-                            user_agent=cfg.get("user_agent", "curl/8.0.0"),
-                        )
-                        _, catchup_host, catchup_port, virtual_domain = extract_channels(
-                            categories,
-                            tvg_id_field="primaryid",
-                            web_base_url="",
-                        )
-                        if catchup_host and catchup_port:
-                            set_catchup_override(
-                                target_host=catchup_host,
-                                target_port=catchup_port,
-                                virtual_domain=virtual_domain,
-                            )
-                            append_runtime_log(
-                                "INFO",
-                                f"内存已更新回放地址: {catchup_host}:{catchup_port}",
-                            )
-                except Exception as e:
-                    logger.warning(f"提取回放服务器地址失败: {e}", exc_info=True)
-            elif job_type == "epg":
-                epg_filename = Path(cfg.get("epg_out", "epg.xml")).name
-                out_path = OUT_DIR / epg_filename
-                if out_path.exists():
-                    update_file_status(
-                        "epg",
-                        {
-                            "exists": True,
-                            "size": out_path.stat().st_size,
-                            "mtime": int(out_path.stat().st_mtime),
-                        },
-                    )
-                append_runtime_log("OK", "EPG 生成完成")
-        else:
-            append_runtime_log("ERROR", f"执行失败（退出码 {rc}）")
-            if result.stderr:
-                append_runtime_log("ERROR", f"错误输出：{result.stderr[:500]}")
-        if result.stdout:
-            append_runtime_log("INFO", f"输出：{result.stdout[:500]}")
-    except subprocess.TimeoutExpired:
-        append_runtime_log("ERROR", "执行超时（超过 5 分钟）")
-        update_job_result(job_type, -1)
+        future = _JOB_POOL.submit(_run_builder, job_type, args, cancel)
+    except Exception:
+        with _jobs_lock:
+            _running.pop(job_type, None)
+        raise
+    try:
+        result = future.result(timeout=timeout_s)
+        rc = 0
+    except FuturesTimeout:
+        cancel.set()
+        error = f"执行超时（超过 {timeout_s:.0f} 秒），已请求取消"
+    except JobCancelled as e:
+        error = str(e)
+    except SystemExit as e:
+        # build() 的参数/环境校验沿用命令行的 SystemExit
+        rc = e.code if isinstance(e.code, int) and e.code else 1
+        error = str(e.code) if not isinstance(e.code, int) else f"退出码 {e.code}"
     except Exception as e:
-        append_runtime_log("ERROR", f"执行异常：{str(e)}")
-        update_job_result(job_type, -1)
+        logger.error(f"任务 {job_type} 异常: {e}", exc_info=True)
+        error = f"执行异常：{e}"
+    elapsed = round(time.monotonic() - t0, 2)
+    update_job_result(job_type, rc, _job_changes(result) if rc == 0 else None)
+
+    if rc == 0:
+        if job_type == "m3u":
+            m3u_filename = Path(cfg.get("output_m3u", "iptv.m3u")).name
+            out_path = OUT_DIR / m3u_filename
+            if out_path.exists():
+                update_file_status(
+                    "m3u",
+                    {
+                        "exists": True,
+                        "size": out_path.stat().st_size,
+                        "mtime": int(out_path.stat().st_mtime),
+                    },
+                )
+            aptv_name = Path(cfg.get("output_m3u_aptv") or "iptv-aptv.m3u").name
+            aptv_path = OUT_DIR / aptv_name
+            if aptv_path.exists():
+                update_file_status(
+                    "m3u_aptv",
+                    {
+                        "exists": True,
+                        "size": aptv_path.stat().st_size,
+                        "mtime": int(aptv_path.stat().st_mtime),
+                    },
+                )
+            append_runtime_log("OK", _summarize(job_type, result))
+            # 回放服务器地址直接取自本次 build() 的结果，不再重新拉一次频道列表
+            catchup = result.get("catchup") or {}
+            if catchup.get("host") and catchup.get("port"):
+                set_catchup_override(
+                    target_host=catchup["host"],
+                    target_port=catchup["port"],
+                    virtual_domain=catchup.get("virtual_domain"),
+                )
+                append_runtime_log(
+                    "INFO",
+                    f"内存已更新回放地址: {catchup['host']}:{catchup['port']}",
+                )
+        else:
+            epg_filename = Path(cfg.get("epg_out", "epg.xml")).name
+            out_path = OUT_DIR / epg_filename
+            if out_path.exists():
+                update_file_status(
+                    "epg",
+                    {
+                        "exists": True,
+                        "size": out_path.stat().st_size,
+                        "mtime": int(out_path.stat().st_mtime),
+                    },
+                )
+            append_runtime_log("OK", _summarize(job_type, result))
+    else:
+        append_runtime_log("ERROR", f"任务 {job_type} 失败：{error}")
 
     publish_status_mqtt()
     full_status = get_status()
@@ -282,4 +415,13 @@ def execute_job(
     elif job_type == "epg" and full_status.get("epg", {}).get("exists"):
         download_url = f"{web_base_url}/out/{Path(cfg.get('epg_out', 'epg.xml')).name}"
 
-    return {"ok": rc == 0, "status": full_status, "download_url": download_url}
+    out: Dict[str, Any] = {
+        "ok": rc == 0,
+        "status": full_status,
+        "download_url": download_url,
+        "result": result or None,
+        "elapsed_s": elapsed,
+    }
+    if error:
+        out["error"] = error
+    return out
@@ -319,7 +319,7 @@ def run_network_diag(cfg: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
             _check(
                 "udpxy",
                 running,
-                f"running={running} pid={st.get('pid')} iface={st.get('source_iface')}",
+                f"engine={st.get('engine', 'udpxy')} running={running} pid={st.get('pid')} iface={st.get('source_iface')}",
             )
         )
     except Exception as e:
@@ -7,7 +7,7 @@
 
 import logging
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, Dict, Optional
 
 from ..config import OUT_DIR
 from ..utils.network import get_local_iface_ip
@@ -34,6 +34,28 @@ def set_catchup_override(
     _catchup_override = cur
 
 
+def _gz_url(path: Path, url: str) -> Optional[str]:
+    """生成任务写出了不旧于原文件的 .gz 时，给出它的直链（部分播放器可直接填 .gz 地址）。"""
+    gz = path.with_name(path.name + ".gz")
+    try:
+        if gz.stat().st_mtime >= path.stat().st_mtime:
+            return url + ".gz"
+    except OSError:
+        pass
+    return None
+
+
+def _content_etag(path: Path) -> Optional[str]:
+    """生成时记录的内容哈希（与 /out 返回的 ETag 同源）；内容不变它就不变，比 mtime 更能说明是否真的更新了。"""
+    try:
+        from iptv_sever.backend.manifest import read_output_meta
+
+        meta = read_output_meta(str(path))
+    except Exception:
+        return None
+    return str(meta["sha256"])[:32] if meta else None
+
+
 def get_status() -> Dict[str, Any]:
     """实时检查文件状态和 UDPXY 服务状态。"""
     from ..runtime_status import get_runtime_status
@@ -51,6 +73,8 @@ def get_status() -> Dict[str, Any]:
             "size": m3u_path.stat().st_size,
             "mtime": int(m3u_path.stat().st_mtime),
             "download_url": f"{web_base_url}/out/{m3u_filename}",
+            "download_url_gz": _gz_url(m3u_path, f"{web_base_url}/out/{m3u_filename}"),
+            "etag": _content_etag(m3u_path),
         }
     else:
         st["m3u"] = {
@@ -58,6 +82,7 @@ def get_status() -> Dict[str, Any]:
             "size": 0,
             "mtime": 0,
             "download_url": None,
+            "etag": None,
         }
 
     aptv_filename = Path(cfg.get("output_m3u_aptv") or "iptv-aptv.m3u").name
@@ -68,6 +93,8 @@ def get_status() -> Dict[str, Any]:
             "size": aptv_path.stat().st_size,
             "mtime": int(aptv_path.stat().st_mtime),
             "download_url": f"{web_base_url}/out/{aptv_filename}",
+            "download_url_gz": _gz_url(aptv_path, f"{web_base_url}/out/{aptv_filename}"),
+            "etag": _content_etag(aptv_path),
         }
     else:
         st["m3u_aptv"] = {
@@ -75,6 +102,7 @@ def get_status() -> Dict[str, Any]:
             "size": 0,
             "mtime": 0,
             "download_url": None,
+            "etag": None,
         }
 
     epg_filename = Path(cfg.get("epg_out", "epg.xml")).name
@@ -85,6 +113,8 @@ def get_status() -> Dict[str, Any]:
             "size": epg_path.stat().st_size,
             "mtime": int(epg_path.stat().st_mtime),
             "download_url": f"{web_base_url}/out/{epg_filename}",
+            "download_url_gz": _gz_url(epg_path, f"{web_base_url}/out/{epg_filename}"),
+            "etag": _content_etag(epg_path),
         }
     else:
         st["epg"] = {
@@ -92,6 +122,7 @@ def get_status() -> Dict[str, Any]:
             "size": 0,
             "mtime": 0,
             "download_url": None,
+            "etag": None,
         }
 
     try:
@@ -112,6 +143,13 @@ def get_status() -> Dict[str, Any]:
             "available": False,
         }
 
+    try:
+        from ..routers.catchup import get_catchup_stats
+
+        st["catchup"] = get_catchup_stats()
+    except Exception as e:
+        logger.debug(f"获取回看统计失败: {e}")
+
     st["health"] = "online"
     return st
 
@@ -44,6 +44,7 @@ def get_udpxy_config() -> Dict[str, Any]:
     if cfg.get("source_iface"):
         udpxy["source_iface"] = cfg["source_iface"]
     udpxy.setdefault("enabled", True)
+    udpxy.setdefault("engine", "udpxy")
     udpxy.setdefault("port", 4022)
     udpxy.setdefault("bind_address", "0.0.0.0")
     udpxy.setdefault("backend_port", 14022)
@@ -51,6 +52,10 @@ def get_udpxy_config() -> Dict[str, Any]:
     udpxy.setdefault("source_iface", "eth1")
     udpxy.setdefault("max_connections", 5)
     udpxy.setdefault("buffer_size", "2Mb")
+    udpxy.setdefault("client_buffer", "1Mb")
+    udpxy.setdefault("splice", True)
+    udpxy.setdefault("burst_buffer", "2Mb")
+    udpxy.setdefault("keep_warm_s", 0)
     udpxy.setdefault("log_file", "/var/log/udpxy.log")
     udpxy.setdefault("pid_file", "/tmp/udpxy.pid")
     return udpxy
@@ -53,14 +53,37 @@ def default_yaml() -> Dict[str, Any]:
             "download_logos": True,
             "localize_logos": True,
             "logo_skip_existing": True,
+            # logo 并发下载：线程数 / 每个源站每秒请求上限 / 已有 logo 重新验证间隔（秒）
+            "logo_workers": 8,
+            "logo_rate_per_host": 20.0,
+            "logo_revalidate_s": 604800,
+            # logo 缩略图：""/none=不生成；png / webp（需要 Pillow），最长边像素
+            "logo_variant": "",
+            "logo_variant_size": 128,
+            # 生成时同时写出 .gz（装了 brotli 还有 .br），/out 按 Accept-Encoding 直接发送
+            "precompress": True,
         },
         "timeout_s": 10.0,
         "user_agent": "curl/8.0.0",
+        # M3U/EPG 任务在 API 进程内的工作线程上运行；超过该秒数请求取消
+        "job_timeout_s": 300,
+        # 频道列表快照在该秒数内复用（M3U/EPG 一轮生成只请求一次）；过期后做条件请求
+        "catalog_max_age_s": 120,
         "udpxy": {
             "enabled": True,
+            # udpxy = 外部 udpxy 进程；native = 进程内组播中继（每个频道只加入一次组播，多台电视共享）
+            "engine": "udpxy",
             "port": 4022,
             "bind_address": "0.0.0.0",
             "max_connections": 5,
+            # native 引擎：每个客户端的环形缓冲（慢客户端只丢自己最旧的数据）
+            "client_buffer": "1Mb",
+            # udpxy 引擎：HEAD 代理在 Linux 上用 splice 在内核里转发直播数据（不支持时自动退回普通循环）
+            "splice": True,
+            # native 引擎快速换台：每个频道保留从最近关键帧开始的数据（0 = 关闭）；
+            # keep_warm_s：最后一个客户端断开后继续收这个频道的秒数（0 = 立即退出组播）
+            "burst_buffer": "2Mb",
+            "keep_warm_s": 0,
             "log_file": "/var/log/udpxy.log",
             "pid_file": "/tmp/udpxy.pid",
         },
@@ -68,6 +91,31 @@ def default_yaml() -> Dict[str, Any]:
             "target_host": "10.255.129.26",
             "target_port": 6060,
             "virtual_domain": "hls.tvod_hls.zte.com",
+            # 上游 keep-alive 连接池
+            "pool_max_per_host": 8,
+            "pool_max_idle": 4,
+            "pool_idle_timeout_s": 30,
+            # 分片缓存（内存 LRU + 磁盘溢出）
+            "cache_enabled": True,
+            "cache_memory_mb": 64,
+            "cache_disk_mb": 256,
+            "cache_ttl_s": 600,
+            "cache_max_object_mb": 16,
+            # 分片预取（0 关闭）
+            "prefetch_segments": 0,
+            "prefetch_idle_s": 30,
+            # 主 m3u8 / 重定向目标缓存（0 关闭）
+            "playlist_cache_ttl_s": 30,
+            "redirect_cache_ttl_s": 300,
+            # 媒体短令牌（false 则用 ?u=base64）
+            "media_tokens": True,
+            "media_token_ttl_s": 21600,
+            # 上游并发限制（0 不限）
+            "limit_global": 16,
+            "limit_per_client": 4,
+            "limit_queue_timeout_s": 10,
+            "limit_max_queue": 64,
+            "limit_retry_after_s": 2,
         },
         "epg": {
             "base_url": "http://cms.99tv.com.cn:99/cms/liveVideoOtt_searchProgramList6p1.action",
@@ -75,6 +123,17 @@ def default_yaml() -> Dict[str, Any]:
             "time_ms": "",
             "days_forward": 7,
             "days_back": 0,
+            # 并发抓取：线程数 / 全局请求速率上限（次/秒，0=不限）/ 单频道失败重试次数
+            "workers": 8,
+            "rate_per_s": 20,
+            "retries": 2,
+            # 增量缓存：按 频道×日期 缓存节目单，只重新抓取过期的频道（今天之前的日期永不过期）
+            "cache": True,
+            "cache_hot_days": 1,
+            "cache_hot_ttl_s": 43200,
+            "cache_ttl_s": 86400,
+            # epg.xml 是否缩进换行（false = 紧凑输出，文件更小）
+            "pretty": True,
         },
         "scheduler": {
             "mode": "interval",
@@ -200,7 +259,15 @@ def flatten_runtime_config(raw: Optional[Dict[str, Any]] = None) -> Dict[str, An
         "download_logos": bool(out.get("download_logos", True)),
         "localize_logos": bool(out.get("localize_logos", True)),
         "logo_skip_existing": bool(out.get("logo_skip_existing", True)),
+        "logo_workers": int(out.get("logo_workers", 8)),
+        "logo_rate_per_host": float(out.get("logo_rate_per_host", 20.0)),
+        "logo_revalidate_s": float(out.get("logo_revalidate_s", 604800)),
+        "logo_variant": str(out.get("logo_variant") or ""),
+        "logo_variant_size": int(out.get("logo_variant_size", 128)),
+        "precompress": bool(out.get("precompress", True)),
         "timeout_s": float(raw.get("timeout_s", 10.0)),
+        "job_timeout_s": float(raw.get("job_timeout_s", 300)),
+        "catalog_max_age_s": float(raw.get("catalog_max_age_s", 120)),
         "user_agent": raw.get("user_agent") or "curl/8.0.0",
         "use_udpxy": True,
         "udpxy": udpxy,
@@ -210,6 +277,14 @@ def flatten_runtime_config(raw: Optional[Dict[str, Any]] = None) -> Dict[str, An
         "epg_time_ms": str(epg.get("time_ms", "")),
         "epg_days_forward": int(epg.get("days_forward", 7)),
         "epg_days_back": int(epg.get("days_back", 0)),
+        "epg_workers": int(epg.get("workers", 8)),
+        "epg_rate_per_s": float(epg.get("rate_per_s", 20)),
+        "epg_retries": int(epg.get("retries", 2)),
+        "epg_cache": bool(epg.get("cache", True)),
+        "epg_cache_hot_days": int(epg.get("cache_hot_days", 1)),
+        "epg_cache_hot_ttl_s": float(epg.get("cache_hot_ttl_s", 43200)),
+        "epg_cache_ttl_s": float(epg.get("cache_ttl_s", 86400)),
+        "epg_pretty": bool(epg.get("pretty", True)),
         "scheduler_mode": sched.get("mode", "interval"),
         "scheduler_interval_hours": int(sched.get("interval_hours", 6)),
         "scheduler_interval_minutes": int(sched.get("interval_minutes", 0)),
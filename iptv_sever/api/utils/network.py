@@ -564,9 +564,14 @@ def get_local_iface_ip(cfg: Dict[str, Any]) -> Optional[str]:
         return None
     
     try:
-        ip = get_interface_ip(local_iface)
+        # 回看每次改写 m3u8 都会走到这里：只用带缓存的 ioctl 查询（没有 IPv4 的结果也缓存），
+        # 不再退回 get_interface_ip()，避免每个请求在事件循环上 fork `ip`；
+        # ioctl 不可用时 get_ipv4_from_iface_cached() 自己会退回 `ip`
+        from iptv_sever.backend.net import get_ipv4_from_iface_cached
+
+        ip = get_ipv4_from_iface_cached(local_iface)
         if ip:
-            logger.info(f"从 local_iface ({local_iface}) 获取到 IP 地址: {ip}")
+            logger.debug(f"从 local_iface ({local_iface}) 获取到 IP 地址: {ip}")
             return ip
         else:
             logger.warning(f"从 local_iface ({local_iface}) 获取 IP 地址失败")
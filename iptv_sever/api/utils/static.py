@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+静态文件：按 Accept-Encoding 发预压缩兄弟文件 + 内容哈希强 ETag（/out）
+"""
+
+import mimetypes
+import os
+from typing import Optional, Set
+
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse
+
+from iptv_sever.backend.manifest import read_output_meta, strong_etag
+
+# 优先级从高到低
+_ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+# logos/sha/ 下是按内容哈希命名的文件：内容变了文件名就变，可以长期缓存
+_IMMUTABLE_DIR = os.path.join("logos", "sha") + os.sep
+_IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+
+
+def _accepted_encodings(value: str) -> Set[str]:
+    """解析 Accept-Encoding，返回可接受的编码（忽略 q=0）。"""
+    out: Set[str] = set()
+    for part in (value or "").split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        for p in params.split(";"):
+            k, _, v = p.strip().partition("=")
+            if k.strip().lower() == "q":
+                try:
+                    q = float(v)
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            out.add(token)
+    if "*" in out:
+        out.update(enc for enc, _ in _ENCODINGS)
+    return out
+
+
+def _fresh_sibling(path: str, src_mtime: float) -> Optional[os.stat_result]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    # 兄弟文件比原文件旧：说明原文件已更新而压缩失败/未做，不能再发
+    if st.st_mtime < src_mtime:
+        return None
+    return st
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """
+    作用：
+    - StaticFiles 的子类：请求 a.xml 且客户端接受 br/gzip 时，若同目录有不旧于原文件的
+      a.xml.br / a.xml.gz，直接发送它（Content-Encoding + 原文件的 Content-Type + Vary）。
+    - 生成任务记录过内容哈希（.meta/）的文件用强 ETag + Cache-Control: no-cache，
+      播放器带 If-None-Match / If-Modified-Since 刷新时内容没变就回 304。
+    - 直接请求 a.xml.gz 仍按普通文件下载。
+    - logos/sha/ 下的内容寻址 logo 发 Cache-Control: immutable，播放器不再反复验证。
+    """
+
+    def _file(
+        self,
+        path: str,
+        st: os.stat_result,
+        request_headers: Headers,
+        status_code: int,
+        etag: str = "",
+        **kw,
+    ) -> Response:
+        response = FileResponse(path, status_code=status_code, stat_result=st, **kw)
+        if etag:
+            response.headers["etag"] = etag
+            response.headers["cache-control"] = "no-cache"
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200) -> Response:
+        path = str(full_path)
+        request_headers = Headers(scope=scope)
+        if path.endswith((".gz", ".br")):
+            # mimetypes 会把 epg.xml.gz 猜成 application/xml，浏览器/播放器会当明文处理
+            media_type = "application/gzip" if path.endswith(".gz") else "application/octet-stream"
+            return self._file(path, stat_result, request_headers, status_code, media_type=media_type)
+
+        if _IMMUTABLE_DIR in path:
+            response = self._file(path, stat_result, request_headers, status_code)
+            response.headers["cache-control"] = _IMMUTABLE_CACHE
+            return response
+
+        meta = read_output_meta(path, stat_result)
+        accepted = _accepted_encodings(request_headers.get("accept-encoding", ""))
+        vary = {}
+        for encoding, ext in _ENCODINGS:
+            st = _fresh_sibling(path + ext, stat_result.st_mtime)
+            if st is None:
+                continue
+            vary = {"Vary": "Accept-Encoding"}
+            if encoding not in accepted:
+                continue
+            return self._file(
+                path + ext,
+                st,
+                request_headers,
+                status_code,
+                etag=strong_etag(meta, encoding) if meta else "",
+                media_type=mimetypes.guess_type(path)[0] or "text/plain",
+                headers={"Content-Encoding": encoding, **vary},
+            )
+
+        return self._file(
+            path,
+            stat_result,
+            request_headers,
+            status_code,
+            etag=strong_etag(meta) if meta else "",
+            headers=vary or None,
+        )
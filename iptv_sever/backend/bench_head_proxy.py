@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+微基准：:4022 HEAD 代理的转发开销
+
+假 udpxy 后端（独立进程，持续发 MPEG-TS 大小的数据）→ UdpxyHeadProxy（独立进程）→ 本进程客户端。
+分别用 read/write 循环和 splice 跑一遍，统计代理进程自身的 CPU 时间，
+输出吞吐与“每 100 Mbit/s 占多少单核 CPU”。
+
+用法示例：
+python3 iptv_sever/backend/bench_head_proxy.py --mb 512
+python3 iptv_sever/backend/bench_head_proxy.py --mb 64 --rate-mbps 80   # 模拟 8 路 10 Mbit/s 高清
+"""
+
+from __future__ import annotations
+
+import argparse
+import multiprocessing as mp
+import os
+import socket
+import sys
+import time
+from typing import Dict, Optional
+
+# 允许直接跑脚本文件（与 build_m3u.py 相同的自举）
+if __package__ in (None, ""):
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    repo_root = os.path.dirname(os.path.dirname(script_dir))
+    if repo_root not in sys.path:
+        sys.path.insert(0, repo_root)
+
+from iptv_sever.backend.udpxy_head_proxy import SPLICE_SUPPORTED, UdpxyHeadProxy
+
+_TS_BLOCK = (b"\x47" + b"\x00" * 187) * 348  # 约 64KB，188 字节对齐
+
+
+def _backend_main(port_q, rate_mbps: float) -> None:
+    srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    srv.bind(("127.0.0.1", 0))
+    srv.listen(8)
+    port_q.put(srv.getsockname()[1])
+    while True:
+        conn, _ = srv.accept()
+        try:
+            conn.recv(65536)
+            conn.sendall(b"HTTP/1.1 200 OK\r\nContent-Type: application/octet-stream\r\n\r\n")
+            t0 = time.monotonic()
+            sent = 0
+            while True:
+                conn.sendall(_TS_BLOCK)
+                sent += len(_TS_BLOCK)
+                if rate_mbps > 0:
+                    ahead = sent * 8 / (rate_mbps * 1e6) - (time.monotonic() - t0)
+                    if ahead > 0:
+                        time.sleep(ahead)
+        except OSError:
+            pass
+        finally:
+            conn.close()
+
+
+def _proxy_main(backend_port: int, splice: bool, port_q, stop_ev, cpu_q) -> None:
+    proxy = UdpxyHeadProxy()
+    ok, msg = proxy.start("127.0.0.1", 0, "127.0.0.1", backend_port, splice=splice)
+    if not ok:
+        port_q.put(-1)
+        return
+    cpu0 = time.process_time()
+    port_q.put(proxy.listen_port)
+    stop_ev.wait()
+    cpu_q.put(time.process_time() - cpu0)
+    proxy.stop()
+
+
+def run_once(backend_port: int, splice: bool, total_bytes: int) -> Optional[Dict[str, float]]:
+    port_q, cpu_q = mp.Queue(), mp.Queue()
+    stop_ev = mp.Event()
+    p = mp.Process(target=_proxy_main, args=(backend_port, splice, port_q, stop_ev, cpu_q), daemon=True)
+    p.start()
+    port = port_q.get(timeout=10)
+    if port < 0:
+        p.terminate()
+        return None
+
+    s = socket.create_connection(("127.0.0.1", port))
+    s.sendall(b"GET /rtp/239.1.1.1:5140 HTTP/1.1\r\nHost: bench\r\n\r\n")
+    buf = bytearray(256 * 1024)
+    got = 0
+    t0 = time.perf_counter()
+    while got < total_bytes:
+        n = s.recv_into(buf)
+        if not n:
+            break
+        got += n
+    wall = time.perf_counter() - t0
+    s.close()
+    stop_ev.set()
+    cpu = cpu_q.get(timeout=10)
+    p.join(timeout=5)
+    mbps = got * 8 / wall / 1e6
+    return {"bytes": got, "wall": wall, "cpu": cpu, "mbps": mbps, "cpu_pct": cpu / wall * 100}
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="HEAD 代理转发 CPU 开销：read/write 循环 vs splice")
+    ap.add_argument("--mb", type=int, default=256, help="每种实现传输的数据量（MB）")
+    ap.add_argument("--rate-mbps", type=float, default=0.0, help="后端发送速率上限 Mbit/s（0=尽快发送）")
+    args = ap.parse_args(argv)
+
+    port_q = mp.Queue()
+    backend = mp.Process(target=_backend_main, args=(port_q, args.rate_mbps), daemon=True)
+    backend.start()
+    backend_port = port_q.get(timeout=10)
+
+    rows = [("read/write 循环", False)]
+    if SPLICE_SUPPORTED:
+        rows.append(("splice", True))
+    else:
+        print("（当前平台没有 os.splice，只测普通循环）", file=sys.stderr)
+
+    total = args.mb * 1024 * 1024
+    rate = f"{args.rate_mbps:g} Mbit/s" if args.rate_mbps > 0 else "不限速"
+    print(f"数据量={args.mb} MB 后端速率={rate}")
+    try:
+        for name, splice in rows:
+            r = run_once(backend_port, splice, total)
+            if r is None:
+                print(f"  {name:<18} 启动失败", file=sys.stderr)
+                return 1
+            per100 = r["cpu_pct"] / (r["mbps"] / 100) if r["mbps"] else 0.0
+            print(
+                f"  {name:<18} {r['mbps']:9.1f} Mbit/s  代理 CPU {r['cpu']:6.2f}s ({r['cpu_pct']:5.1f}%)"
+                f"  每 100 Mbit/s ≈ {per100:5.2f}% 单核"
+            )
+    finally:
+        backend.terminate()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+微基准：回看 m3u8 改写
+
+对比旧实现（整段 decode → splitlines → 每行 urljoin/正则闭包 → join → encode）
+与 catchup_proxy.M3U8Rewriter（按字节单遍改写，可边收边改）。
+
+用法示例：
+python3 iptv_sever/backend/bench_m3u8_rewrite.py --segments 5000 --repeat 20
+"""
+
+from __future__ import annotations
+
+import argparse
+import base64
+import os
+import re
+import sys
+import time
+from urllib.parse import urljoin
+
+# 允许直接跑脚本文件（与 build_m3u.py 相同的自举）
+if __package__ in (None, ""):
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    repo_root = os.path.dirname(os.path.dirname(script_dir))
+    if repo_root not in sys.path:
+        sys.path.insert(0, repo_root)
+
+from iptv_sever.backend.catchup_proxy import (
+    M3U8Rewriter,
+    MediaTokenTable,
+    rewrite_m3u8_to_proxy,
+)
+
+PLAYLIST_URL = (
+    "http://10.255.129.26:6060/hls.tvod_hls.zte.com/ZTE_EPG16/2/9201/index.m3u8"
+    "?programbegin=20250101040000%2B00&programend=20250101070000%2B00&AuthInfo=abcdef0123456789"
+)
+PROXY_BASE = "http://192.168.1.250:8088/catchup/media"
+
+
+# ---------- 旧实现（仅作对照） ----------
+
+_LEGACY_URI_RE = re.compile(r'URI="([^"]+)"', re.IGNORECASE)
+
+
+def _legacy_token(url: str) -> str:
+    return base64.urlsafe_b64encode(url.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def legacy_rewrite(content: bytes, *, playlist_url: str, proxy_base: str) -> bytes:
+    try:
+        text = content.decode("utf-8")
+    except UnicodeDecodeError:
+        text = content.decode("utf-8", errors="replace")
+
+    base = proxy_base.rstrip("/")
+    out_lines = []
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not stripped:
+            out_lines.append(line)
+            continue
+
+        if stripped.startswith("#"):
+            def _repl(m: re.Match) -> str:
+                raw = m.group(1)
+                abs_url = urljoin(playlist_url, raw)
+                if abs_url.startswith("http://") or abs_url.startswith("https://"):
+                    return f'URI="{base}?u={_legacy_token(abs_url)}"'
+                return m.group(0)
+
+            out_lines.append(_LEGACY_URI_RE.sub(_repl, line))
+            continue
+
+        abs_url = urljoin(playlist_url, stripped)
+        if abs_url.startswith("http://") or abs_url.startswith("https://"):
+            out_lines.append(f"{base}?u={_legacy_token(abs_url)}")
+        else:
+            out_lines.append(line)
+
+    return ("\r\n".join(out_lines) + "\r\n").encode("utf-8")
+
+
+# ---------- 数据与计时 ----------
+
+
+def make_playlist(segments: int) -> bytes:
+    lines = [
+        "#EXTM3U",
+        "#EXT-X-VERSION:3",
+        "#EXT-X-TARGETDURATION:10",
+        "#EXT-X-MEDIA-SEQUENCE:0",
+        '#EXT-X-KEY:METHOD=AES-128,URI="key.bin?kid=1"',
+    ]
+    for i in range(segments):
+        lines.append("#EXTINF:10.000,")
+        lines.append(
+            f"20250101040000_{i:06d}.ts?AuthInfo=abcdef0123456789&usergroup=g1&vbegin={i * 10}"
+        )
+    lines.append("#EXT-X-ENDLIST")
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def _bench(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="回看 m3u8 改写微基准")
+    ap.add_argument("--segments", type=int, default=5000, help="合成播放列表的分片数")
+    ap.add_argument("--repeat", type=int, default=20, help="每种实现重复次数（取最快一次）")
+    ap.add_argument("--chunk", type=int, default=16 * 1024, help="流式改写时每次 feed 的字节数")
+    args = ap.parse_args(argv)
+
+    content = make_playlist(args.segments)
+    kw = {"playlist_url": PLAYLIST_URL, "proxy_base": PROXY_BASE}
+
+    old = legacy_rewrite(content, **kw)
+    new = rewrite_m3u8_to_proxy(content, **kw)
+    if old != new:
+        print("❌ 新旧实现输出不一致", file=sys.stderr)
+        return 1
+
+    def streamed():
+        rw = M3U8Rewriter(tokens=tokens, **kw)
+        parts = [rw.feed(content[i : i + args.chunk]) for i in range(0, len(content), args.chunk)]
+        parts.append(rw.finish())
+        return b"".join(parts)
+
+    tokens = MediaTokenTable()
+    token_out = rewrite_m3u8_to_proxy(content, tokens=tokens, **kw)
+    if streamed() != token_out:
+        print("❌ 流式改写与整段改写输出不一致", file=sys.stderr)
+        return 1
+
+    rows = [
+        ("旧实现 (?u=)", lambda: legacy_rewrite(content, **kw), old),
+        ("新实现 (?u=)", lambda: rewrite_m3u8_to_proxy(content, **kw), new),
+        ("新实现 (令牌)", lambda: rewrite_m3u8_to_proxy(content, tokens=tokens, **kw), token_out),
+        (f"新实现 (令牌, 每 {args.chunk} 字节 feed)", streamed, token_out),
+    ]
+    base_ms = None
+    print(f"分片数={args.segments} 输入={len(content)} 字节 重复={args.repeat}")
+    for name, fn, out in rows:
+        ms = _bench(fn, args.repeat)
+        base_ms = base_ms or ms
+        print(f"  {name:<32} {ms:8.2f} ms  x{base_ms / ms:5.2f}  输出={len(out)} 字节")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+微基准：M3U 多 style 生成
+
+对比旧流程（udpxy 转换复制一遍 Channel → 每个 style 再 with_catchup_style() 复制一遍
+→ generate_m3u_text() 拼整份行列表 → write_text()）与 core.write_m3u_files()（单遍、边算边写）。
+输出耗时与 tracemalloc 峰值内存，并校验两者写出的文件逐字节一致。
+
+用法示例：
+python3 iptv_sever/backend/bench_m3u_pipeline.py --channels 2000 --repeat 10
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Dict, List
+
+# 允许直接跑脚本文件（与 build_m3u.py 相同的自举）
+if __package__ in (None, ""):
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    repo_root = os.path.dirname(os.path.dirname(script_dir))
+    if repo_root not in sys.path:
+        sys.path.insert(0, repo_root)
+
+from iptv_sever.backend.core import (
+    Channel,
+    convert_multicast_to_udpxy,
+    generate_m3u_text,
+    with_catchup_style,
+    write_m3u_files,
+    write_text,
+)
+
+WEB_BASE = "http://192.168.1.250:8088"
+UDPXY_BASE = "http://192.168.1.250:4022"
+X_TVG_URL = "http://192.168.1.250:8088/out/epg.xml"
+
+
+def make_channels(n: int) -> List[Channel]:
+    return [
+        Channel(
+            name=f"频道-{i}",
+            group=("央视", "卫视", "本地", "数字")[i % 4],
+            tvg_id=str(100000 + i),
+            tvg_name=f"频道-{i}",
+            tvg_logo=f"{WEB_BASE}/out/logos/{100000 + i}.png",
+            chno=str(i + 1),
+            stream_url=f"rtp://239.33.{i // 250}.{i % 250}:5140",
+            catchup_path=f"PLTV/88888888/224/3221{i:06d}/index.m3u8?fmt=ts2hls",
+        )
+        for i in range(n)
+    ]
+
+
+# ---------- 旧流程（仅作对照） ----------
+
+
+def legacy_write(channels: List[Channel], outputs: Dict[str, str]) -> None:
+    channels = [
+        Channel(
+            name=ch.name,
+            group=ch.group,
+            tvg_id=ch.tvg_id,
+            tvg_name=ch.tvg_name,
+            tvg_logo=ch.tvg_logo,
+            chno=ch.chno,
+            stream_url=convert_multicast_to_udpxy(ch.stream_url, UDPXY_BASE),
+            catchup_source=ch.catchup_source,
+            catchup_path=ch.catchup_path,
+        )
+        for ch in channels
+    ]
+    for style, path in outputs.items():
+        styled = with_catchup_style(channels, WEB_BASE, style=style)
+        write_text(path, generate_m3u_text(styled, x_tvg_url=X_TVG_URL))
+
+
+def pipeline_write(channels: List[Channel], outputs: Dict[str, str]) -> None:
+    write_m3u_files(channels, outputs, web_base_url=WEB_BASE, x_tvg_url=X_TVG_URL, udpxy_base=UDPXY_BASE)
+
+
+# ---------- 计时 ----------
+
+
+def _bench(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000
+
+
+def _peak_kib(fn) -> float:
+    tracemalloc.start()
+    try:
+        fn()
+        _cur, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / 1024
+
+
+def _read(paths: Dict[str, str]) -> List[bytes]:
+    out = []
+    for p in paths.values():
+        with open(p, "rb") as f:
+            out.append(f.read())
+    return out
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="M3U 多 style 生成微基准")
+    ap.add_argument("--channels", type=int, default=2000, help="合成频道数")
+    ap.add_argument("--repeat", type=int, default=10, help="每种实现重复次数（取最快一次）")
+    args = ap.parse_args(argv)
+
+    channels = make_channels(args.channels)
+    with tempfile.TemporaryDirectory() as d:
+        old_out = {"tivimate": os.path.join(d, "old.m3u"), "aptv": os.path.join(d, "old-aptv.m3u")}
+        new_out = {"tivimate": os.path.join(d, "new.m3u"), "aptv": os.path.join(d, "new-aptv.m3u")}
+
+        legacy_write(channels, old_out)
+        pipeline_write(channels, new_out)
+        if _read(old_out) != _read(new_out):
+            print("❌ 新旧实现输出不一致", file=sys.stderr)
+            return 1
+
+        rows = [
+            ("旧流程 (复制 Channel + 整份拼接)", lambda: legacy_write(channels, old_out)),
+            ("单遍流水线 (write_m3u_files)", lambda: pipeline_write(channels, new_out)),
+        ]
+        size = sum(len(b) for b in _read(new_out))
+        print(f"频道数={args.channels} style=tivimate+aptv 输出={size} 字节 重复={args.repeat}")
+        base_ms = None
+        for name, fn in rows:
+            ms = _bench(fn, args.repeat)
+            peak = _peak_kib(fn)
+            base_ms = base_ms or ms
+            print(f"  {name:<34} {ms:8.2f} ms  x{base_ms / ms:5.2f}  峰值内存={peak:9.1f} KiB")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
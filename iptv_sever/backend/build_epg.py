@@ -11,8 +11,11 @@ python3 /www/iptv_sever/build_epg.py
 from __future__ import annotations
 
 import argparse
+import datetime as dt
 import os
 import sys
+import threading
+from typing import Any, Dict, List, Optional
 
 # 允许直接跑脚本文件：把 iptv_sever 的父目录加入 sys.path
 if __package__ in (None, ""):
@@ -25,14 +28,23 @@ if __package__ in (None, ""):
         sys.path.insert(0, repo_root)
 
 from iptv_sever.backend.conf import (
+    DEFAULT_CATALOG_CACHE_DIR,
+    DEFAULT_CATALOG_MAX_AGE_S,
     DEFAULT_CHANNEL_LIST_SOURCE,
     DEFAULT_EPG_BASE_URL,
+    DEFAULT_EPG_CACHE_DIR,
+    DEFAULT_EPG_CACHE_HOT_DAYS,
+    DEFAULT_EPG_CACHE_HOT_TTL_S,
+    DEFAULT_EPG_CACHE_TTL_S,
     DEFAULT_EPG_EXTRA_PARAMS,
     DEFAULT_EPG_OUT,
     DEFAULT_EPG_RIDDLE,
     DEFAULT_EPG_TIME_MS,
     DEFAULT_EPG_DAYS_BACK,
     DEFAULT_EPG_DAYS_FORWARD,
+    DEFAULT_EPG_RATE_PER_S,
+    DEFAULT_EPG_RETRIES,
+    DEFAULT_EPG_WORKERS,
     DEFAULT_HTTP_TIMEOUT_S,
     DEFAULT_LOGO_DIR,
     DEFAULT_SOURCE_IFACE,
@@ -40,9 +52,13 @@ from iptv_sever.backend.conf import (
     DEFAULT_WEB_BASE_URL,
     EPGSettings,
 )
-from iptv_sever.backend.core import load_channel_categories
-from iptv_sever.backend.epg import build_xmltv, extract_epg_channels, filter_epg_by_days, indent, parse_query_params, run_epg
-from iptv_sever.backend.net import build_opener, get_ipv4_from_iface, is_url
+from iptv_sever.backend.cancel import raise_if_cancelled
+from iptv_sever.backend.compress import precompress, remove_precompressed
+from iptv_sever.backend.catalog import get_catalog
+from iptv_sever.backend.epg import TZ_CN, filter_epg_by_days, parse_query_params, run_epg, write_xmltv
+from iptv_sever.backend.epg_cache import EPGCache
+from iptv_sever.backend.manifest import diff_index, read_output_meta
+from iptv_sever.backend.net import build_opener, get_ipv4_from_iface_cached, is_url
 
 
 def parse_args(argv: list[str]) -> argparse.Namespace:
@@ -65,12 +81,34 @@ def parse_args(argv: list[str]) -> argparse.Namespace:
     ap.add_argument("--time", dest="time_ms", default=DEFAULT_EPG_TIME_MS, help="time（毫秒字符串，抓包参数）")
     ap.add_argument("--extra-params", default=DEFAULT_EPG_EXTRA_PARAMS, help="固定 POST 参数（querystring）")
     ap.add_argument("--timeout", type=float, default=8.0, help="单次请求超时秒数")
-    ap.add_argument("--sleep", type=float, default=0.05, help="每个频道请求间隔秒数")
+    ap.add_argument("--sleep", type=float, default=0.05, help="每个频道请求间隔秒数（旧参数；未指定 --rate 时按 1/sleep 折算速率）")
+    ap.add_argument("--workers", type=int, default=DEFAULT_EPG_WORKERS, help="并发抓取线程数（1=串行）")
+    ap.add_argument("--rate", type=float, default=None, help=f"全局请求速率上限 次/秒（0=不限速，默认 {DEFAULT_EPG_RATE_PER_S:g}）")
+    ap.add_argument("--retries", type=int, default=DEFAULT_EPG_RETRIES, help="单频道失败重试次数")
     ap.add_argument("--max-channels", type=int, default=0, help="限制处理频道数（0=不限制）")
     ap.add_argument("--ua", default=DEFAULT_USER_AGENT, help="User-Agent")
+    ap.add_argument("--cache-dir", default=DEFAULT_EPG_CACHE_DIR, help="EPG 增量缓存目录（空=不启用，每次全量抓取）")
+    ap.add_argument("--cache-hot-days", type=int, default=DEFAULT_EPG_CACHE_HOT_DAYS, help="今天之后多少天按近期 TTL 刷新")
+    ap.add_argument("--cache-hot-ttl", type=float, default=DEFAULT_EPG_CACHE_HOT_TTL_S, help="今天/近期日期缓存有效秒数")
+    ap.add_argument("--cache-ttl", type=float, default=DEFAULT_EPG_CACHE_TTL_S, help="更远日期缓存有效秒数")
     ap.add_argument("--days-forward", type=int, default=DEFAULT_EPG_DAYS_FORWARD, help="向后预告天数（包含今天）")
+    ap.add_argument("--no-pretty", dest="pretty", action="store_false", help="输出紧凑 XML（不缩进换行，文件更小）")
+    ap.add_argument(
+        "--precompress",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="同时写出 epg.xml.gz（装了 brotli 时还有 .br），供 /out 按 Accept-Encoding 直接发送",
+    )
     ap.add_argument("--days-back", type=int, default=DEFAULT_EPG_DAYS_BACK, help="向前回看天数（包含今天）")
 
+    ap.add_argument("--catalog-cache-dir", default=DEFAULT_CATALOG_CACHE_DIR, help="频道目录快照目录（空=只缓存在内存）")
+    ap.add_argument(
+        "--catalog-max-age",
+        type=float,
+        default=DEFAULT_CATALOG_MAX_AGE_S,
+        help="频道目录快照免请求复用秒数（0=每次都发条件请求）",
+    )
+
     # 必须绑定网卡
     ap.add_argument("--source-iface", default=DEFAULT_SOURCE_IFACE, help="用于拉取频道/EPG 的网卡名（必需）")
 
@@ -80,16 +118,63 @@ def parse_args(argv: list[str]) -> argparse.Namespace:
     return ap.parse_args(argv)
 
 
-def main(argv: list[str]) -> int:
+def _resolve_rate(args: argparse.Namespace) -> float:
+    """
+    作用：
+    - 确定 EPG 请求速率：显式 --rate 优先；只改了 --sleep 时沿用旧语义折算为 1/sleep。
+    """
+
+    if args.rate is not None:
+        return max(0.0, float(args.rate))
+    if float(args.sleep) != 0.05:
+        return (1.0 / float(args.sleep)) if args.sleep > 0 else 0.0
+    return DEFAULT_EPG_RATE_PER_S
+
+def _programme_diff(
+    before: Optional[Dict[str, Any]],
+    after: Optional[Dict[str, Any]],
+    channels: List[Dict[str, str]],
+) -> Dict[str, Any]:
+    """
+    作用：
+    - 由前后两次 .meta 记录里的每频道节目摘要得到变化摘要。
+
+    输出：
+    - Dict: baseline/total/added/removed/channels_changed（频道数）+ programmes/programmes_delta
+      + examples（频道名示例）
+    """
+
+    new = (after or {}).get("index") or {}
+    old = (before or {}).get("index")
+    d = diff_index(old, new)
+    keys = d.pop("keys")
+    d["channels_changed"] = d.pop("changed")
+    d["programmes"] = int((after or {}).get("programmes") or 0)
+    if old is not None:
+        d["programmes_delta"] = d["programmes"] - int((before or {}).get("programmes") or 0)
+    if keys:
+        names = {ch["id"]: str(ch.get("name") or ch["id"]) for ch in channels}
+        d["examples"] = {
+            "added": [names.get(cid, cid) for cid in keys["added"]],
+            "removed": [names.get(cid, cid) for cid in keys["removed"]],
+            "channels_changed": [names.get(cid, cid) for cid in keys["changed"]],
+        }
+    return d
+
+
+def build(argv: list[str], *, cancel: Optional[threading.Event] = None) -> Dict[str, Any]:
     """
     作用：
     - 串联 net/core/epg 生成 epg.xml。
+      命令行 main() 和 API 进程内任务引擎共用这一个入口（参数同为命令行形式）。
 
     输入：
     - argv: 参数列表
+    - cancel: 取消事件（进程内运行时由任务引擎传入；抓取过程中和阶段之间检查）
 
     输出：
-    - int: 退出码
+    - Dict: 结构化结果（channels/programmes/fetch/cache/out）
+      参数非法时抛 SystemExit（与命令行行为一致），被取消时抛 JobCancelled
     """
 
     args = parse_args(argv)
@@ -113,9 +198,17 @@ def main(argv: list[str]) -> int:
         timeout_s=float(args.timeout),
         sleep_s=float(args.sleep),
         max_channels=int(args.max_channels),
+        workers=int(args.workers),
+        rate_per_s=_resolve_rate(args),
+        retries=int(args.retries),
+        cache_dir=str(args.cache_dir or ""),
+        cache_hot_days=int(args.cache_hot_days),
+        cache_hot_ttl_s=float(args.cache_hot_ttl),
+        cache_ttl_s=float(args.cache_ttl),
         user_agent=str(args.ua),
         days_forward=int(args.days_forward),
         days_back=int(args.days_back),
+        pretty=bool(args.pretty),
         web_base_url=str(args.web_base_url),
         logo_dir=str(args.logo_dir),
     )
@@ -127,28 +220,45 @@ def main(argv: list[str]) -> int:
 
     if not (settings.source_iface or "").strip():
         raise SystemExit("--source-iface 不能为空（必须指定用于拉取频道/EPG 的网卡）")
-    bind_ip = get_ipv4_from_iface(settings.source_iface)
+    bind_ip = get_ipv4_from_iface_cached(settings.source_iface)
     if not bind_ip:
         raise SystemExit(f"无法从网卡 {settings.source_iface!r} 获取 IPv4（请确认接口 up 且 DHCP 正常）")
 
     opener = build_opener(bind_ip)
 
-    # 拉取频道列表（同样走绑定网卡）
-    cats = load_channel_categories(
+    # 频道列表取自共享快照（同样走绑定网卡；M3U 刚拉过时不再请求）
+    catalog = get_catalog(str(args.catalog_cache_dir))
+    snapshot = catalog.load(
         settings.channels_url,
         opener=opener,
         timeout_s=DEFAULT_HTTP_TIMEOUT_S,
         user_agent=settings.user_agent,
+        max_age_s=float(args.catalog_max_age),
     )
-    channels = extract_epg_channels(cats)
+    channels = snapshot.epg_channels()
+    catalog.save()
 
     extra_params = parse_query_params(settings.extra_params_qs)
     # 用当前出口 IP 覆盖 ip（避免写死）
     if bind_ip:
         extra_params["ip"] = bind_ip
 
-    epg_by_channel, stats = run_epg(
-        channels=channels,
+    cache = None
+    fetch_list = channels
+    if settings.cache_dir:
+        cache = EPGCache(
+            settings.cache_dir,
+            hot_days=settings.cache_hot_days,
+            hot_ttl_s=settings.cache_hot_ttl_s,
+            ttl_s=settings.cache_ttl_s,
+            keep_days=max(settings.days_back, 1),
+        )
+        today = dt.datetime.now(tz=TZ_CN).date()
+        stale = set(cache.select_stale((ch["id"] for ch in channels), today=today, days_forward=settings.days_forward))
+        fetch_list = [ch for ch in channels if ch["id"] in stale]
+
+    fetched, stats = run_epg(
+        channels=fetch_list,
         base_url=settings.base_url,
         riddle=settings.riddle,
         time_ms=settings.time_ms,
@@ -158,31 +268,96 @@ def main(argv: list[str]) -> int:
         opener=opener,
         sleep_s=settings.sleep_s,
         max_channels=settings.max_channels,
+        workers=settings.workers,
+        rate_per_s=settings.rate_per_s,
+        retries=settings.retries,
+        cancel=cancel,
     )
+    raise_if_cancelled(cancel, "EPG 抓取")
+
+    if cache is not None:
+        for cid, data in fetched.items():
+            cache.update(cid, data)
+        cache.prune(today=today, keep_channels=(ch["id"] for ch in channels))
+        cache.save()
+        # 本次没抓（缓存仍新鲜）或抓取失败的频道，都从缓存补齐
+        epg_by_channel = {ch["id"]: fetched.get(ch["id"], {}) for ch in channels}
+    else:
+        epg_by_channel = fetched
 
     # 按日期范围过滤（你要的“几天预告”就在这里控制）
     epg_by_channel = filter_epg_by_days(
         epg_by_channel,
         days_back=settings.days_back,
         days_forward=settings.days_forward,
+        cache=cache,
     )
 
-    tree = build_xmltv(
+    # 流式写出（临时文件 + 原子 rename；内容没变则不重写），不在内存里构建整棵 XML 树
+    before = read_output_meta(settings.out_path)
+    programmes = write_xmltv(
         channels=channels,
         epg_by_channel=epg_by_channel,
         out_path=settings.out_path,
         logo_dir=settings.logo_dir,
         web_base_url=settings.web_base_url,
+        pretty=settings.pretty,
     )
-    indent(tree.getroot())
+    after = read_output_meta(settings.out_path)
+    changed = not (before and after and before.get("sha256") == after.get("sha256"))
+    if args.precompress:
+        if changed or not os.path.exists(f"{settings.out_path}.gz"):
+            precompress(settings.out_path)
+    else:
+        remove_precompressed(settings.out_path)
+
+    return {
+        "channels": len(channels),
+        "programmes": programmes,
+        "fetch": stats,
+        "cache": dict(cache.stats) if cache is not None else None,
+        "days_back": settings.days_back,
+        "days_forward": settings.days_forward,
+        "out": settings.out_path,
+        "changed": changed,
+        "diff": _programme_diff(before, after, channels),
+        "catalog": {"sha256": snapshot.sha256[:16], **catalog.stats},
+    }
+
+
+def main(argv: list[str]) -> int:
+    """
+    作用：
+    - 命令行入口：调用 build() 并打印结果。
 
-    os.makedirs(os.path.dirname(settings.out_path) or ".", exist_ok=True)
-    tree.write(settings.out_path, encoding="utf-8", xml_declaration=True)
+    输入：
+    - argv: 参数列表
+
+    输出：
+    - int: 退出码
+    """
 
-    print(f"频道数：{len(channels)}")
-    print(f"EPG：ok={stats.get('ok')} fail={stats.get('fail')}")
-    print(f"范围：days_back={settings.days_back} days_forward={settings.days_forward}")
-    print(f"输出：{settings.out_path}")
+    result = build(argv)
+    stats = result["fetch"]
+    print(f"频道数：{result['channels']}")
+    print(f"EPG：ok={stats.get('ok')} fail={stats.get('fail')} retried={stats.get('retried')} 耗时={stats.get('elapsed_s')}s")
+    cs = result["cache"]
+    if cs is not None:
+        print(
+            f"缓存：跳过={cs['skipped']} 抓取={cs['fetched']} 变化日期={cs['dates_changed']} "
+            f"未变日期={cs['dates_unchanged']} 清理日期={cs['dates_pruned']}"
+        )
+    print(f"节目数：{result['programmes']}")
+    d = result["diff"]
+    if not result["changed"]:
+        print("内容未变，未重写")
+    elif not d["baseline"]:
+        print(
+            f"节目变化：频道新增 {d['added']} 删除 {d['removed']} 节目有变 {d['channels_changed']}，"
+            f"节目数 {d['programmes_delta']:+d}"
+        )
+    print(f"范围：days_back={result['days_back']} days_forward={result['days_forward']}")
+    print(f"输出：{result['out']}")
     return 0
 
 
@@ -20,7 +20,9 @@ from __future__ import annotations
 import argparse
 import sys
 import os
+import threading
 from pathlib import Path
+from typing import Any, Dict, Optional
 
 # 允许两种运行方式：
 # 1) 在仓库根目录：python3 -m iptv_sever.backend.build_m3u ...
@@ -38,13 +40,20 @@ if __package__ in (None, ""):
         sys.path.insert(0, repo_root)
 
 from iptv_sever.backend.conf import (
+    DEFAULT_CATALOG_CACHE_DIR,
+    DEFAULT_CATALOG_MAX_AGE_S,
     DEFAULT_CHANNEL_LIST_SOURCE,
     DEFAULT_HTTP_TIMEOUT_S,
     DEFAULT_DOWNLOAD_LOGOS,
     DEFAULT_LOGO_DELAY_S,
+    DEFAULT_LOGO_RATE_PER_HOST,
+    DEFAULT_LOGO_REVALIDATE_S,
     DEFAULT_LOGO_DIR,
     DEFAULT_LOGO_SKIP_EXISTING,
     DEFAULT_LOGO_TIMEOUT_S,
+    DEFAULT_LOGO_VARIANT,
+    DEFAULT_LOGO_VARIANT_SIZE,
+    DEFAULT_LOGO_WORKERS,
     DEFAULT_LOCALIZE_LOGOS,
     DEFAULT_M3U_OUT,
     DEFAULT_SOURCE_IFACE,
@@ -54,17 +63,13 @@ from iptv_sever.backend.conf import (
     DEFAULT_X_TVG_URL,
     M3USettings,
 )
-from iptv_sever.backend.core import (
-    Channel,
-    convert_multicast_to_udpxy,
-    extract_channels,
-    generate_m3u_text,
-    load_channel_categories,
-    with_catchup_style,
-    write_text,
-)
+from iptv_sever.backend.core import write_m3u_files
+from iptv_sever.backend.cancel import raise_if_cancelled
+from iptv_sever.backend.catalog import get_catalog
+from iptv_sever.backend.compress import precompress, remove_precompressed
 from iptv_sever.backend.logo import localize_logos
-from iptv_sever.backend.net import build_opener, get_ipv4_from_iface, is_url
+from iptv_sever.backend.manifest import diff_index, read_output_meta
+from iptv_sever.backend.net import build_opener, get_ipv4_from_iface_cached, is_url
 
 
 def parse_args(argv: list[str]) -> argparse.Namespace:
@@ -92,6 +97,14 @@ def parse_args(argv: list[str]) -> argparse.Namespace:
     ap.add_argument("--timeout", type=float, default=DEFAULT_HTTP_TIMEOUT_S, help="拉取输入 URL 的超时秒数（默认 10）")
     ap.add_argument("--user-agent", default=DEFAULT_USER_AGENT, help="拉取输入 URL 的 User-Agent（默认 curl/8.0.0）")
 
+    ap.add_argument("--catalog-cache-dir", default=DEFAULT_CATALOG_CACHE_DIR, help="频道目录快照目录（空=只缓存在内存）")
+    ap.add_argument(
+        "--catalog-max-age",
+        type=float,
+        default=DEFAULT_CATALOG_MAX_AGE_S,
+        help="频道目录快照免请求复用秒数（0=每次都发条件请求）",
+    )
+
     # URL 输入：必须绑定网卡（从该网卡取 IPv4）
     ap.add_argument("--source-iface", default=DEFAULT_SOURCE_IFACE, help="用于拉取频道 URL 的网卡名（必需；会从该网卡取 IPv4 并 bind）")
 
@@ -107,7 +120,33 @@ def parse_args(argv: list[str]) -> argparse.Namespace:
     ap.add_argument("--logo-dir", default=DEFAULT_LOGO_DIR, help="logo 保存目录（空=自动：与 out 同目录下 logos/）")
     ap.add_argument("--web-base-url", default=DEFAULT_WEB_BASE_URL, help="本地 Web Base（用于拼接 logo URL，例如 http://192.168.1.250）")
     ap.add_argument("--logo-timeout", type=float, default=DEFAULT_LOGO_TIMEOUT_S, help="下载 logo 超时秒数")
-    ap.add_argument("--logo-delay", type=float, default=DEFAULT_LOGO_DELAY_S, help="下载 logo 间隔秒数")
+    ap.add_argument(
+        "--precompress",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="同时写出 .gz（装了 brotli 时还有 .br）预压缩文件，供 /out 按 Accept-Encoding 直接发送",
+    )
+    ap.add_argument("--logo-delay", type=float, default=DEFAULT_LOGO_DELAY_S, help="下载 logo 间隔秒数（旧参数；未指定 --logo-rate 时按 1/delay 折算速率）")
+    ap.add_argument("--logo-workers", type=int, default=DEFAULT_LOGO_WORKERS, help="并发下载 logo 的线程数")
+    ap.add_argument(
+        "--logo-rate",
+        type=float,
+        default=None,
+        help=f"每个 logo 源站的请求速率上限 次/秒（0=不限速，默认 {DEFAULT_LOGO_RATE_PER_HOST:g}）",
+    )
+    ap.add_argument(
+        "--logo-revalidate",
+        type=float,
+        default=DEFAULT_LOGO_REVALIDATE_S,
+        help="已有 logo 按 ETag/Last-Modified 重新验证的间隔秒数",
+    )
+    ap.add_argument(
+        "--logo-variant",
+        choices=("none", "png", "webp"),
+        default=DEFAULT_LOGO_VARIANT or "none",
+        help="生成 logo 缩略图并让 tvg-logo / EPG icon 指向它（需要 Pillow；none=用原图）",
+    )
+    ap.add_argument("--logo-variant-size", type=int, default=DEFAULT_LOGO_VARIANT_SIZE, help="logo 缩略图最长边像素")
     ap.add_argument(
         "--logo-skip-existing",
         action=argparse.BooleanOptionalAction,
@@ -127,17 +166,59 @@ def parse_args(argv: list[str]) -> argparse.Namespace:
     )
     return ap.parse_args(argv)
 
+def _resolve_logo_rate(args: argparse.Namespace) -> float:
+    """
+    作用：
+    - 确定每个 logo 源站的请求速率：显式 --logo-rate 优先；只改了 --logo-delay 时按 1/delay 折算。
+    """
+
+    if args.logo_rate is not None:
+        return max(0.0, float(args.logo_rate))
+    if float(args.logo_delay) != DEFAULT_LOGO_DELAY_S:
+        return (1.0 / float(args.logo_delay)) if args.logo_delay > 0 else 0.0
+    return DEFAULT_LOGO_RATE_PER_HOST
 
-def main(argv: list[str]) -> int:
+
+def _same_content(before: Optional[Dict[str, Any]], after: Optional[Dict[str, Any]]) -> bool:
+    return bool(before and after and before.get("sha256") == after.get("sha256"))
+
+
+def _channel_diff(before: Optional[Dict[str, Any]], after: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    作用：
+    - 由前后两次 .meta 记录里的频道索引（tvg-id → 显示名）得到变化摘要。
+
+    输出：
+    - Dict: baseline/total/added/removed/renamed + examples（频道名示例）
+    """
+
+    new = (after or {}).get("index") or {}
+    old = (before or {}).get("index")
+    d = diff_index(old, new)
+    keys = d.pop("keys")
+    d["renamed"] = d.pop("changed")
+    if keys:
+        d["examples"] = {
+            "added": [new[k] for k in keys["added"]],
+            "removed": [old[k] for k in keys["removed"]],
+            "renamed": [f"{old[k]} → {new[k]}" for k in keys["changed"]],
+        }
+    return d
+
+
+def build(argv: list[str], *, cancel: Optional[threading.Event] = None) -> Dict[str, Any]:
     """
     作用：
     - 串联 net/core 完成：拉取频道 → 抽取频道 → 生成 M3U → 写文件。
+      命令行 main() 和 API 进程内任务引擎共用这一个入口（参数同为命令行形式）。
 
     输入：
     - argv: 命令行参数列表（不含程序名）
+    - cancel: 取消事件（进程内运行时由任务引擎传入；阶段之间检查）
 
     输出：
-    - int: 进程退出码（0 表示成功）
+    - Dict: 结构化结果（written/channels/style/catchup/logos）
+      参数非法时抛 SystemExit（与命令行行为一致），被取消时抛 JobCancelled
     """
 
     args = parse_args(argv)
@@ -168,6 +249,11 @@ def main(argv: list[str]) -> int:
         logo_timeout_s=float(args.logo_timeout),
         logo_delay_s=float(args.logo_delay),
         logo_skip_existing=bool(args.logo_skip_existing),
+        logo_workers=int(args.logo_workers),
+        logo_rate_per_host=_resolve_logo_rate(args),
+        logo_revalidate_s=float(args.logo_revalidate),
+        logo_variant="" if args.logo_variant == "none" else str(args.logo_variant),
+        logo_variant_size=int(args.logo_variant_size),
     )
 
     # 2) 强制 URL 输入（你明确说最终一定是 URL）
@@ -178,27 +264,28 @@ def main(argv: list[str]) -> int:
     if not (settings.source_iface or "").strip():
         raise SystemExit("--source-iface 不能为空（必须指定用于拉取频道 URL 的网卡）")
 
-    bind_ip = get_ipv4_from_iface(settings.source_iface)
+    bind_ip = get_ipv4_from_iface_cached(settings.source_iface)
     if not bind_ip:
         raise SystemExit(f"无法从网卡 {settings.source_iface!r} 获取 IPv4（请确认网卡 up 且已拿到 DHCP）")
 
     opener = build_opener(bind_ip)
 
-    # 3) 加载 JSON 并抽取频道
-    categories = load_channel_categories(
+    # 3) 取频道目录快照并抽取频道（与 EPG 共用；目录没变时直接用缓存的解析结果）
+    catalog = get_catalog(str(args.catalog_cache_dir))
+    snapshot = catalog.load(
         settings.channel_source,
         opener=opener,
         timeout_s=settings.timeout_s,
         user_agent=settings.user_agent,
+        max_age_s=float(args.catalog_max_age),
     )
-    channels, catchup_host, catchup_port, virtual_domain = extract_channels(
-        categories, 
+    channels, catchup_host, catchup_port, virtual_domain = snapshot.channels(
         tvg_id_field=settings.tvg_id_field,
-        web_base_url=settings.web_base_url
+        web_base_url=settings.web_base_url,
     )
-    # 注意：这里提取的 catchup_host/port/domain 暂时不使用
-    # 因为 build_m3u.py 是独立脚本，不直接修改配置
-    # 地址信息会在 execute_job() 中提取并保存
+    catalog.save()
+    # catchup_host/port/domain 随结果返回，由 execute_job() 写进内存覆盖（不再重新拉一次频道列表）
+    raise_if_cancelled(cancel, "频道列表")
 
     # 4) Logo：默认“只改地址”，显式 --download-logos 才下载缺失
     if settings.localize_logos:
@@ -213,57 +300,95 @@ def main(argv: list[str]) -> int:
             skip_existing=settings.logo_skip_existing,
             download_missing=settings.download_logos,
             user_agent=settings.user_agent,
+            workers=settings.logo_workers,
+            rate_per_host=settings.logo_rate_per_host,
+            revalidate_s=settings.logo_revalidate_s,
+            variant=settings.logo_variant,
+            variant_size=settings.logo_variant_size,
+            cancel=cancel,
         )
 
-    # 4) 地址处理：可选转换成 udpxy HTTP
-    if settings.use_udpxy:
-        channels = [
-            Channel(
-                name=ch.name,
-                group=ch.group,
-                tvg_id=ch.tvg_id,
-                tvg_name=ch.tvg_name,
-                tvg_logo=ch.tvg_logo,
-                chno=ch.chno,
-                stream_url=convert_multicast_to_udpxy(ch.stream_url, settings.udpxy_base),
-                catchup_source=ch.catchup_source,
-                catchup_path=ch.catchup_path,
-            )
-            for ch in channels
-        ]
+    raise_if_cancelled(cancel, "logo")
 
     # 5) 输出 M3U（可同时生成 TiviMate / APTV 两套回看模板）
+    #    单遍生成：udpxy 地址与公共属性每个频道只算一次，两套文件边算边写，写完再原子替换
     style = str(getattr(args, "catchup_style", "both") or "both").lower()
     out_aptv = str(getattr(args, "out_aptv", "") or "").strip()
     if not out_aptv:
         p = Path(settings.out_path)
         out_aptv = str(p.with_name("iptv-aptv.m3u"))
 
-    written = []
+    outputs = {}
     if style in ("tivimate", "both"):
-        ch_tv = with_catchup_style(
-            channels, settings.web_base_url, style="tivimate"
-        )
-        write_text(settings.out_path, generate_m3u_text(ch_tv, x_tvg_url=settings.x_tvg_url))
-        written.append(settings.out_path)
+        outputs["tivimate"] = settings.out_path
     if style in ("aptv", "both"):
-        ch_aptv = with_catchup_style(channels, settings.web_base_url, style="aptv")
-        aptv_path = settings.out_path if style == "aptv" else out_aptv
-        write_text(
-            aptv_path, generate_m3u_text(ch_aptv, x_tvg_url=settings.x_tvg_url)
-        )
-        written.append(aptv_path)
+        outputs["aptv"] = settings.out_path if style == "aptv" else out_aptv
+    written = list(outputs.values())
+    before = {p: read_output_meta(p) for p in written}
+    # 内容与现有文件相同的不会重写（mtime / ETag / MQTT 状态都不变）
+    write_m3u_files(
+        channels,
+        outputs,
+        web_base_url=settings.web_base_url,
+        x_tvg_url=settings.x_tvg_url,
+        udpxy_base=settings.udpxy_base if settings.use_udpxy else "",
+    )
+    after = {p: read_output_meta(p) for p in written}
+    changed = [p for p in written if not _same_content(before[p], after[p])]
 
-    print(f"读取：{settings.channel_source}")
-    print(f"频道数：{len(channels)}")
-    print(f"catchup-style：{style}")
     for p in written:
-        print(f"输出：{p}")
-    if settings.localize_logos:
+        if args.precompress:
+            if p in changed or not os.path.exists(f"{p}.gz"):
+                precompress(p)
+        else:
+            remove_precompressed(p)
+
+    return {
+        "source": settings.channel_source,
+        "channels": len(channels),
+        "style": style,
+        "written": written,
+        "changed": changed,
+        "diff": _channel_diff(before[written[0]], after[written[0]]) if written else None,
+        "catchup": {
+            "host": catchup_host,
+            "port": catchup_port,
+            "virtual_domain": virtual_domain,
+        },
+        "logos": dict(stats) if settings.localize_logos else None,
+        "catalog": {"sha256": snapshot.sha256[:16], **catalog.stats},
+    }
+
+
+def main(argv: list[str]) -> int:
+    """
+    作用：
+    - 命令行入口：调用 build() 并打印结果。
+
+    输入：
+    - argv: 命令行参数列表（不含程序名）
+
+    输出：
+    - int: 进程退出码（0 表示成功）
+    """
+
+    result = build(argv)
+    print(f"读取：{result['source']}")
+    print(f"频道数：{result['channels']}")
+    print(f"catchup-style：{result['style']}")
+    for p in result["written"]:
+        print(f"输出：{p}" + ("" if p in result["changed"] else "（内容未变，未重写）"))
+    d = result["diff"]
+    if d and not d["baseline"]:
+        print(f"频道变化：新增 {d['added']} 删除 {d['removed']} 改名 {d['renamed']}")
+    stats = result["logos"]
+    if stats is not None:
         print(
             "logo："
             f"downloaded={stats.get('downloaded')} "
             f"skipped={stats.get('skipped')} "
+            f"updated={stats.get('updated')} "
+            f"not_modified={stats.get('not_modified')} "
             f"failed={stats.get('failed')} "
             f"missing={stats.get('missing')} "
             f"rewritten={stats.get('rewritten')}"
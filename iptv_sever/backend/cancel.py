@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+任务取消（cancel）
+
+进程内运行生成任务时，API 侧通过 threading.Event 请求取消；
+各阶段之间和耗时循环里调用 raise_if_cancelled()，尽快让出工作线程。
+"""
+
+from __future__ import annotations
+
+import threading
+from typing import Optional
+
+
+class JobCancelled(Exception):
+    """任务被取消（手动取消或超时）。"""
+
+
+def raise_if_cancelled(cancel: Optional[threading.Event], where: str = "") -> None:
+    """
+    作用：
+    - cancel 已置位时抛 JobCancelled；cancel 为 None（命令行运行）时什么都不做。
+
+    输入：
+    - cancel: 取消事件
+    - where: 当前阶段（写进异常信息便于排查）
+    """
+
+    if cancel is not None and cancel.is_set():
+        raise JobCancelled(f"任务已取消{f'（{where}）' if where else ''}")
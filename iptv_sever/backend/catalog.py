@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+频道目录快照（catalog）
+
+职责：
+- 频道列表（channel_5.js）每个生成周期只拉一次：M3U、EPG、回看地址发现共用同一份快照
+- 条件请求（If-None-Match / If-Modified-Since）；304 或正文哈希没变时直接复用已解析结果
+- 快照在内存 + 磁盘（<cache_dir>/catalog.json）各存一份；命令行单独运行也能命中
+
+说明：
+- max_age_s 内的重复 load() 不发请求（M3U 与 EPG 任务紧挨着跑时共用一次下载）
+- 上游失败时退回上一次快照并打印警告，避免整轮生成失败
+"""
+
+from __future__ import annotations
+
+import dataclasses
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from typing import Any, Dict, List, Optional, Tuple
+
+from iptv_sever.backend.core import Channel, extract_channels
+from iptv_sever.backend.epg import extract_epg_channels
+from iptv_sever.backend.net import is_url
+
+CATALOG_VERSION = 1
+
+ChannelsResult = Tuple[List[Channel], Optional[str], Optional[int], Optional[str]]
+
+
+class CatalogSnapshot:
+    """
+    作用：
+    - 一份频道目录：原始分类数组 + 校验信息 + 按参数缓存的解析结果。
+
+    说明：
+    - channels()/epg_channels() 每次返回新 list（元素是不可变的 Channel / 新 dict），调用方可随意改
+    """
+
+    def __init__(
+        self,
+        *,
+        source: str,
+        categories: List[Dict[str, Any]],
+        sha256: str,
+        etag: str = "",
+        last_modified: str = "",
+        fetched_at: float = 0.0,
+        parsed: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        self.source = source
+        self.categories = categories
+        self.sha256 = sha256
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched_at = fetched_at
+        # "epg" -> [...]；"m3u|<tvg_id_field>|<web_base_url>" -> {"channels": [...], "catchup": [...]}
+        self._parsed: Dict[str, Any] = dict(parsed or {})
+        self._lock = threading.Lock()
+
+    def channels(self, *, tvg_id_field: str = "primaryid", web_base_url: str = "") -> ChannelsResult:
+        """等价于 extract_channels(categories, ...)，同一组参数只解析一次。"""
+
+        key = f"m3u|{tvg_id_field}|{web_base_url}"
+        with self._lock:
+            hit = self._parsed.get(key)
+            if hit is None:
+                chs, host, port, domain = extract_channels(
+                    self.categories, tvg_id_field=tvg_id_field, web_base_url=web_base_url
+                )
+                hit = {"channels": [dataclasses.asdict(c) for c in chs], "catchup": [host, port, domain]}
+                self._parsed[key] = hit
+        host, port, domain = hit["catchup"]
+        return [Channel(**c) for c in hit["channels"]], host, port, domain
+
+    def epg_channels(self) -> List[Dict[str, str]]:
+        """等价于 extract_epg_channels(categories)，只解析一次。"""
+
+        with self._lock:
+            hit = self._parsed.get("epg")
+            if hit is None:
+                hit = extract_epg_channels(self.categories)
+                self._parsed["epg"] = hit
+        return [dict(c) for c in hit]
+
+    def to_doc(self) -> Dict[str, Any]:
+        with self._lock:
+            parsed = dict(self._parsed)
+        return {
+            "v": CATALOG_VERSION,
+            "source": self.source,
+            "sha256": self.sha256,
+            "etag": self.etag,
+            "last_modified": self.last_modified,
+            "fetched_at": self.fetched_at,
+            "categories": self.categories,
+            "parsed": parsed,
+        }
+
+
+class ChannelCatalog:
+    """
+    作用：
+    - 频道目录加载器：内存快照 → 条件请求 → 磁盘快照兜底。
+
+    输入：
+    - cache_dir: 磁盘快照目录（空 = 只用内存）
+    """
+
+    def __init__(self, cache_dir: str = "") -> None:
+        self.cache_dir = str(cache_dir or "")
+        self._snap: Optional[CatalogSnapshot] = None
+        self._lock = threading.Lock()
+        self.stats: Dict[str, int] = {
+            "memory_hits": 0,
+            "not_modified": 0,
+            "unchanged": 0,
+            "downloads": 0,
+            "stale_fallbacks": 0,
+        }
+
+    # ---------- 磁盘 ----------
+
+    def _path(self) -> str:
+        return os.path.join(self.cache_dir, "catalog.json")
+
+    def _load_disk(self, source: str) -> Optional[CatalogSnapshot]:
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._path(), "r", encoding="utf-8") as f:
+                doc = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print(f"[WARN] 忽略损坏的频道目录快照 {self._path()}: {e}", file=sys.stderr)
+            return None
+        if not isinstance(doc, dict) or doc.get("v") != CATALOG_VERSION or doc.get("source") != source:
+            return None
+        if not isinstance(doc.get("categories"), list):
+            return None
+        return CatalogSnapshot(
+            source=source,
+            categories=doc["categories"],
+            sha256=str(doc.get("sha256") or ""),
+            etag=str(doc.get("etag") or ""),
+            last_modified=str(doc.get("last_modified") or ""),
+            fetched_at=float(doc.get("fetched_at") or 0),
+            parsed=doc.get("parsed") if isinstance(doc.get("parsed"), dict) else None,
+        )
+
+    def save(self) -> None:
+        """把当前快照（含已解析结果）写盘；无 cache_dir 时什么都不做。"""
+
+        snap = self._snap
+        if not self.cache_dir or snap is None:
+            return
+        path = self._path()
+        tmp = f"{path}.tmp"
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(snap.to_doc(), f, ensure_ascii=False, separators=(",", ":"))
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"[WARN] 写入频道目录快照失败 {path}: {e}", file=sys.stderr)
+
+    # ---------- 加载 ----------
+
+    def load(
+        self,
+        source: str,
+        *,
+        opener: Optional[urllib.request.OpenerDirector],
+        timeout_s: float,
+        user_agent: str,
+        max_age_s: float = 0.0,
+    ) -> CatalogSnapshot:
+        """
+        作用：
+        - 取频道目录快照：max_age_s 内直接用内存快照；否则带校验头请求上游。
+
+        输入：
+        - source: 频道列表 URL（必须是 http://）
+        - opener/timeout_s/user_agent: 请求参数（opener 通常绑定源 IP）
+        - max_age_s: 内存快照免请求的有效秒数（0 = 每次都发条件请求）
+
+        输出：
+        - CatalogSnapshot（上游失败且没有旧快照时抛出原异常）
+        """
+
+        src = (source or "").strip()
+        if not src:
+            raise ValueError("source 不能为空")
+        if not is_url(src):
+            raise ValueError(f"input 必须是 URL（http）：{src!r}")
+
+        with self._lock:
+            snap = self._snap if self._snap is not None and self._snap.source == src else None
+            if snap is not None and max_age_s > 0 and time.time() - snap.fetched_at < max_age_s:
+                self.stats["memory_hits"] += 1
+                return snap
+            if snap is None:
+                snap = self._load_disk(src)
+
+            headers = {"User-Agent": user_agent}
+            if snap is not None:
+                if snap.etag:
+                    headers["If-None-Match"] = snap.etag
+                if snap.last_modified:
+                    headers["If-Modified-Since"] = snap.last_modified
+
+            op = opener or urllib.request.build_opener()
+            req = urllib.request.Request(src, headers=headers)
+            try:
+                with op.open(req, timeout=timeout_s) as resp:
+                    raw = resp.read()
+                    etag = resp.headers.get("ETag", "") or ""
+                    last_modified = resp.headers.get("Last-Modified", "") or ""
+            except urllib.error.HTTPError as e:
+                if e.code == 304 and snap is not None:
+                    snap.fetched_at = time.time()
+                    self.stats["not_modified"] += 1
+                    self._snap = snap
+                    return snap
+                if snap is None:
+                    raise
+                print(f"[WARN] 频道列表请求失败（HTTP {e.code}），沿用上一次快照", file=sys.stderr)
+                self.stats["stale_fallbacks"] += 1
+                self._snap = snap
+                return snap
+            except Exception as e:
+                if snap is None:
+                    raise
+                print(f"[WARN] 频道列表请求失败（{type(e).__name__}: {e}），沿用上一次快照", file=sys.stderr)
+                self.stats["stale_fallbacks"] += 1
+                self._snap = snap
+                return snap
+
+            digest = hashlib.sha256(raw).hexdigest()
+            now = time.time()
+            if snap is not None and snap.sha256 == digest:
+                # 上游不支持条件请求，但内容没变：保留已解析结果
+                snap.etag, snap.last_modified, snap.fetched_at = etag, last_modified, now
+                self.stats["unchanged"] += 1
+                self._snap = snap
+                return snap
+
+            data = json.loads(raw.decode("utf-8", errors="replace"))
+            if not isinstance(data, list):
+                raise ValueError("JSON 格式错误：root 应该是数组（list）")
+            self.stats["downloads"] += 1
+            self._snap = CatalogSnapshot(
+                source=src,
+                categories=data,
+                sha256=digest,
+                etag=etag,
+                last_modified=last_modified,
+                fetched_at=now,
+            )
+            return self._snap
+
+
+_catalogs: Dict[str, ChannelCatalog] = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_catalog(cache_dir: str = "") -> ChannelCatalog:
+    """
+    作用：
+    - 按磁盘目录取进程内共享的频道目录（API 进程里 M3U/EPG 任务共用同一个实例）。
+    """
+
+    key = str(cache_dir or "")
+    with _catalogs_lock:
+        cat = _catalogs.get(key)
+        if cat is None:
+            cat = ChannelCatalog(key)
+            _catalogs[key] = cat
+        return cat
+
+
+def get_catalog_stats() -> Dict[str, Any]:
+    with _catalogs_lock:
+        cats = dict(_catalogs)
+    out: Dict[str, Any] = {}
+    for key, cat in cats.items():
+        snap = cat._snap
+        out[key or "memory"] = {
+            **cat.stats,
+            "sha256": snap.sha256[:16] if snap is not None else "",
+            "fetched_at": int(snap.fetched_at) if snap is not None else 0,
+        }
+    return out
@@ -0,0 +1,486 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+回看分片缓存（/catchup/media）
+
+- 以解码后的上游 URL 为 key，缓存 .ts 等 HLS 分片
+- 两级：内存按字节 LRU，挤出的分片落到磁盘目录（同样按字节 LRU），都带 TTL
+- 同一分片的并发请求合并：只发一次上游请求，后台任务边拉边把数据分给所有等待者；
+  播放器中途断开不影响这次拉取，拉完照样进缓存
+- 超过 max_object_bytes 的分片（整段节目的单个 .ts）中途转为流式：不再缓存、不再接受新的合并请求，
+  已被所有读者取走的块立即释放，读者跟不上时暂停读上游，内存只保留一个有界窗口
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+# 只缓存 HLS 分片；整段 mp4 等大文件直接流式透传
+_SEGMENT_SUFFIXES = (".ts", ".m4s", ".aac")
+
+# 转为流式后，读者还没取走的数据超过这么多就暂停读上游
+STREAM_WINDOW_BYTES = 2 * 1024 * 1024
+# 暂停后读者这么久还不动（播放器断开但响应体没开始迭代等）就放弃这次拉取
+STREAM_STALL_S = 60.0
+
+
+def is_cacheable_segment(url: str) -> bool:
+    path = (urlparse(url).path or "").lower()
+    return path.endswith(_SEGMENT_SUFFIXES)
+
+
+@dataclass
+class CachedSegment:
+    """缓存命中的分片。"""
+
+    body: bytes
+    content_type: str
+    stored_at: float
+
+
+class InflightSegment:
+    """
+    作用：
+    - 一次正在进行的上游分片拉取；多个请求共享同一份数据。
+
+    说明：
+    - head_ready 之后 status/headers 可用
+    - 读者先 add_reader()（拿到 SegmentCache.fetch() 的返回值后立即同步登记），
+      再用 iter_body(rid) 从头产出已收到和后续到达的块
+    - streaming=True（超过单对象上限）后只保留还有读者没取走的块：chunks[0] 的序号是 base
+    """
+
+    def __init__(self, url: str) -> None:
+        self.url = url
+        self.status = 0
+        self.headers: Dict[str, str] = {}
+        self.chunks: List[bytes] = []
+        self.base = 0
+        self.size = 0
+        self.buffered = 0
+        self.streaming = False
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.head_ready = asyncio.Event()
+        self._changed = asyncio.Event()
+        self._drained = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        # 合并进来的额外请求数（拉完后按 size 计入 bytes_saved）
+        self.joined = 0
+        # 读者 id -> 下一个要读的块序号
+        self.readers: Dict[int, int] = {}
+        self._next_rid = 0
+
+    def _notify(self) -> None:
+        ev = self._changed
+        self._changed = asyncio.Event()
+        ev.set()
+
+    def _append(self, chunk: bytes) -> None:
+        self.chunks.append(chunk)
+        self.size += len(chunk)
+        self.buffered += len(chunk)
+        self._notify()
+
+    def add_reader(self) -> int:
+        """登记一个从头读的读者；流式转发已丢掉开头时不能再登记（调用方应另起拉取）。"""
+        if self.base:
+            raise RuntimeError("分片已在流式转发，不能再从头读取")
+        rid = self._next_rid
+        self._next_rid += 1
+        self.readers[rid] = 0
+        return rid
+
+    def remove_reader(self, rid: int) -> None:
+        if self.readers.pop(rid, None) is not None:
+            self._trim()
+
+    def _trim(self) -> None:
+        """流式转发时丢掉所有读者都已取走的块，并唤醒等待读者的拉取任务。"""
+        if not self.streaming:
+            return
+        low = min(self.readers.values(), default=self.base + len(self.chunks))
+        n = low - self.base
+        if n > 0:
+            self.buffered -= sum(len(c) for c in self.chunks[:n])
+            del self.chunks[:n]
+            self.base = low
+        self._drained.set()
+
+    async def _wait_drain(self, window: int, stall_s: float) -> None:
+        """读者还没取走的数据超过 window 时等读者跟上；stall_s 秒没有进展抛 asyncio.TimeoutError。"""
+        while self.buffered > window and self.readers:
+            self._drained.clear()
+            await asyncio.wait_for(self._drained.wait(), timeout=stall_s)
+
+    def _finish(self, error: Optional[BaseException] = None) -> None:
+        self.error = error
+        self.done = True
+        self.head_ready.set()
+        self._notify()
+
+    def content_type(self) -> str:
+        for k, v in self.headers.items():
+            if k.lower() == "content-type":
+                return v
+        return ""
+
+    async def wait_head(self, timeout: float) -> None:
+        await asyncio.wait_for(self.head_ready.wait(), timeout=timeout)
+        if self.error is not None and not self.status:
+            raise self.error
+
+    async def iter_body(self, rid: int) -> AsyncIterator[bytes]:
+        try:
+            while True:
+                changed = self._changed
+                while self.readers[rid] < self.base + len(self.chunks):
+                    i = self.readers[rid]
+                    chunk = self.chunks[i - self.base]
+                    self.readers[rid] = i + 1
+                    self._trim()
+                    yield chunk
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                await changed.wait()
+        finally:
+            self.remove_reader(rid)
+
+
+class SegmentCache:
+    """
+    作用：
+    - 回看分片的两级 LRU 缓存 + 并发请求合并。
+
+    输入：
+    - max_memory_bytes: 内存层字节上限
+    - max_disk_bytes: 磁盘层字节上限（0 = 不落盘）
+    - disk_dir: 磁盘层目录（启动时清空，进程内维护索引）
+    - ttl_s: 分片存活秒数
+    - max_object_bytes: 单个分片超过该大小不缓存
+    """
+
+    def __init__(
+        self,
+        *,
+        max_memory_bytes: int = 64 * 1024 * 1024,
+        max_disk_bytes: int = 0,
+        disk_dir: str = "",
+        ttl_s: float = 600,
+        max_object_bytes: int = 16 * 1024 * 1024,
+    ) -> None:
+        self.max_memory_bytes = max(0, int(max_memory_bytes))
+        self.max_disk_bytes = max(0, int(max_disk_bytes))
+        self.disk_dir = (disk_dir or "").strip()
+        self.ttl_s = float(ttl_s)
+        self.max_object_bytes = max(1, int(max_object_bytes))
+
+        self._mem: "OrderedDict[str, CachedSegment]" = OrderedDict()
+        self._mem_bytes = 0
+        # url -> (path, size, stored_at, content_type)
+        self._disk: "OrderedDict[str, tuple]" = OrderedDict()
+        self._disk_bytes = 0
+        self._inflight: Dict[str, InflightSegment] = {}
+        self._bg: set = set()
+        self._stats = {
+            "hits_memory": 0,
+            "hits_disk": 0,
+            "misses": 0,
+            "coalesced": 0,
+            "stored": 0,
+            "evicted": 0,
+            "expired": 0,
+            "bytes_saved": 0,
+            "upstream_bytes": 0,
+            "streamed": 0,
+        }
+
+        if self.disk_dir and self.max_disk_bytes > 0:
+            self._reset_disk_dir()
+        else:
+            self.max_disk_bytes = 0
+
+    # ---------- 磁盘层 ----------
+
+    def _reset_disk_dir(self) -> None:
+        try:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            for name in os.listdir(self.disk_dir):
+                if name.endswith(".seg"):
+                    try:
+                        os.remove(os.path.join(self.disk_dir, name))
+                    except OSError:
+                        pass
+        except OSError as e:
+            logger.warning(f"分片磁盘缓存不可用 {self.disk_dir}: {e}")
+            self.max_disk_bytes = 0
+
+    def _disk_path(self, url: str) -> str:
+        name = hashlib.sha1(url.encode("utf-8")).hexdigest() + ".seg"
+        return os.path.join(self.disk_dir, name)
+
+    async def _spill_to_disk(self, url: str, seg: CachedSegment) -> None:
+        """内存挤出的分片写到磁盘：文件 IO 在线程里做，索引只在事件循环里改。"""
+        size = len(seg.body)
+        if not self.max_disk_bytes or size > self.max_disk_bytes:
+            self._stats["evicted"] += 1
+            return
+        path = self._disk_path(url)
+        try:
+            await asyncio.to_thread(_write_file, path, seg.body)
+        except OSError as e:
+            logger.debug(f"分片落盘失败: {e}")
+            self._stats["evicted"] += 1
+            return
+        old = self._disk.pop(url, None)
+        if old:
+            self._disk_bytes -= old[1]
+        self._disk[url] = (path, size, seg.stored_at, seg.content_type)
+        self._disk_bytes += size
+        while self._disk_bytes > self.max_disk_bytes and self._disk:
+            old_url = next(iter(self._disk))
+            self._drop_disk(old_url)
+            self._stats["evicted"] += 1
+
+    def _drop_disk(self, url: str) -> None:
+        entry = self._disk.pop(url, None)
+        if entry:
+            self._disk_bytes -= entry[1]
+            try:
+                os.remove(entry[0])
+            except OSError:
+                pass
+
+    # ---------- 查询 / 写入 ----------
+
+    def _expired(self, stored_at: float) -> bool:
+        return self.ttl_s > 0 and time.time() - stored_at > self.ttl_s
+
+    async def get(self, url: str) -> Optional[CachedSegment]:
+        """查缓存：内存 → 磁盘（命中后提升回内存）。"""
+        seg = self._mem.get(url)
+        if seg is not None:
+            if self._expired(seg.stored_at):
+                self._mem.pop(url, None)
+                self._mem_bytes -= len(seg.body)
+                self._stats["expired"] += 1
+            else:
+                self._mem.move_to_end(url)
+                self._stats["hits_memory"] += 1
+                self._stats["bytes_saved"] += len(seg.body)
+                return seg
+
+        entry = self._disk.get(url)
+        if entry is not None:
+            path, size, stored_at, ctype = entry
+            if self._expired(stored_at):
+                self._drop_disk(url)
+                self._stats["expired"] += 1
+                return None
+            try:
+                body = await asyncio.to_thread(_read_file, path)
+            except OSError:
+                self._drop_disk(url)
+                return None
+            self._drop_disk(url)
+            seg = CachedSegment(body=body, content_type=ctype, stored_at=stored_at)
+            self._store_memory(url, seg)
+            self._stats["hits_disk"] += 1
+            self._stats["bytes_saved"] += size
+            return seg
+        return None
+
+    def peek(self, url: str) -> bool:
+        """是否已有未过期缓存或正在拉取（不计入统计）。"""
+        if url in self._inflight:
+            return True
+        seg = self._mem.get(url)
+        if seg is not None and not self._expired(seg.stored_at):
+            return True
+        entry = self._disk.get(url)
+        return entry is not None and not self._expired(entry[2])
+
+    def put(self, url: str, body: bytes, content_type: str) -> None:
+        if len(body) > self.max_object_bytes:
+            return
+        self._store_memory(
+            url, CachedSegment(body=body, content_type=content_type, stored_at=time.time())
+        )
+        self._stats["stored"] += 1
+
+    def _store_memory(self, url: str, seg: CachedSegment) -> None:
+        old = self._mem.pop(url, None)
+        if old is not None:
+            self._mem_bytes -= len(old.body)
+        self._mem[url] = seg
+        self._mem_bytes += len(seg.body)
+        while self._mem_bytes > self.max_memory_bytes and self._mem:
+            old_url, old_seg = self._mem.popitem(last=False)
+            self._mem_bytes -= len(old_seg.body)
+            if self.max_disk_bytes and not self._expired(old_seg.stored_at):
+                task = asyncio.get_running_loop().create_task(
+                    self._spill_to_disk(old_url, old_seg)
+                )
+                self._bg.add(task)
+                task.add_done_callback(self._bg.discard)
+            else:
+                self._stats["evicted"] += 1
+
+    # ---------- 并发合并 ----------
+
+    def fetch(
+        self,
+        url: str,
+        open_fn: Callable[[], Awaitable[Any]],
+        permit: Any = None,
+    ) -> InflightSegment:
+        """
+        作用：
+        - 取同一 URL 的在途拉取；没有则启动后台任务拉取（200 且不超限则写入缓存）。
+
+        输入：
+        - open_fn: 无参协程工厂，返回 catchup_client.UpstreamResponse
+        - permit: 上游名额（catchup_limiter.Permit）；后台拉取结束（含失败/取消）时归还，
+          合并到已有拉取时立即归还
+        """
+
+        inflight = self._inflight.get(url)
+        if inflight is not None:
+            if permit is not None:
+                permit.release()
+            self._stats["coalesced"] += 1
+            inflight.joined += 1
+            return inflight
+
+        self._stats["misses"] += 1
+        inflight = InflightSegment(url)
+        self._inflight[url] = inflight
+        inflight.task = asyncio.get_running_loop().create_task(
+            self._run_fetch(inflight, open_fn, permit)
+        )
+        return inflight
+
+    async def _run_fetch(
+        self, inflight: InflightSegment, open_fn: Callable[[], Awaitable[Any]], permit: Any = None
+    ) -> None:
+        try:
+            resp = await open_fn()
+            inflight.status = resp.status
+            inflight.headers = dict(resp.headers)
+            inflight.head_ready.set()
+            async for chunk in resp.iter_chunks():
+                inflight._append(chunk)
+                self._stats["upstream_bytes"] += len(chunk)
+                if inflight.size > self.max_object_bytes:
+                    if not inflight.streaming:
+                        self._start_streaming(inflight)
+                    if not inflight.readers:
+                        raise RuntimeError("超过缓存上限且已没有读者，停止拉取")
+                    inflight._trim()
+                    await inflight._wait_drain(STREAM_WINDOW_BYTES, STREAM_STALL_S)
+            inflight._finish()
+            self._stats["bytes_saved"] += inflight.size * inflight.joined
+            if inflight.status != 200 or inflight.streaming:
+                pass
+            else:
+                self.put(inflight.url, b"".join(inflight.chunks), inflight.content_type())
+        except BaseException as e:
+            logger.debug(f"分片拉取失败: {e}")
+            inflight._finish(e)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+        finally:
+            # 转为流式后同一 URL 可能已有新的拉取，只摘掉自己
+            if self._inflight.get(inflight.url) is inflight:
+                self._inflight.pop(inflight.url, None)
+            if permit is not None:
+                permit.release()
+
+    def _start_streaming(self, inflight: InflightSegment) -> None:
+        """超过单对象上限：不再缓存，也不再让新请求合并进来（它们从头读不到已丢掉的块）。"""
+        inflight.streaming = True
+        if self._inflight.get(inflight.url) is inflight:
+            self._inflight.pop(inflight.url, None)
+        self._stats["streamed"] += 1
+        logger.debug(f"分片超过缓存上限，改为流式转发、不缓存: {inflight.url[:120]}")
+
+    def stats(self) -> Dict[str, Any]:
+        hits = self._stats["hits_memory"] + self._stats["hits_disk"] + self._stats["coalesced"]
+        total = hits + self._stats["misses"]
+        return {
+            **self._stats,
+            "hit_ratio": round(hits / total, 4) if total else 0.0,
+            "memory_bytes": self._mem_bytes,
+            "memory_items": len(self._mem),
+            "disk_bytes": self._disk_bytes,
+            "disk_items": len(self._disk),
+            "inflight": len(self._inflight),
+        }
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _write_file(path: str, data: bytes) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+_cache: Optional[SegmentCache] = None
+_cache_sig: Optional[tuple] = None
+
+
+def get_segment_cache(cfg: Optional[Dict[str, Any]], *, disk_dir: str = "") -> Optional[SegmentCache]:
+    """
+    作用：
+    - 按 catchup 配置取进程内共享的分片缓存；cache_enabled=false 时返回 None。
+
+    输入：
+    - cfg: catchup 配置段（cache_enabled / cache_memory_mb / cache_disk_mb / cache_ttl_s /
+      cache_max_object_mb）
+    - disk_dir: 磁盘层目录
+    """
+
+    global _cache, _cache_sig
+    cfg = cfg or {}
+    if not cfg.get("cache_enabled", True):
+        return None
+    mb = 1024 * 1024
+    sig = (
+        int(float(cfg.get("cache_memory_mb", 64)) * mb),
+        int(float(cfg.get("cache_disk_mb", 256)) * mb),
+        disk_dir,
+        float(cfg.get("cache_ttl_s", 600)),
+        int(float(cfg.get("cache_max_object_mb", 16)) * mb),
+    )
+    if _cache is None or sig != _cache_sig:
+        _cache = SegmentCache(
+            max_memory_bytes=sig[0],
+            max_disk_bytes=sig[1],
+            disk_dir=sig[2],
+            ttl_s=sig[3],
+            max_object_bytes=sig[4],
+        )
+        _cache_sig = sig
+    return _cache
+
+
+def get_cache_stats() -> Dict[str, Any]:
+    return _cache.stats() if _cache is not None else {}
@@ -0,0 +1,567 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+回看上游异步 HTTP 客户端
+
+在 async 路由里用 urllib 同步读完整个 body 会卡住 uvicorn 事件循环（/out、/health 也跟着卡）。
+这里直接用 asyncio 连上游（绑定 source_iface 的 IPv4），响应头读完即返回，
+body 由调用方按块拉取，可直接接 StreamingResponse。
+
+只实现回看反代需要的 HTTP/1.1 子集：GET/HEAD、Content-Length / chunked / 读到 EOF、
+跟随重定向。
+
+连接按 (scheme, host, port, 源 IP) 放进 UpstreamPool 复用：HLS 分片每 2~10 秒一个，
+复用 keep-alive 连接后每个分片只剩一个 RTT，不再重新握手。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import ssl
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Callable, Deque, Dict, List, Optional, Tuple
+from urllib.parse import urljoin, urlparse
+
+from .catchup_proxy import get_source_bind_ip
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+_REDIRECT_CODES = {301, 302, 303, 307, 308}
+_NO_BODY_CODES = {204, 304}
+_MAX_HEADER_BYTES = 64 * 1024
+
+
+class UpstreamError(Exception):
+    """上游连接或 HTTP 协议错误。"""
+
+
+PoolKey = Tuple[str, str, int, str]
+
+
+class _PooledConn:
+    """池中的一条上游连接。"""
+
+    __slots__ = ("key", "reader", "writer", "last_used", "reused")
+
+    def __init__(self, key: PoolKey, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.key = key
+        self.reader = reader
+        self.writer = writer
+        self.last_used = time.monotonic()
+        self.reused = False
+
+    def healthy(self, idle_timeout_s: float) -> bool:
+        if self.reader.at_eof() or self.writer.is_closing():
+            return False
+        if self.reader._buffer:  # type: ignore[attr-defined]
+            # 空闲连接上不该有数据（上游多发了字节或已开始关闭）
+            return False
+        return time.monotonic() - self.last_used < idle_timeout_s
+
+    def close(self) -> None:
+        try:
+            self.writer.close()
+        except Exception:
+            pass
+
+
+class UpstreamPool:
+    """
+    作用：
+    - 按 (scheme, host, port, 源 IP) 复用到上游的 keep-alive 连接。
+
+    输入：
+    - max_per_host: 每个上游同时使用的连接上限（超出则排队等待）
+    - max_idle_per_host: 每个上游最多保留的空闲连接数
+    - idle_timeout_s: 空闲超过该秒数的连接取用时丢弃
+
+    说明：
+    - 取空闲连接时检查健康（对端已关闭/有残留数据/超时）并淘汰；
+    - 源 IP 在 key 里：专网 DHCP 换地址后旧连接自然不再命中，随超时淘汰。
+    """
+
+    def __init__(
+        self,
+        *,
+        max_per_host: int = 8,
+        max_idle_per_host: int = 4,
+        idle_timeout_s: float = 30.0,
+    ) -> None:
+        self.max_per_host = max(1, int(max_per_host))
+        self.max_idle_per_host = max(0, int(max_idle_per_host))
+        self.idle_timeout_s = float(idle_timeout_s)
+        self._idle: Dict[PoolKey, Deque[_PooledConn]] = {}
+        self._slots: Dict[PoolKey, asyncio.Semaphore] = {}
+        self._active: Dict[PoolKey, int] = {}
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "evicted": 0,
+            "retried": 0,
+            "connect_errors": 0,
+        }
+
+    def configure(
+        self,
+        *,
+        max_per_host: Optional[int] = None,
+        max_idle_per_host: Optional[int] = None,
+        idle_timeout_s: Optional[float] = None,
+    ) -> None:
+        """按配置调整上限（已创建的排队信号量保持不变，新 host 生效）。"""
+        if max_per_host is not None and int(max_per_host) != self.max_per_host:
+            self.max_per_host = max(1, int(max_per_host))
+            self._slots = {k: v for k, v in self._slots.items() if self._active.get(k)}
+        if max_idle_per_host is not None:
+            self.max_idle_per_host = max(0, int(max_idle_per_host))
+        if idle_timeout_s is not None:
+            self.idle_timeout_s = float(idle_timeout_s)
+
+    def _slot(self, key: PoolKey) -> asyncio.Semaphore:
+        sem = self._slots.get(key)
+        if sem is None:
+            sem = asyncio.Semaphore(self.max_per_host)
+            self._slots[key] = sem
+        return sem
+
+    async def acquire(self, key: PoolKey, *, timeout: float, fresh: bool = False) -> _PooledConn:
+        """取一条连接：优先复用健康的空闲连接，否则新建。"""
+        sem = self._slot(key)
+        try:
+            await asyncio.wait_for(sem.acquire(), timeout=timeout)
+        except asyncio.TimeoutError:
+            raise UpstreamError(f"上游连接数已满（{key[1]}:{key[2]} 上限 {self.max_per_host}）")
+        self._active[key] = self._active.get(key, 0) + 1
+        try:
+            idle = self._idle.get(key)
+            while idle and not fresh:
+                conn = idle.pop()
+                if conn.healthy(self.idle_timeout_s):
+                    conn.reused = True
+                    self._stats["hits"] += 1
+                    return conn
+                self._stats["evicted"] += 1
+                conn.close()
+            self._stats["misses"] += 1
+            return await self._connect(key, timeout=timeout)
+        except BaseException:
+            self._release_slot(key)
+            raise
+
+    async def _connect(self, key: PoolKey, *, timeout: float) -> _PooledConn:
+        scheme, host, port, bind_ip = key
+        ssl_ctx = ssl.create_default_context() if scheme == "https" else None
+        local_addr = (bind_ip, 0) if bind_ip else None
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(
+                    host,
+                    port,
+                    ssl=ssl_ctx,
+                    local_addr=local_addr,
+                    limit=_MAX_HEADER_BYTES,
+                ),
+                timeout=timeout,
+            )
+        except asyncio.TimeoutError:
+            self._stats["connect_errors"] += 1
+            raise UpstreamError(f"连接上游超时: {host}:{port}")
+        except OSError as e:
+            self._stats["connect_errors"] += 1
+            raise UpstreamError(f"连接上游失败 {host}:{port}: {e}")
+        return _PooledConn(key, reader, writer)
+
+    def release(self, conn: _PooledConn, *, reusable: bool) -> None:
+        """归还连接：可复用且未超空闲上限则放回，否则关闭。"""
+        key = conn.key
+        self._release_slot(key)
+        if reusable and self.max_idle_per_host > 0 and not conn.writer.is_closing():
+            idle = self._idle.setdefault(key, deque())
+            conn.last_used = time.monotonic()
+            idle.append(conn)
+            while len(idle) > self.max_idle_per_host:
+                self._stats["evicted"] += 1
+                idle.popleft().close()
+            return
+        conn.close()
+
+    def _release_slot(self, key: PoolKey) -> None:
+        self._active[key] = max(0, self._active.get(key, 0) - 1)
+        sem = self._slots.get(key)
+        if sem is not None:
+            sem.release()
+
+    def note_retry(self) -> None:
+        self._stats["retried"] += 1
+
+    def close_idle(self) -> None:
+        for idle in self._idle.values():
+            while idle:
+                idle.pop().close()
+        self._idle.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """命中/未命中等计数 + 当前各上游的活跃/空闲连接数。"""
+        total = self._stats["hits"] + self._stats["misses"]
+        hosts = {}
+        for key in set(self._idle) | set(self._active):
+            idle = len(self._idle.get(key) or ())
+            active = self._active.get(key, 0)
+            if idle or active:
+                hosts[f"{key[1]}:{key[2]}"] = {"active": active, "idle": idle}
+        return {
+            **self._stats,
+            "hit_ratio": round(self._stats["hits"] / total, 4) if total else 0.0,
+            "max_per_host": self.max_per_host,
+            "max_idle_per_host": self.max_idle_per_host,
+            "hosts": hosts,
+        }
+
+
+_pool: Optional[UpstreamPool] = None
+
+
+def get_upstream_pool(cfg: Optional[Dict[str, Any]] = None) -> UpstreamPool:
+    """
+    作用：
+    - 取进程内共享的上游连接池（/catchup/... 与 /catchup/media 共用）。
+
+    输入：
+    - cfg: catchup 配置段（可选），读取 pool_max_per_host / pool_max_idle / pool_idle_timeout_s
+    """
+
+    global _pool
+    if _pool is None:
+        _pool = UpstreamPool()
+    if cfg:
+        _pool.configure(
+            max_per_host=cfg.get("pool_max_per_host"),
+            max_idle_per_host=cfg.get("pool_max_idle"),
+            idle_timeout_s=cfg.get("pool_idle_timeout_s"),
+        )
+    return _pool
+
+
+def get_pool_stats() -> Dict[str, Any]:
+    return get_upstream_pool().stats()
+
+
+def _split_url(url: str) -> Tuple[str, str, int, str, str]:
+    """
+    作用：
+    - 拆出建连与请求行需要的字段。
+
+    输出：
+    - (scheme, host, port, host_header, target)
+    """
+
+    parsed = urlparse(url)
+    scheme = (parsed.scheme or "").lower()
+    if scheme not in ("http", "https"):
+        raise UpstreamError(f"不支持的协议: {url[:80]}")
+    host = parsed.hostname or ""
+    if not host:
+        raise UpstreamError(f"URL 缺少主机: {url[:80]}")
+    default_port = 443 if scheme == "https" else 80
+    port = parsed.port or default_port
+    host_header = host if port == default_port else f"{host}:{port}"
+    target = parsed.path or "/"
+    if parsed.query:
+        target = f"{target}?{parsed.query}"
+    return scheme, host, port, host_header, target
+
+
+class UpstreamResponse:
+    """
+    作用：
+    - 已读完响应头的上游响应；body 通过 iter_chunks()/read() 按需读取。
+
+    说明：
+    - 用完必须 aclose()（iter_chunks 读到结尾或中途退出时会自动关闭）。
+    """
+
+    def __init__(
+        self,
+        *,
+        status: int,
+        reason: str,
+        headers: Dict[str, str],
+        url: str,
+        method: str,
+        version: str,
+        conn: _PooledConn,
+        pool: UpstreamPool,
+        timeout: float,
+    ) -> None:
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.url = url
+        self._conn = conn
+        self._pool = pool
+        self._reader = conn.reader
+        self._timeout = timeout
+        self._closed = False
+        self._broken = False
+
+        te = self.header("transfer-encoding").lower()
+        cl = self.header("content-length").strip()
+        self._chunked = "chunked" in te
+        self._chunk_left = 0
+        self._remaining: Optional[int] = None
+        if not self._chunked and cl.isdigit():
+            self._remaining = int(cl)
+        self._done = (
+            method == "HEAD"
+            or status in _NO_BODY_CODES
+            or 100 <= status < 200
+            or self._remaining == 0
+        )
+        # 只有长度明确、且双方都没要求关闭的 HTTP/1.1 响应才能放回池里
+        self._keep_alive = (
+            version == "HTTP/1.1"
+            and "close" not in self.header("connection").lower()
+            and (self._done or self._chunked or self._remaining is not None)
+        )
+
+    def header(self, name: str, default: str = "") -> str:
+        """大小写不敏感地取响应头。"""
+        name_l = name.lower()
+        for k, v in self.headers.items():
+            if k.lower() == name_l:
+                return v
+        return default
+
+    async def _wait(self, aw):
+        return await asyncio.wait_for(aw, timeout=self._timeout)
+
+    async def _read_some(self, size: int) -> bytes:
+        if self._done:
+            return b""
+        try:
+            return await self._read_body(size)
+        except BaseException:
+            self._broken = True
+            raise
+
+    async def _read_body(self, size: int) -> bytes:
+
+        if self._chunked:
+            if self._chunk_left == 0:
+                line = await self._wait(self._reader.readline())
+                if not line:
+                    raise UpstreamError("上游 chunked 响应提前结束")
+                try:
+                    n = int(line.split(b";", 1)[0].strip() or b"0", 16)
+                except ValueError:
+                    raise UpstreamError(f"非法 chunk 长度: {line[:32]!r}")
+                if n == 0:
+                    # 跳过 trailer，直到空行
+                    while True:
+                        trailer = await self._wait(self._reader.readline())
+                        if trailer in (b"\r\n", b"\n", b""):
+                            break
+                    self._done = True
+                    return b""
+                self._chunk_left = n
+            data = await self._wait(self._reader.read(min(size, self._chunk_left)))
+            if not data:
+                raise UpstreamError("上游 chunked 响应提前结束")
+            self._chunk_left -= len(data)
+            if self._chunk_left == 0:
+                await self._wait(self._reader.readexactly(2))
+            return data
+
+        if self._remaining is not None:
+            data = await self._wait(self._reader.read(min(size, self._remaining)))
+            if not data:
+                raise UpstreamError(
+                    f"上游响应被截断（还差 {self._remaining} 字节）"
+                )
+            self._remaining -= len(data)
+            if self._remaining <= 0:
+                self._done = True
+            return data
+
+        # 无长度：读到连接关闭为止
+        data = await self._wait(self._reader.read(size))
+        if not data:
+            self._done = True
+        return data
+
+    async def iter_chunks(self, chunk_size: int = DEFAULT_CHUNK_SIZE) -> AsyncIterator[bytes]:
+        """逐块产出 body；结束（或调用方中途退出）时关闭连接。"""
+        try:
+            while True:
+                data = await self._read_some(chunk_size)
+                if not data:
+                    break
+                yield data
+        finally:
+            await self.aclose()
+
+    async def read(self) -> bytes:
+        """读完整个 body（m3u8 这类小响应用）。"""
+        parts: List[bytes] = []
+        async for chunk in self.iter_chunks():
+            parts.append(chunk)
+        return b"".join(parts)
+
+    async def aclose(self) -> None:
+        """释放连接：body 已完整读完且允许 keep-alive 时放回连接池，否则关闭。"""
+        if self._closed:
+            return
+        self._closed = True
+        reusable = self._done and self._keep_alive and not self._broken
+        self._pool.release(self._conn, reusable=reusable)
+
+
+async def _read_response_head(
+    reader: asyncio.StreamReader, timeout: float
+) -> Tuple[str, int, str, Dict[str, str]]:
+    try:
+        raw = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=timeout)
+    except asyncio.IncompleteReadError:
+        raise UpstreamError("上游未返回完整响应头即断开")
+    except asyncio.LimitOverrunError:
+        raise UpstreamError("上游响应头过大")
+
+    lines = raw.decode("latin-1").split("\r\n")
+    status_line = lines[0]
+    parts = status_line.split(" ", 2)
+    if len(parts) < 2 or not parts[0].startswith("HTTP/"):
+        raise UpstreamError(f"非法状态行: {status_line[:80]!r}")
+    try:
+        status = int(parts[1])
+    except ValueError:
+        raise UpstreamError(f"非法状态码: {status_line[:80]!r}")
+    version = parts[0].upper()
+    reason = parts[2] if len(parts) > 2 else ""
+
+    headers: Dict[str, str] = {}
+    for line in lines[1:]:
+        if not line or ":" not in line:
+            continue
+        k, v = line.split(":", 1)
+        headers[k.strip()] = v.strip()
+    return version, status, reason, headers
+
+
+async def _request_once(
+    url: str,
+    *,
+    method: str,
+    bind_ip: str,
+    user_agent: str,
+    extra_headers: Optional[Dict[str, str]],
+    timeout: float,
+    pool: UpstreamPool,
+) -> UpstreamResponse:
+    scheme, host, port, host_header, target = _split_url(url)
+    key: PoolKey = (scheme, host, port, bind_ip)
+
+    lines = [
+        f"{method} {target} HTTP/1.1",
+        f"Host: {host_header}",
+        f"User-Agent: {user_agent or 'Mozilla/5.0'}",
+        "Accept: */*",
+        "Connection: keep-alive",
+    ]
+    for k, v in (extra_headers or {}).items():
+        lines.append(f"{k}: {v}")
+    head = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1", errors="replace")
+
+    fresh = False
+    while True:
+        conn = await pool.acquire(key, timeout=timeout, fresh=fresh)
+        try:
+            conn.writer.write(head)
+            await asyncio.wait_for(conn.writer.drain(), timeout=timeout)
+            version, status, reason, headers = await _read_response_head(
+                conn.reader, timeout
+            )
+        except (UpstreamError, ConnectionError) as e:
+            pool.release(conn, reusable=False)
+            # 复用的空闲连接可能刚好被上游关掉：换新连接重试一次
+            if conn.reused and not fresh:
+                pool.note_retry()
+                fresh = True
+                continue
+            if isinstance(e, UpstreamError):
+                raise
+            raise UpstreamError(f"上游连接中断 {host}:{port}: {e}")
+        except BaseException:
+            pool.release(conn, reusable=False)
+            raise
+        break
+
+    return UpstreamResponse(
+        status=status,
+        reason=reason,
+        headers=headers,
+        url=url,
+        method=method,
+        version=version,
+        conn=conn,
+        pool=pool,
+        timeout=timeout,
+    )
+
+
+async def open_upstream(
+    url: str,
+    *,
+    source_iface: str = "",
+    method: str = "GET",
+    user_agent: str = "Mozilla/5.0",
+    headers: Optional[Dict[str, str]] = None,
+    timeout: float = 30,
+    on_redirect: Optional[Callable[[str], None]] = None,
+    max_redirects: int = 5,
+    pool: Optional[UpstreamPool] = None,
+) -> UpstreamResponse:
+    """
+    作用：
+    - 绑定 source_iface 异步请求上游，跟随重定向，返回已读完响应头的 UpstreamResponse。
+
+    输入：
+    - url: 上游 URL（http/https）
+    - source_iface: 专网网卡名（取其 IPv4 作为源地址；为空则不绑定）
+    - method: GET / HEAD
+    - user_agent/headers: 请求头
+    - timeout: 建连、读响应头、每次读 body 的超时秒数
+    - on_redirect: 每次重定向时回调新地址
+    - pool: 连接池（默认进程内共享池）
+
+    输出：
+    - UpstreamResponse（status/headers/url 为最终响应；4xx/5xx 也原样返回）
+    """
+
+    # 带缓存的 ioctl 查询，不阻塞事件循环
+    bind_ip = get_source_bind_ip(source_iface)
+    pool = pool or get_upstream_pool()
+    current = url
+    method = (method or "GET").upper()
+    for _ in range(max_redirects + 1):
+        resp = await _request_once(
+            current,
+            method=method,
+            bind_ip=bind_ip,
+            user_agent=user_agent,
+            extra_headers=headers,
+            timeout=timeout,
+            pool=pool,
+        )
+        location = resp.header("location")
+        if resp.status not in _REDIRECT_CODES or not location:
+            return resp
+        # 重定向响应体通常很小：读完再释放，连接还能复用
+        await resp.read()
+        current = urljoin(current, location)
+        if on_redirect:
+            on_redirect(current)
+        if resp.status == 303:
+            method = "GET"
+    raise UpstreamError(f"重定向次数超过 {max_redirects}")
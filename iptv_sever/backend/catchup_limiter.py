@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+回看上游并发限制
+
+播放器并发猛拉分片时，不加限制会在 source_iface 上开出大量连接，挤占同一条链路上的直播组播。
+- 全局 + 按播放器 IP 两级并发上限；超出的请求排队等待
+- 排队人数超过上限或等待超时：抛 LimiterOverloaded，路由回 503 + Retry-After
+- 名额在响应体发完（或播放器断开）时归还；分片缓存的上游拉取在拉完时归还
+- 预取用 try_acquire() 不排队申请，没有空位就跳过，不挤占播放器自己的请求
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class LimiterOverloaded(Exception):
+    """排队已满或等待超时。"""
+
+    def __init__(self, reason: str, retry_after: int) -> None:
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Permit:
+    """一次上游请求占用的名额；release() 可重复调用。"""
+
+    def __init__(self, limiter: "ConcurrencyLimiter", client: str) -> None:
+        self._limiter = limiter
+        self.client = client
+        self._released = False
+
+    def release(self) -> None:
+        if self._released:
+            return
+        self._released = True
+        self._limiter._release(self.client)
+
+
+class ConcurrencyLimiter:
+    """
+    作用：
+    - 回看上游请求的全局 / 单客户端并发上限 + 有界排队。
+
+    输入：
+    - max_global: 全局同时进行的上游请求数（0 = 不限）
+    - max_per_client: 单个播放器 IP 同时进行的上游请求数（0 = 不限）
+    - queue_timeout_s: 排队最长等待秒数
+    - max_queue: 同时排队的请求数上限
+    - retry_after_s: 503 响应里的 Retry-After 秒数
+    """
+
+    def __init__(
+        self,
+        *,
+        max_global: int = 16,
+        max_per_client: int = 4,
+        queue_timeout_s: float = 10.0,
+        max_queue: int = 64,
+        retry_after_s: int = 2,
+    ) -> None:
+        self.max_global = max(0, int(max_global))
+        self.max_per_client = max(0, int(max_per_client))
+        self.queue_timeout_s = max(0.0, float(queue_timeout_s))
+        self.max_queue = max(0, int(max_queue))
+        self.retry_after_s = max(1, int(retry_after_s))
+
+        self._global = asyncio.Semaphore(self.max_global) if self.max_global else None
+        # client -> [Semaphore, 引用数（占用 + 排队）]
+        self._clients: Dict[str, list] = {}
+        self._active: Dict[str, int] = {}
+        self._waiting = 0
+        self._stats = {
+            "admitted": 0,
+            "queued": 0,
+            "rejected_queue_full": 0,
+            "rejected_timeout": 0,
+            "try_rejected": 0,
+            "max_queue_depth": 0,
+            "wait_ms_total": 0.0,
+            "wait_ms_max": 0.0,
+        }
+
+    def _client_slot(self, client: str) -> Optional[list]:
+        if not self.max_per_client:
+            return None
+        slot = self._clients.get(client)
+        if slot is None:
+            slot = [asyncio.Semaphore(self.max_per_client), 0]
+            self._clients[client] = slot
+        return slot
+
+    def _drop_client_ref(self, client: str) -> None:
+        slot = self._clients.get(client)
+        if slot is None:
+            return
+        slot[1] -= 1
+        if slot[1] <= 0:
+            self._clients.pop(client, None)
+
+    def _busy(self, sem: Optional[asyncio.Semaphore]) -> bool:
+        return sem is not None and sem.locked()
+
+    async def _take(self, sem: asyncio.Semaphore, deadline: float) -> None:
+        if not sem.locked():
+            # 有空位时 acquire() 不会挂起
+            await sem.acquire()
+            return
+        self._waiting += 1
+        self._stats["queued"] += 1
+        self._stats["max_queue_depth"] = max(self._stats["max_queue_depth"], self._waiting)
+        try:
+            await asyncio.wait_for(sem.acquire(), timeout=max(0.0, deadline - time.monotonic()))
+        finally:
+            self._waiting -= 1
+
+    async def acquire(self, client: str) -> Permit:
+        """
+        作用：
+        - 申请一个上游名额；需要排队时最多等 queue_timeout_s。
+
+        输出：
+        - Permit（用完调用 release()）；排队已满/超时抛 LimiterOverloaded
+        """
+
+        client = client or "-"
+        slot = self._client_slot(client)
+        sem_client = slot[0] if slot is not None else None
+        if (self._busy(sem_client) or self._busy(self._global)) and self._waiting >= self.max_queue:
+            self._stats["rejected_queue_full"] += 1
+            raise LimiterOverloaded("排队已满", self.retry_after_s)
+
+        if slot is not None:
+            slot[1] += 1
+        t0 = time.monotonic()
+        deadline = t0 + self.queue_timeout_s
+        got_client = False
+        try:
+            if sem_client is not None:
+                await self._take(sem_client, deadline)
+                got_client = True
+            if self._global is not None:
+                await self._take(self._global, deadline)
+        except asyncio.TimeoutError:
+            if got_client:
+                sem_client.release()
+            self._drop_client_ref(client)
+            self._stats["rejected_timeout"] += 1
+            raise LimiterOverloaded("排队超时", self.retry_after_s)
+        except BaseException:
+            if got_client:
+                sem_client.release()
+            self._drop_client_ref(client)
+            raise
+
+        wait_ms = (time.monotonic() - t0) * 1000
+        self._stats["admitted"] += 1
+        self._stats["wait_ms_total"] += wait_ms
+        self._stats["wait_ms_max"] = max(self._stats["wait_ms_max"], wait_ms)
+        self._active[client] = self._active.get(client, 0) + 1
+        if wait_ms >= 1000:
+            logger.info(f"回看上游排队 {wait_ms:.0f}ms: client={client}")
+        return Permit(self, client)
+
+    async def try_acquire(self, client: str) -> Optional[Permit]:
+        """
+        作用：
+        - 不排队地申请名额（预取用）：全局和该客户端都有空位、且没有请求在排队时立即拿到，否则返回 None。
+        """
+
+        client = client or "-"
+        slot = self._clients.get(client)
+        if self._waiting or self._busy(self._global) or (slot is not None and self._busy(slot[0])):
+            self._stats["try_rejected"] += 1
+            return None
+        slot = self._client_slot(client)
+        if slot is not None:
+            slot[1] += 1
+            # 有空位时 acquire() 不会挂起
+            await slot[0].acquire()
+        if self._global is not None:
+            await self._global.acquire()
+        self._stats["admitted"] += 1
+        self._active[client] = self._active.get(client, 0) + 1
+        return Permit(self, client)
+
+    def _release(self, client: str) -> None:
+        if self._global is not None:
+            self._global.release()
+        slot = self._clients.get(client)
+        if slot is not None:
+            slot[0].release()
+            self._drop_client_ref(client)
+        n = self._active.get(client, 0) - 1
+        if n > 0:
+            self._active[client] = n
+        else:
+            self._active.pop(client, None)
+
+    def stats(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = dict(self._stats)
+        admitted = self._stats["admitted"]
+        out["wait_ms_avg"] = round(self._stats["wait_ms_total"] / admitted, 2) if admitted else 0.0
+        out["wait_ms_total"] = round(self._stats["wait_ms_total"], 1)
+        out["wait_ms_max"] = round(self._stats["wait_ms_max"], 1)
+        out["queue_depth"] = self._waiting
+        out["active"] = sum(self._active.values())
+        out["active_clients"] = dict(self._active)
+        out["max_global"] = self.max_global
+        out["max_per_client"] = self.max_per_client
+        return out
+
+
+_limiter: Optional[ConcurrencyLimiter] = None
+_limiter_sig: Optional[tuple] = None
+
+
+def get_limiter(cfg: Optional[Dict[str, Any]]) -> Optional[ConcurrencyLimiter]:
+    """
+    作用：
+    - 按 catchup 配置取进程内共享的限流器；全局与单客户端上限都为 0 时返回 None。
+
+    输入：
+    - cfg: catchup 配置段（limit_global / limit_per_client / limit_queue_timeout_s /
+      limit_max_queue / limit_retry_after_s）
+    """
+
+    global _limiter, _limiter_sig
+    cfg = cfg or {}
+    sig = (
+        int(cfg.get("limit_global", 16) or 0),
+        int(cfg.get("limit_per_client", 4) or 0),
+        float(cfg.get("limit_queue_timeout_s", 10)),
+        int(cfg.get("limit_max_queue", 64)),
+        int(cfg.get("limit_retry_after_s", 2)),
+    )
+    if not sig[0] and not sig[1]:
+        return None
+    if _limiter is None or sig != _limiter_sig:
+        _limiter = ConcurrencyLimiter(
+            max_global=sig[0],
+            max_per_client=sig[1],
+            queue_timeout_s=sig[2],
+            max_queue=sig[3],
+            retry_after_s=sig[4],
+        )
+        _limiter_sig = sig
+    return _limiter
+
+
+def get_limiter_stats() -> Dict[str, Any]:
+    return _limiter.stats() if _limiter is not None else {}
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+回看主播放列表缓存（/catchup/{catchup_path}）
+
+播放器（尤其 TiviMate）打开节目和每次拖动都会重复请求同一个主 m3u8：
+- 改写好的 m3u8 按 (catchup_path, 转换后的开始/结束时间, 其它参数, 本机反代地址) 缓存几十秒
+- 运营商重定向器给出的最终地址单独缓存更久，正文过期后直接请求最终地址，不再经重定向器
+- 同一 key 并发请求排队：只有第一个去上游，其余等它写入缓存后直接命中
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+PlaylistKey = Tuple[Any, ...]
+
+
+def playlist_cache_key(
+    catchup_path: str,
+    begin: str,
+    end: str,
+    extra_params: Optional[Dict[str, str]],
+    proxy_base: str,
+) -> PlaylistKey:
+    """begin/end 传 convert_catchup_times 之后的值，不同时间格式的同一节目归到同一 key。"""
+    extras = tuple(sorted((str(k), str(v)) for k, v in (extra_params or {}).items()))
+    return (catchup_path.strip("/"), begin, end, extras, proxy_base.rstrip("/"))
+
+
+@dataclass
+class CachedPlaylist:
+    """已改写的主 m3u8。"""
+
+    body: bytes
+    headers: Dict[str, str]
+    final_url: str
+    segments: List[str] = field(default_factory=list)
+    stored_at: float = 0.0
+
+
+class PlaylistCache:
+    """
+    作用：
+    - 主 m3u8 正文 + 重定向目标的短 TTL 缓存（进程内，事件循环线程使用）。
+
+    输入：
+    - ttl_s: 改写后正文的存活秒数
+    - redirect_ttl_s: 重定向最终地址的存活秒数（0 = 不缓存重定向）
+    - max_entries: 各自的条目上限（LRU）
+    """
+
+    def __init__(
+        self,
+        *,
+        ttl_s: float = 30,
+        redirect_ttl_s: float = 300,
+        max_entries: int = 256,
+    ) -> None:
+        self.ttl_s = float(ttl_s)
+        self.redirect_ttl_s = float(redirect_ttl_s)
+        self.max_entries = max(1, int(max_entries))
+        self._entries: "OrderedDict[PlaylistKey, CachedPlaylist]" = OrderedDict()
+        # key -> (final_url, stored_at)
+        self._redirects: "OrderedDict[PlaylistKey, Tuple[str, float]]" = OrderedDict()
+        # key -> [lock, 引用数]
+        self._locks: Dict[PlaylistKey, list] = {}
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "waited": 0,
+            "redirect_hits": 0,
+            "redirect_dropped": 0,
+        }
+
+    def get(self, key: PlaylistKey) -> Optional[CachedPlaylist]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self._stats["misses"] += 1
+            return None
+        if time.monotonic() - entry.stored_at > self.ttl_s:
+            self._entries.pop(key, None)
+            self._stats["misses"] += 1
+            return None
+        self._entries.move_to_end(key)
+        self._stats["hits"] += 1
+        return entry
+
+    def put(self, key: PlaylistKey, entry: CachedPlaylist) -> None:
+        entry.stored_at = time.monotonic()
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def redirect_for(self, key: PlaylistKey) -> str:
+        item = self._redirects.get(key)
+        if item is None:
+            return ""
+        url, stored_at = item
+        if time.monotonic() - stored_at > self.redirect_ttl_s:
+            self._redirects.pop(key, None)
+            return ""
+        self._stats["redirect_hits"] += 1
+        return url
+
+    def set_redirect(self, key: PlaylistKey, final_url: str) -> None:
+        if self.redirect_ttl_s <= 0 or not final_url:
+            return
+        self._redirects[key] = (final_url, time.monotonic())
+        self._redirects.move_to_end(key)
+        while len(self._redirects) > self.max_entries:
+            self._redirects.popitem(last=False)
+
+    def drop_redirect(self, key: PlaylistKey) -> None:
+        if self._redirects.pop(key, None) is not None:
+            self._stats["redirect_dropped"] += 1
+
+    @asynccontextmanager
+    async def lock(self, key: PlaylistKey) -> AsyncIterator[None]:
+        """同一 key 串行：第一个请求拉上游，后面的拿到锁时通常已能命中缓存。"""
+        slot = self._locks.get(key)
+        if slot is None:
+            slot = [asyncio.Lock(), 0]
+            self._locks[key] = slot
+        if slot[0].locked():
+            self._stats["waited"] += 1
+        slot[1] += 1
+        try:
+            async with slot[0]:
+                yield
+        finally:
+            slot[1] -= 1
+            if slot[1] <= 0:
+                self._locks.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = dict(self._stats)
+        total = self._stats["hits"] + self._stats["misses"]
+        out["hit_ratio"] = round(self._stats["hits"] / total, 4) if total else 0.0
+        out["entries"] = len(self._entries)
+        out["redirects"] = len(self._redirects)
+        return out
+
+
+_cache: Optional[PlaylistCache] = None
+_cache_sig: Optional[tuple] = None
+
+
+def get_playlist_cache(cfg: Optional[Dict[str, Any]]) -> Optional[PlaylistCache]:
+    """
+    作用：
+    - 按 catchup 配置取进程内共享的主播放列表缓存；playlist_cache_ttl_s<=0 时返回 None。
+
+    输入：
+    - cfg: catchup 配置段（playlist_cache_ttl_s / redirect_cache_ttl_s）
+    """
+
+    global _cache, _cache_sig
+    cfg = cfg or {}
+    ttl = float(cfg.get("playlist_cache_ttl_s", 30) or 0)
+    if ttl <= 0:
+        return None
+    sig = (ttl, float(cfg.get("redirect_cache_ttl_s", 300) or 0))
+    if _cache is None or sig != _cache_sig:
+        _cache = PlaylistCache(ttl_s=sig[0], redirect_ttl_s=sig[1])
+        _cache_sig = sig
+    return _cache
+
+
+def get_playlist_cache_stats() -> Dict[str, Any]:
+    return _cache.stats() if _cache is not None else {}
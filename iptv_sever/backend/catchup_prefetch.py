@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+回看分片预取（/catchup/media）
+
+- 改写 m3u8 时登记播放列表里的分片顺序（按播放器 IP 一个会话）
+- 播放器请求第 i 个分片时，后台按顺序把 i+1..i+N 拉进分片缓存（catchup_cache），
+  播放器请求到时直接命中缓存，不再每片都等一次 10.255 CDN
+- 同一时刻每个会话最多一个预取请求在途；缓冲上限就是 N 个分片 + 缓存自身的字节上限
+- 每个预取请求都从回看限流器（catchup_limiter）不排队地拿一个名额，与播放器自己的请求共用
+  全局/单客户端上限；没有空位就暂停预取，等播放器请求下一片时再试
+- 播放器拖动（跳出预取窗口/往回跳）、换节目或长时间不再请求时取消该会话的预取
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from .catchup_cache import InflightSegment, SegmentCache, is_cacheable_segment
+
+logger = logging.getLogger(__name__)
+
+# url -> 无参协程工厂（返回 UpstreamResponse），与 SegmentCache.fetch 的 open_fn 一致
+OpenFactory = Callable[[str], Callable[[], Awaitable[Any]]]
+
+
+class _Session:
+    def __init__(self, client: str, segments: List[str]) -> None:
+        self.client = client
+        self.segments: List[str] = []
+        self.index: Dict[str, int] = {}
+        self.position = -1
+        self.last_seen = time.monotonic()
+        self.worker: Optional[asyncio.Task] = None
+        self.current: Optional[InflightSegment] = None
+        # 已预取、尚未被播放器取走的分片
+        self.prefetched: Set[str] = set()
+        self.set_segments(segments)
+
+    def set_segments(self, segments: List[str]) -> None:
+        self.segments = list(segments)
+        self.index = {u: i for i, u in enumerate(self.segments)}
+
+
+class Prefetcher:
+    """
+    作用：
+    - 按会话顺序预取 HLS 分片进 SegmentCache。
+
+    说明：
+    - 全部状态只在事件循环线程里读写，不加锁。
+    """
+
+    def __init__(
+        self,
+        cache: SegmentCache,
+        *,
+        depth: int = 3,
+        idle_s: float = 30.0,
+        max_sessions: int = 64,
+    ) -> None:
+        self.cache = cache
+        self.depth = max(0, int(depth))
+        self.idle_s = max(1.0, float(idle_s))
+        self.max_sessions = max(1, int(max_sessions))
+        self._sessions: Dict[str, _Session] = {}
+        self._stats = {
+            "sessions_started": 0,
+            "issued": 0,
+            "used": 0,
+            "cancelled": 0,
+            "seeks": 0,
+            "errors": 0,
+            "skipped_busy": 0,
+        }
+
+    # ---------- 会话 ----------
+
+    def register_playlist(self, client: str, segment_urls: List[str]) -> None:
+        """
+        作用：
+        - m3u8 改写完成后登记分片顺序（只保留可缓存的分片 URL）。
+
+        说明：
+        - 同一播放器刷新同一播放列表时保留当前位置；换成毫不相干的列表视为换节目，取消旧预取。
+        """
+
+        self._sweep()
+        segments = [u for u in segment_urls if is_cacheable_segment(u)]
+        if not client or not segments:
+            return
+
+        sess = self._sessions.get(client)
+        if sess is not None:
+            if any(u in sess.index for u in segments):
+                sess.set_segments(segments)
+                sess.last_seen = time.monotonic()
+                return
+            self._cancel(sess)
+            self._sessions.pop(client, None)
+
+        if len(self._sessions) >= self.max_sessions:
+            oldest = min(self._sessions.values(), key=lambda s: s.last_seen)
+            self._drop(oldest)
+        self._sessions[client] = _Session(client, segments)
+        self._stats["sessions_started"] += 1
+
+    def on_segment(self, client: str, url: str, open_for: OpenFactory, limiter: Any = None) -> None:
+        """
+        作用：
+        - 播放器请求了某个分片：更新会话位置，必要时启动后台预取。
+
+        输入：
+        - limiter: catchup_limiter.ConcurrencyLimiter（None = 未启用限流）；client 与限流器的客户端键一致
+        """
+
+        self._sweep()
+        sess = self._sessions.get(client)
+        if sess is None:
+            return
+        i = sess.index.get(url)
+        if i is None:
+            return
+
+        sess.last_seen = time.monotonic()
+        if url in sess.prefetched:
+            sess.prefetched.discard(url)
+            self._stats["used"] += 1
+
+        # 往回跳或跳出预取窗口：之前预取的都用不上了
+        if sess.position >= 0 and (i < sess.position or i > sess.position + self.depth + 1):
+            self._stats["seeks"] += 1
+            logger.debug(f"预取: {client} 拖动 {sess.position} → {i}，取消旧预取")
+            self._cancel(sess)
+            sess.prefetched.clear()
+        sess.position = i
+
+        if self.depth <= 0:
+            return
+        if sess.worker is None or sess.worker.done():
+            sess.worker = asyncio.get_running_loop().create_task(self._run(sess, open_for, limiter))
+
+    def _next_target(self, sess: _Session) -> Optional[str]:
+        start = sess.position + 1
+        for u in sess.segments[start : start + self.depth]:
+            if not self.cache.peek(u):
+                return u
+        return None
+
+    async def _run(self, sess: _Session, open_for: OpenFactory, limiter: Any) -> None:
+        try:
+            while True:
+                target = self._next_target(sess)
+                if target is None:
+                    return
+                permit = None
+                if limiter is not None:
+                    permit = await limiter.try_acquire(sess.client)
+                    if permit is None:
+                        self._stats["skipped_busy"] += 1
+                        logger.debug(f"预取: {sess.client} 上游名额已满，暂停预取")
+                        return
+                # 名额交给缓存的后台拉取，拉完（或被 _cancel 取消）时归还
+                inflight = self.cache.fetch(target, open_for(target), permit=permit)
+                sess.current = inflight
+                sess.prefetched.add(target)
+                self._stats["issued"] += 1
+                if inflight.task is not None:
+                    # shield：本 worker 被取消时由 _cancel 决定是否连同在途拉取一起取消
+                    await asyncio.shield(inflight.task)
+                if inflight.status != 200:
+                    self._stats["errors"] += 1
+                    logger.debug(f"预取失败({inflight.status}): {target[:120]}")
+                    return
+        except asyncio.CancelledError:
+            pass
+        finally:
+            sess.current = None
+
+    def _cancel(self, sess: _Session) -> None:
+        if sess.worker is not None and not sess.worker.done():
+            sess.worker.cancel()
+            self._stats["cancelled"] += 1
+        cur = sess.current
+        # 已有播放器在等这一片（joined>0）就让它拉完
+        if cur is not None and not cur.done and cur.joined == 0 and cur.task is not None:
+            cur.task.cancel()
+        sess.worker = None
+        sess.current = None
+
+    def _drop(self, sess: _Session) -> None:
+        self._cancel(sess)
+        self._sessions.pop(sess.client, None)
+
+    def _sweep(self) -> None:
+        now = time.monotonic()
+        for sess in list(self._sessions.values()):
+            if now - sess.last_seen > self.idle_s:
+                logger.debug(f"预取: {sess.client} 空闲超时，结束会话")
+                self._drop(sess)
+
+    def stats(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = dict(self._stats)
+        issued = self._stats["issued"]
+        out["used_ratio"] = round(self._stats["used"] / issued, 3) if issued else 0.0
+        out["depth"] = self.depth
+        out["sessions"] = len(self._sessions)
+        return out
+
+
+_prefetcher: Optional[Prefetcher] = None
+_prefetcher_sig: Optional[tuple] = None
+
+
+def get_prefetcher(cfg: Optional[Dict[str, Any]], cache: Optional[SegmentCache]) -> Optional[Prefetcher]:
+    """
+    作用：
+    - 按 catchup 配置取进程内共享的预取器；prefetch_segments<=0 或未启用分片缓存时返回 None。
+
+    输入：
+    - cfg: catchup 配置段（prefetch_segments / prefetch_idle_s）
+    - cache: get_segment_cache() 的返回值
+    """
+
+    global _prefetcher, _prefetcher_sig
+    cfg = cfg or {}
+    depth = int(cfg.get("prefetch_segments") or 0)
+    if depth <= 0 or cache is None:
+        return None
+    sig = (depth, float(cfg.get("prefetch_idle_s", 30)), id(cache))
+    if _prefetcher is None or sig != _prefetcher_sig:
+        _prefetcher = Prefetcher(cache, depth=sig[0], idle_s=sig[1])
+        _prefetcher_sig = sig
+    return _prefetcher
+
+
+def get_prefetch_stats() -> Dict[str, Any]:
+    return _prefetcher.stats() if _prefetcher is not None else {}
@@ -14,17 +14,21 @@ from __future__ import annotations
 import base64
 import ipaddress
 import re
-import urllib.request
-from typing import Callable, Optional, Tuple
-from urllib.parse import urljoin, urlparse
+import secrets
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urljoin, urlparse, urlsplit
 
-from .net import _SourceAddrHTTPHandler, get_ipv4_from_iface
+from .net import get_ipv4_from_iface_cached
 
-_URI_ATTR_RE = re.compile(r'URI="([^"]+)"', re.IGNORECASE)
+_URI_ATTR_RE = re.compile(rb'URI="([^"]+)"', re.IGNORECASE)
+_HTTP_PREFIXES = (b"http://", b"https://")
 
 
 def get_source_bind_ip(source_iface: str) -> str:
-    return get_ipv4_from_iface((source_iface or "").strip())
+    """source_iface 的 IPv4（带缓存，不会每个请求都 fork `ip`）。"""
+    return get_ipv4_from_iface_cached((source_iface or "").strip())
 
 
 def is_allowed_upstream_url(url: str) -> bool:
@@ -70,9 +74,258 @@ def decode_upstream_token(token: str) -> str:
     return once
 
 
-def build_media_proxy_url(proxy_base: str, upstream_url: str) -> str:
-    base = (proxy_base or "").rstrip("/")
-    return f"{base}?u={encode_upstream_token(upstream_url)}"
+class MediaTokenTable:
+    """
+    作用：
+    - 服务端令牌表：短随机 ID -> 上游 URL 目录前缀（scheme://host:port/dir/）。
+      改写后的地址形如 {proxy_base}/{tid}/{文件名?query}，比整条 URL 的 base64 短得多；
+      解码是一次字典查找，ID 只由服务端在改写合法上游时发放，无法伪造去访问任意主机。
+    - 启用令牌时旧的 ?u= 链接只放行已发放过的目录前缀（allows_legacy）。
+
+    输入：
+    - ttl_s: 令牌闲置多久过期（每次使用顺延）
+    - max_tokens: 令牌数上限（LRU）
+    """
+
+    def __init__(self, *, ttl_s: float = 6 * 3600, max_tokens: int = 4096) -> None:
+        self.ttl_s = float(ttl_s)
+        self.max_tokens = max(1, int(max_tokens))
+        # tid -> [prefix, expires_at]
+        self._by_id: "OrderedDict[str, list]" = OrderedDict()
+        self._by_prefix: Dict[str, str] = {}
+        self._stats = {"issued": 0, "hits": 0, "misses": 0, "expired": 0, "legacy_rejected": 0}
+
+    def issue(self, prefix: str) -> str:
+        now = time.monotonic()
+        tid = self._by_prefix.get(prefix)
+        if tid is not None and tid in self._by_id:
+            entry = self._by_id[tid]
+            entry[1] = now + self.ttl_s
+            self._by_id.move_to_end(tid)
+            return tid
+        tid = secrets.token_urlsafe(6)
+        while tid in self._by_id:
+            tid = secrets.token_urlsafe(6)
+        self._by_id[tid] = [prefix, now + self.ttl_s]
+        self._by_prefix[prefix] = tid
+        self._stats["issued"] += 1
+        while len(self._by_id) > self.max_tokens:
+            old_tid, (old_prefix, _) = self._by_id.popitem(last=False)
+            self._by_prefix.pop(old_prefix, None)
+        return tid
+
+    def resolve(self, tid: str) -> str:
+        """返回令牌对应的前缀；不存在或已过期返回空串。"""
+        entry = self._by_id.get(tid)
+        if entry is None:
+            self._stats["misses"] += 1
+            return ""
+        now = time.monotonic()
+        if now > entry[1]:
+            self._by_id.pop(tid, None)
+            self._by_prefix.pop(entry[0], None)
+            self._stats["expired"] += 1
+            return ""
+        entry[1] = now + self.ttl_s
+        self._by_id.move_to_end(tid)
+        self._stats["hits"] += 1
+        return entry[0]
+
+    def proxy_url(self, proxy_base: str, upstream_url: str) -> str:
+        """
+        上游地址 -> 令牌形式的本地地址。
+
+        不退回可伪造的 ?u= 形式：不是 http(s) 绝对地址时抛 ValueError。
+        """
+        prefix, rest = _split_prefix(upstream_url)
+        tid = self.issue(prefix)
+        return f"{(proxy_base or '').rstrip('/')}/{tid}/{rest}"
+
+    def allows_legacy(self, upstream_url: str) -> bool:
+        """
+        旧 ?u= 链接是否放行：只接受目录前缀已由本表发放且未过期的上游地址，
+        客户端自己拼的 ?u= 到不了改写时没见过的主机/目录。
+        """
+        try:
+            prefix, _ = _split_prefix(upstream_url)
+        except ValueError:
+            prefix = ""
+        tid = self._by_prefix.get(prefix) if prefix else None
+        if tid is not None and self.resolve(tid) == prefix:
+            return True
+        self._stats["legacy_rejected"] += 1
+        return False
+
+    def stats(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = dict(self._stats)
+        out["tokens"] = len(self._by_id)
+        return out
+
+
+def _query_start(url: str) -> int:
+    i = url.find("?")
+    return i if i >= 0 else len(url)
+
+
+def _split_prefix(url: str) -> Tuple[str, str]:
+    """http(s) 绝对地址 -> (目录前缀 scheme://host:port/dir/, 文件名?query)；没有路径时前缀是 scheme://host:port/。"""
+    q = _query_start(url)
+    scheme_end = url.find("://", 0, q)
+    if scheme_end < 0 or url[:scheme_end].lower() not in ("http", "https"):
+        raise ValueError(f"不是 http(s) 绝对地址: {url[:120]}")
+    host_end = scheme_end + 3
+    cut = url.rfind("/", host_end, q)
+    if cut < 0:
+        # http://host?x 与 http://host/?x 等价
+        if q == host_end:
+            raise ValueError(f"缺少主机: {url[:120]}")
+        return url[:q] + "/", url[q:]
+    return url[: cut + 1], url[cut + 1 :]
+
+
+_token_table: Optional[MediaTokenTable] = None
+_token_sig: Optional[tuple] = None
+
+
+def get_media_token_table(cfg: Optional[Dict[str, Any]]) -> Optional[MediaTokenTable]:
+    """
+    作用：
+    - 按 catchup 配置取进程内共享的令牌表；media_tokens=false 时返回 None（改写用旧的 ?u= 形式）。
+
+    输入：
+    - cfg: catchup 配置段（media_tokens / media_token_ttl_s）
+    """
+
+    global _token_table, _token_sig
+    cfg = cfg or {}
+    if not cfg.get("media_tokens", True):
+        return None
+    sig = (float(cfg.get("media_token_ttl_s", 6 * 3600)),)
+    if _token_table is None or sig != _token_sig:
+        _token_table = MediaTokenTable(ttl_s=sig[0])
+        _token_sig = sig
+    return _token_table
+
+
+def get_media_token_stats() -> Dict[str, Any]:
+    return _token_table.stats() if _token_table is not None else {}
+
+
+class M3U8Rewriter:
+    """
+    作用：
+    - 单遍、按字节改写 m3u8：分片/子列表/#EXT URI 全部指向本机 /catchup/media。
+      可以边收上游数据边 feed()，不必先攒整段再 decode/split/join。
+
+    输入：
+    - playlist_url: m3u8 的最终地址（相对路径以它为基准）
+    - proxy_base: 本机 /catchup/media 地址
+    - tokens: 传入时用令牌形式（{proxy_base}/{tid}/{文件名}），否则用 ?u=base64 形式
+
+    输出：
+    - feed()/finish() 返回改写后的字节（每行以 CRLF 结尾）；media_urls 为按顺序出现的分片绝对地址
+    """
+
+    def __init__(
+        self,
+        *,
+        playlist_url: str,
+        proxy_base: str,
+        tokens: Optional[MediaTokenTable] = None,
+    ) -> None:
+        self.playlist_url = playlist_url
+        self.proxy_base = (proxy_base or "").rstrip("/")
+        self.tokens = tokens
+        self.media_urls: List[str] = []
+
+        parts = urlsplit(playlist_url)
+        self._scheme = parts.scheme.encode("utf-8")
+        origin = f"{parts.scheme}://{parts.netloc}"
+        base_path = parts.path or "/"
+        self._origin = origin.encode("utf-8")
+        self._dir = (origin + base_path[: base_path.rfind("/") + 1]).encode("utf-8")
+        # 基准路径含 ./ ../ 时交给 urljoin 规范化；其余相对地址直接拼接
+        self._fast = parts.scheme in ("http", "https") and "/." not in base_path
+        self._legacy_prefix = f"{self.proxy_base}?u=".encode("ascii", errors="replace")
+        self._dir_proxy: Optional[bytes] = None
+        self._pending = b""
+        self._emitted = False
+        self._sub_uri = _URI_ATTR_RE.sub
+
+    def _resolve(self, ref: bytes) -> Tuple[Optional[bytes], bool]:
+        """返回 (绝对地址, 是否就在 playlist 同目录)；非 http(s) 返回 (None, False)。"""
+        if ref.startswith(_HTTP_PREFIXES):
+            return ref, False
+        if self._fast:
+            head = ref.partition(b"?")[0]
+            if b":" not in head and b"./" not in head and head not in (b".", b"..") and ref[:1] != b"?":
+                if ref.startswith(b"//"):
+                    return self._scheme + b":" + ref, False
+                if ref[:1] == b"/":
+                    return self._origin + ref, False
+                return self._dir + ref, b"/" not in head
+        abs_url = urljoin(self.playlist_url, ref.decode("utf-8", errors="replace"))
+        if abs_url.startswith("http://") or abs_url.startswith("https://"):
+            return abs_url.encode("utf-8"), False
+        return None, False
+
+    def _proxy(self, abs_url: bytes, ref: bytes, same_dir: bool) -> bytes:
+        if self.tokens is None:
+            return self._legacy_prefix + base64.urlsafe_b64encode(abs_url).rstrip(b"=")
+        if same_dir:
+            if self._dir_proxy is None:
+                tid = self.tokens.issue(self._dir.decode("utf-8"))
+                self._dir_proxy = f"{self.proxy_base}/{tid}/".encode("utf-8")
+            return self._dir_proxy + ref
+        return self.tokens.proxy_url(self.proxy_base, abs_url.decode("utf-8")).encode("utf-8")
+
+    def _repl_uri(self, m: "re.Match[bytes]") -> bytes:
+        ref = m.group(1)
+        abs_url, same_dir = self._resolve(ref)
+        if abs_url is None:
+            return m.group(0)
+        return b'URI="' + self._proxy(abs_url, ref, same_dir) + b'"'
+
+    def _rewrite_lines(self, data: bytes) -> bytes:
+        out = []
+        append = out.append
+        for line in data.splitlines():
+            stripped = line.strip()
+            if not stripped:
+                append(line)
+            elif stripped[:1] == b"#":
+                append(self._sub_uri(self._repl_uri, line) if b'"' in line else line)
+            else:
+                abs_url, same_dir = self._resolve(stripped)
+                if abs_url is None:
+                    append(line)
+                else:
+                    self.media_urls.append(abs_url.decode("utf-8", errors="replace"))
+                    append(self._proxy(abs_url, stripped, same_dir))
+        if not out:
+            return b""
+        self._emitted = True
+        out.append(b"")
+        return b"\r\n".join(out)
+
+    def feed(self, chunk: bytes) -> bytes:
+        data = self._pending + chunk if self._pending else chunk
+        cut = max(data.rfind(b"\n"), data.rfind(b"\r"))
+        # 末尾的 \r 可能和下一块开头的 \n 是同一个换行，先留着
+        if cut == len(data) - 1 and data[cut:] == b"\r":
+            cut = max(data.rfind(b"\n", 0, cut), data.rfind(b"\r", 0, cut))
+        if cut < 0:
+            self._pending = data
+            return b""
+        self._pending = data[cut + 1 :]
+        return self._rewrite_lines(data[: cut + 1])
+
+    def finish(self) -> bytes:
+        data, self._pending = self._pending, b""
+        out = self._rewrite_lines(data) if data else b""
+        if not self._emitted:
+            return b"\r\n"
+        return out
 
 
 def rewrite_m3u8_to_proxy(
@@ -80,37 +333,47 @@ def rewrite_m3u8_to_proxy(
     *,
     playlist_url: str,
     proxy_base: str,
+    tokens: Optional[MediaTokenTable] = None,
 ) -> bytes:
-    try:
-        text = content.decode("utf-8")
-    except UnicodeDecodeError:
-        text = content.decode("utf-8", errors="replace")
-
-    out_lines = []
-    for line in text.splitlines():
-        stripped = line.strip()
-        if not stripped:
-            out_lines.append(line)
-            continue
-
-        if stripped.startswith("#"):
-            def _repl(m: re.Match) -> str:
-                raw = m.group(1)
-                abs_url = urljoin(playlist_url, raw)
-                if abs_url.startswith("http://") or abs_url.startswith("https://"):
-                    return f'URI="{build_media_proxy_url(proxy_base, abs_url)}"'
-                return m.group(0)
-
-            out_lines.append(_URI_ATTR_RE.sub(_repl, line))
-            continue
-
-        abs_url = urljoin(playlist_url, stripped)
-        if abs_url.startswith("http://") or abs_url.startswith("https://"):
-            out_lines.append(build_media_proxy_url(proxy_base, abs_url))
-        else:
-            out_lines.append(line)
-
-    return ("\r\n".join(out_lines) + "\r\n").encode("utf-8")
+    """
+    改写 m3u8：分片/子列表/#EXT URI 全部指向本机 /catchup/media。
+    传入 tokens 时用令牌形式（{proxy_base}/{tid}/{文件名}），否则用 ?u=base64 形式。
+    """
+    rw = M3U8Rewriter(playlist_url=playlist_url, proxy_base=proxy_base, tokens=tokens)
+    return rw.feed(content) + rw.finish()
+
+
+def parse_byte_range(value: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    解析单段 Range（bytes=a-b / bytes=a- / bytes=-n），返回闭区间 (start, end)。
+
+    - 格式不认识或多段 Range：返回 None（按 RFC 可忽略 Range，回整段）
+    - 起点超出 size：抛 ValueError（调用方回 416）
+    """
+    s = (value or "").strip()
+    if not s.lower().startswith("bytes="):
+        return None
+    spec = s[6:].strip()
+    if "," in spec or "-" not in spec:
+        return None
+    first, _, last = spec.partition("-")
+    first, last = first.strip(), last.strip()
+    if not first:
+        if not last.isdigit():
+            return None
+        n = int(last)
+        if n <= 0 or size <= 0:
+            raise ValueError(f"Range 超出范围: {s} / {size}")
+        return (max(0, size - n), size - 1)
+    if not first.isdigit() or (last and not last.isdigit()):
+        return None
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise ValueError(f"Range 超出范围: {s} / {size}")
+    end = int(last) if last else size - 1
+    return (start, min(end, size - 1))
 
 
 def looks_like_m3u8(content_type: str, content: bytes) -> bool:
@@ -124,33 +387,3 @@ def looks_like_ts(url: str, content_type: str) -> bool:
     path = (urlparse(url).path or "").lower()
     ct = (content_type or "").lower()
     return path.endswith(".ts") or "mp2t" in ct or "mpegts" in ct
-
-
-def fetch_upstream(
-    url: str,
-    *,
-    source_iface: str = "",
-    user_agent: str = "Mozilla/5.0",
-    timeout: float = 30,
-    on_redirect: Optional[Callable[[str], None]] = None,
-) -> Tuple[int, dict, bytes, str]:
-    """绑定 source_iface 拉取上游。返回 (status, headers, body, final_url)。"""
-    bind_ip = get_source_bind_ip(source_iface)
-
-    class PreserveRedirect(urllib.request.HTTPRedirectHandler):
-        def redirect_request(self, req, fp, code, msg, headers, newurl):
-            if on_redirect:
-                on_redirect(newurl)
-            return super().redirect_request(req, fp, code, msg, headers, newurl)
-
-    handlers = [PreserveRedirect]
-    if bind_ip:
-        handlers.insert(0, _SourceAddrHTTPHandler(bind_ip))
-    opener = urllib.request.build_opener(*handlers)
-
-    req = urllib.request.Request(url)
-    req.add_header("User-Agent", user_agent or "Mozilla/5.0")
-    with opener.open(req, timeout=timeout) as resp:
-        body = resp.read()
-        headers = {k: v for k, v in resp.headers.items()}
-        return int(resp.status), headers, body, (resp.geturl() or url)
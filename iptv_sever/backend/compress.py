@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+输出文件预压缩（compress）
+
+职责：
+- 生成 m3u / epg.xml 后顺带写出 .gz（以及装了 brotli 时的 .br）同名兄弟文件
+- /out 静态服务按 Accept-Encoding 直接发预压缩文件，运行时不做压缩
+
+说明：
+- 压缩按块流式进行，内存占用与文件大小无关
+- 写入走临时文件 + rename；兄弟文件 mtime 与原文件一致，便于判断是否过期
+"""
+
+from __future__ import annotations
+
+import gzip
+import os
+import sys
+from typing import List, Optional
+
+try:
+    import brotli  # type: ignore
+except ImportError:  # 可选依赖：没装就只生成 .gz
+    brotli = None
+
+_CHUNK = 256 * 1024
+
+
+def _finish(tmp: str, dst: str, mtime: float) -> None:
+    os.utime(tmp, (mtime, mtime))
+    os.replace(tmp, dst)
+
+
+def _write_gzip(src: str, dst: str, mtime: float, level: int) -> None:
+    tmp = f"{dst}.tmp"
+    with open(src, "rb") as fin, open(tmp, "wb") as raw:
+        # mtime 固定为原文件 mtime：内容不变时 .gz 字节也不变
+        with gzip.GzipFile(filename="", mode="wb", fileobj=raw, compresslevel=level, mtime=int(mtime)) as gz:
+            while True:
+                chunk = fin.read(_CHUNK)
+                if not chunk:
+                    break
+                gz.write(chunk)
+    _finish(tmp, dst, mtime)
+
+
+def _write_brotli(src: str, dst: str, mtime: float) -> None:
+    tmp = f"{dst}.tmp"
+    comp = brotli.Compressor(mode=brotli.MODE_TEXT, quality=9)
+    with open(src, "rb") as fin, open(tmp, "wb") as fout:
+        while True:
+            chunk = fin.read(_CHUNK)
+            if not chunk:
+                break
+            fout.write(comp.process(chunk))
+        fout.write(comp.finish())
+    _finish(tmp, dst, mtime)
+
+
+def _remove_quietly(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def precompress(path: str, *, gzip_level: int = 9, use_brotli: Optional[bool] = None) -> List[str]:
+    """
+    作用：
+    - 为 path 写出 path.gz（以及 path.br），失败只打印警告不抛出（原文件仍可用）。
+
+    输入：
+    - path: 已生成的输出文件
+    - gzip_level: gzip 压缩级别（1-9）
+    - use_brotli: None = 装了 brotli 就生成；False = 不生成并删除旧的 .br
+
+    输出：
+    - List[str]: 成功写出的文件路径
+    """
+
+    written: List[str] = []
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError as e:
+        print(f"[WARN] 预压缩跳过（源文件不可读）{path}: {e}", file=sys.stderr)
+        return written
+
+    gz_path = f"{path}.gz"
+    try:
+        _write_gzip(path, gz_path, mtime, max(1, min(9, int(gzip_level))))
+        written.append(gz_path)
+    except OSError as e:
+        _remove_quietly(f"{gz_path}.tmp")
+        # 写不出新的就删掉旧的，避免静态服务发出过期内容
+        _remove_quietly(gz_path)
+        print(f"[WARN] 生成 {gz_path} 失败: {e}", file=sys.stderr)
+
+    br_path = f"{path}.br"
+    want_br = (brotli is not None) if use_brotli is None else (bool(use_brotli) and brotli is not None)
+    if want_br:
+        try:
+            _write_brotli(path, br_path, mtime)
+            written.append(br_path)
+        except Exception as e:
+            _remove_quietly(f"{br_path}.tmp")
+            _remove_quietly(br_path)
+            print(f"[WARN] 生成 {br_path} 失败: {e}", file=sys.stderr)
+    else:
+        _remove_quietly(br_path)
+    return written
+
+
+def remove_precompressed(path: str) -> None:
+    """关闭预压缩时清掉旧的兄弟文件，避免静态服务继续发出过期内容。"""
+
+    for ext in (".gz", ".br"):
+        _remove_quietly(f"{path}{ext}")
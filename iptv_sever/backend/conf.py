@@ -35,6 +35,12 @@ DEFAULT_HTTP_TIMEOUT_S = 10.0
 # User-Agent：用于 urllib 请求头（有些服务端对 UA 比较敏感）
 DEFAULT_USER_AGENT = "curl/8.0.0"
 
+# 频道目录快照（M3U / EPG / 回看地址发现共用一次频道列表请求）
+# - cache_dir 为空 = 只在进程内存里缓存（命令行单独运行时每次都请求）
+# - max_age_s：快照在该秒数内直接复用，不发请求；过期后带 ETag/Last-Modified 条件请求
+DEFAULT_CATALOG_CACHE_DIR = ""
+DEFAULT_CATALOG_MAX_AGE_S = 120.0
+
 # --------- EPG/XMLTV（生成 epg.xml）---------
 
 # 默认 EPG 输出文件（相对路径会在入口脚本中固定到脚本目录）
@@ -66,6 +72,22 @@ DEFAULT_EPG_EXTRA_PARAMS = (
 DEFAULT_EPG_DAYS_FORWARD = 7
 DEFAULT_EPG_DAYS_BACK = 0
 
+# EPG 并发抓取
+# - workers：并发线程数（1 = 逐个频道串行）
+# - rate_per_s：所有线程合计的请求速率上限（次/秒，含重试；0 = 不限速）
+# - retries：单个频道失败后的重试次数（指数退避；HTTP 4xx 不重试）
+DEFAULT_EPG_WORKERS = 8
+DEFAULT_EPG_RATE_PER_S = 20.0
+DEFAULT_EPG_RETRIES = 2
+
+# EPG 增量缓存（按 频道 × 日期 持久化原始节目 JSON）
+# - cache_dir 为空 = 不启用（每次全量抓取）
+# - hot_days：今天之后多少天算“近期”，近期日期用 hot_ttl_s，更远的用 ttl_s；今天之前的日期永不过期
+DEFAULT_EPG_CACHE_DIR = ""
+DEFAULT_EPG_CACHE_HOT_DAYS = 1
+DEFAULT_EPG_CACHE_HOT_TTL_S = 43200
+DEFAULT_EPG_CACHE_TTL_S = 86400
+
 # --------- Logo 下载与本地化（可选）---------
 
 # 是否下载缺失 logo（默认下载；已存在则跳过，做到“默认一键可用”）
@@ -80,9 +102,24 @@ DEFAULT_LOGO_TIMEOUT_S = 10.0
 # logo 下载间隔（秒）：避免过快请求
 DEFAULT_LOGO_DELAY_S = 0.05
 
-# 如果本地已存在同名文件，是否跳过下载
+# 本地已存在的 logo：True = 只在记录超过 revalidate 间隔后才按 ETag/Last-Modified 重新验证；
+# False = 每次都发条件请求（304 不重新下载）
 DEFAULT_LOGO_SKIP_EXISTING = True
 
+# logo 并发下载
+# - workers：并发线程数
+# - rate_per_host：每个源站的请求速率上限（次/秒；0 = 不限速）
+# - revalidate_s：已有 logo 的重新验证间隔（秒）
+DEFAULT_LOGO_WORKERS = 8
+DEFAULT_LOGO_RATE_PER_HOST = 20.0
+DEFAULT_LOGO_REVALIDATE_S = 7 * 86400
+
+# logo 缩略图（需要 Pillow；没装时自动退回原图）
+# - variant：""=不生成；png / webp
+# - variant_size：最长边像素
+DEFAULT_LOGO_VARIANT = ""
+DEFAULT_LOGO_VARIANT_SIZE = 128
+
 # logo 保存目录：
 # - 为空字符串表示“自动”：与 out_path 同目录下创建 logos/
 #   例如：/www/iptv_sever/out/iptv.m3u -> /www/iptv_sever/out/logos/
@@ -137,6 +174,11 @@ class M3USettings:
     logo_timeout_s: float = DEFAULT_LOGO_TIMEOUT_S
     logo_delay_s: float = DEFAULT_LOGO_DELAY_S
     logo_skip_existing: bool = DEFAULT_LOGO_SKIP_EXISTING
+    logo_workers: int = DEFAULT_LOGO_WORKERS
+    logo_rate_per_host: float = DEFAULT_LOGO_RATE_PER_HOST
+    logo_revalidate_s: float = DEFAULT_LOGO_REVALIDATE_S
+    logo_variant: str = DEFAULT_LOGO_VARIANT
+    logo_variant_size: int = DEFAULT_LOGO_VARIANT_SIZE
 
 
 @dataclass(frozen=True)
@@ -169,12 +211,24 @@ class EPGSettings:
     timeout_s: float = 8.0
     sleep_s: float = 0.05
     max_channels: int = 0
+    workers: int = DEFAULT_EPG_WORKERS
+    rate_per_s: float = DEFAULT_EPG_RATE_PER_S
+    retries: int = DEFAULT_EPG_RETRIES
+
+    # 增量缓存（cache_dir 为空 = 不启用）
+    cache_dir: str = DEFAULT_EPG_CACHE_DIR
+    cache_hot_days: int = DEFAULT_EPG_CACHE_HOT_DAYS
+    cache_hot_ttl_s: float = DEFAULT_EPG_CACHE_HOT_TTL_S
+    cache_ttl_s: float = DEFAULT_EPG_CACHE_TTL_S
     user_agent: str = DEFAULT_USER_AGENT
 
     # 生成范围（按日期过滤）
     days_forward: int = DEFAULT_EPG_DAYS_FORWARD
     days_back: int = DEFAULT_EPG_DAYS_BACK
 
+    # 输出格式：True = 缩进换行，False = 紧凑
+    pretty: bool = True
+
     # icon：优先用本地 logo（如果本地存在）
     web_base_url: str = DEFAULT_WEB_BASE_URL
     logo_dir: str = DEFAULT_LOGO_DIR
@@ -18,6 +18,7 @@ import urllib.request
 from dataclasses import dataclass
 from typing import Dict, Iterable, List, Optional, Tuple
 from urllib.parse import parse_qs, urlparse
+from iptv_sever.backend.manifest import commit_output
 from iptv_sever.backend.net import is_url
 
 
@@ -82,6 +83,7 @@ class Channel:
     stream_url: str
     catchup_source: str = ""  # 回放URL模板（可选）
     catchup_path: str = ""  # 运营商回看路径，用于生成不同播放器模板
+    primaryid: str = ""  # 上游频道 id（即 XMLTV 的 channel id；logo 查找表按它对应频道）
 
 
 def _category_name(cat: Dict) -> str:
@@ -275,6 +277,7 @@ def extract_channels(categories: List[Dict], *, tvg_id_field: str = "primaryid",
                 stream_url=multi_zx,
                 catchup_source=catchup_source,
                 catchup_path=channel_catchup_path if catchup_source else "",
+                primaryid=primaryid,
             )
         )
 
@@ -331,6 +334,7 @@ def with_catchup_style(
                 stream_url=ch.stream_url,
                 catchup_source=src,
                 catchup_path=ch.catchup_path,
+                primaryid=ch.primaryid,
             )
         )
     return out
@@ -378,25 +382,18 @@ def _escape_attr(v: str) -> str:
     return (v or "").replace('"', '\\"')
 
 
-def build_extinf(ch: Channel) -> str:
-    """
-    作用：
-    - 生成一条 EXTINF 行（不含播放地址那一行）。
+def _catchup_attrs(catchup_source: str) -> str:
+    """EXTINF 中与回看模板相关的属性（随播放器 style 变化的那一段）。"""
 
-    输入：
-    - ch: Channel 频道对象
+    if not catchup_source:
+        return ""
+    return f'catchup="default" catchup-source="{_escape_attr(catchup_source)}"'
 
-    输出：
-    - str: EXTINF 行文本
-    """
 
-    parts = ["#EXTINF:-1"]
-
-    # 添加 catchup 配置（如果有）——与原仓库/旧机 .250 一致，不额外加 catchup-days
-    if ch.catchup_source:
-        parts.append('catchup="default"')
-        parts.append(f'catchup-source="{_escape_attr(ch.catchup_source)}"')
+def _extinf_attrs(ch: Channel) -> str:
+    """EXTINF 中与 style 无关的属性（tvg-id/tvg-name/tvg-logo/group-title/tvg-chno）。"""
 
+    parts: List[str] = []
     if ch.tvg_id:
         parts.append(f'tvg-id="{_escape_attr(ch.tvg_id)}"')
     if ch.tvg_name:
@@ -408,9 +405,33 @@ def build_extinf(ch: Channel) -> str:
     if ch.chno:
         # 非标准字段：部分播放器会用它排序/显示频道号
         parts.append(f'tvg-chno="{_escape_attr(ch.chno)}"')
+    return " ".join(parts)
+
 
+def _join_extinf(catchup: str, attrs: str, name: str) -> str:
+    parts = ["#EXTINF:-1"]
+    # 添加 catchup 配置（如果有）——与原仓库/旧机 .250 一致，不额外加 catchup-days
+    if catchup:
+        parts.append(catchup)
+    if attrs:
+        parts.append(attrs)
     # 逗号后面是"显示名"
-    return " ".join(parts) + f",{ch.name}"
+    return " ".join(parts) + f",{name}"
+
+
+def build_extinf(ch: Channel) -> str:
+    """
+    作用：
+    - 生成一条 EXTINF 行（不含播放地址那一行）。
+
+    输入：
+    - ch: Channel 频道对象
+
+    输出：
+    - str: EXTINF 行文本
+    """
+
+    return _join_extinf(_catchup_attrs(ch.catchup_source), _extinf_attrs(ch), ch.name)
 
 
 def generate_m3u_text(
@@ -468,3 +489,85 @@ def write_text(path: str, text: str) -> None:
         f.write(text)
 
 
+def _m3u_header(x_tvg_url: str) -> str:
+    xtvg = (x_tvg_url or "").strip()
+    if xtvg:
+        return f'#EXTM3U\n#EXT-X-TVG url-tvg="{_escape_attr(xtvg)}"\n'
+    return "#EXTM3U\n"
+
+
+def write_m3u_files(
+    channels: Iterable[Channel],
+    outputs: Dict[str, str],
+    *,
+    web_base_url: str,
+    x_tvg_url: str = "",
+    udpxy_base: str = "",
+) -> int:
+    """
+    作用：
+    - 单遍生成多套播放列表：每个频道与 style 无关的部分（属性串、udpxy 地址）只算一次，
+      只有 catchup-source 按 style 各算一次，边算边写入各自的临时文件，全部写完后再逐个提交：
+      内容与现有文件相同则跳过（不 rename、不改 mtime），否则原子 rename 并记录哈希 + 频道索引。
+      输出与 with_catchup_style() + generate_m3u_text() + write_text() 逐字节一致。
+
+    输入：
+    - channels: 频道（可以是生成器）
+    - outputs: {style: 输出路径}，style 见 build_catchup_source()（tivimate / aptv）
+    - web_base_url: 回看模板的本地 Web Base
+    - x_tvg_url: EPG 地址（可选）
+    - udpxy_base: 非空时把 rtp/udp 组播地址转换成 udpxy HTTP 地址
+
+    输出：
+    - int: 写出的频道数（任一文件写失败时删掉全部临时文件并抛出，旧文件保持不变）
+    """
+
+    if not outputs:
+        return 0
+    targets: List[Tuple[str, str, str]] = []
+    for style, path in outputs.items():
+        p = (path or "").strip()
+        if not p:
+            raise ValueError("输出路径不能为空")
+        parent = os.path.dirname(p)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        targets.append((style, p, f"{p}.tmp"))
+
+    header = _m3u_header(x_tvg_url)
+    files = []
+    count = 0
+    # 频道索引（tvg-id → 显示名）写进 .meta 记录，下次生成据此给出新增/删除/改名摘要
+    index: Dict[str, str] = {}
+    try:
+        for _style, _path, tmp in targets:
+            f = open(tmp, "w", encoding="utf-8")
+            files.append(f)
+            f.write(header)
+        for ch in channels:
+            index[ch.tvg_id or ch.name] = ch.name
+            attrs = _extinf_attrs(ch)
+            stream = convert_multicast_to_udpxy(ch.stream_url, udpxy_base) if udpxy_base else ch.stream_url
+            for (style, _path, _tmp), f in zip(targets, files):
+                src = ch.catchup_source
+                if ch.catchup_path and web_base_url:
+                    src = build_catchup_source(ch.catchup_path, web_base_url, style=style)
+                f.write(_join_extinf(_catchup_attrs(src), attrs, ch.name))
+                f.write("\n")
+                f.write(stream)
+                f.write("\n")
+            count += 1
+        for f in files:
+            f.close()
+        for _style, path, tmp in targets:
+            commit_output(tmp, path, extra={"index": index})
+    except BaseException:
+        for f in files:
+            f.close()
+        for _style, _path, tmp in targets:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+        raise
+    return count
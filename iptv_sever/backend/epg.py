@@ -12,16 +12,25 @@ EPG/XMLTV 生成核心逻辑（epg）
 from __future__ import annotations
 
 import datetime as dt
+import hashlib
 import json
+import os
 import sys
+import threading
 import time
 import urllib.error
 import urllib.parse
 import urllib.request
-import xml.etree.ElementTree as ET
-from typing import Any, Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple, TYPE_CHECKING
 
-from iptv_sever.backend.logo import logo_filename_from_url
+from iptv_sever.backend.conf import DEFAULT_EPG_RETRIES, DEFAULT_EPG_WORKERS
+from iptv_sever.backend.logo import LogoUrls, get_logo_urls
+from iptv_sever.backend.manifest import commit_output
+from iptv_sever.backend.net import TokenBucket
+
+if TYPE_CHECKING:
+    from iptv_sever.backend.epg_cache import EPGCache
 
 TZ_CN = dt.timezone(dt.timedelta(hours=8))
 
@@ -52,6 +61,7 @@ def filter_epg_by_days(
     days_back: int,
     days_forward: int,
     now: Optional[dt.datetime] = None,
+    cache: Optional["EPGCache"] = None,
 ) -> Dict[str, Dict[str, Any]]:
     """
     作用：
@@ -62,6 +72,8 @@ def filter_epg_by_days(
     - days_back: 向前保留天数（包含今天）
     - days_forward: 向后保留天数（包含今天）
     - now: 当前时间（可选，默认取现在；按中国时区计算日期）
+    - cache: EPG 增量缓存（可选）；给了时每个频道先取缓存里的日期，
+      再用 epg_by_channel 中本次抓到的覆盖（本次跳过/失败的频道传空 dict 即可）
 
     输出：
     - Dict[str, Dict[str, Any]]: 过滤后的 EPG JSON（结构同输入）
@@ -81,6 +93,8 @@ def filter_epg_by_days(
 
     out: Dict[str, Dict[str, Any]] = {}
     for cid, data in (epg_by_channel or {}).items():
+        if cache is not None:
+            data = {**cache.dates_for(cid), **(data if isinstance(data, dict) else {})}
         if not isinstance(data, dict):
             continue
         keep: Dict[str, Any] = {}
@@ -273,13 +287,6 @@ def fetch_program_list(
         return None, f"{type(e).__name__}: {e}"
 
 
-def _www_path_to_url_path(p: str) -> str:
-    x = (p or "").strip()
-    if x.startswith("/www/"):
-        return "/" + x[len("/www/") :].lstrip("/")
-    return x
-
-
 def local_icon_src(
     icon_url: str,
     *,
@@ -287,6 +294,7 @@ def local_icon_src(
     out_path: str,
     logo_dir: str,
     web_base_url: str,
+    logos: Optional[LogoUrls] = None,
 ) -> str:
     """
     作用：
@@ -294,68 +302,20 @@ def local_icon_src(
 
     输入：
     - icon_url: 频道原始 icon URL
-    - channel_id: primaryid（用于兜底文件名）
+    - channel_id: primaryid（logo 查找表里的频道 id，也用于兜底文件名）
     - out_path: epg.xml 输出路径（用于自动推导 logo_dir）
     - logo_dir: logo 保存目录（空=自动：与 out_path 同目录下 logos/）
     - web_base_url: 路由器 Web base（例如 http://192.168.1.250）
+    - logos: 已取得的 logo 查找表（批量生成时传入）；None 时按参数取 get_logo_urls()
 
     输出：
     - str: icon src URL
     """
 
-    url = (icon_url or "").strip()
-    if not url:
-        return url
-
-    ldir = (logo_dir or "").strip()
-    import os
-
-    if not ldir:
-        # logo_dir 为空，自动推导
-        out_dir = os.path.dirname(out_path) or "."
-        # 检查 out_path 的父目录名是否是 "out"
-        out_dir_name = os.path.basename(out_dir)
-        if out_dir_name == "out":
-            # 如果输出目录已经是 out/，直接使用同目录下的 logos/
-            ldir = os.path.join(out_dir, "logos")
-        else:
-            # 如果输出目录不是 out/，强制使用 out/logos/
-            # 获取 out_path 所在的基础目录（通常是 /www/iptv_sever）
-            base_dir = os.path.dirname(out_path) or "."
-            ldir = os.path.join(base_dir, "out", "logos")
-    else:
-        # logo_dir 不为空，但需要确保在 out/ 目录下
-        # 如果传入的路径不在 out/ 目录下，强制转换
-        ldir_abs = os.path.abspath(ldir)
-        out_dir_abs = os.path.dirname(os.path.abspath(out_path)) or "."
-        # 检查 logo_dir 是否在 out/ 目录下
-        if "out" not in ldir_abs.split(os.sep) or os.path.basename(os.path.dirname(ldir_abs)) != "out":
-            # 如果不在 out/ 目录下，强制使用 out/logos/
-            base_dir = os.path.dirname(os.path.abspath(out_path)) or "."
-            # 如果 out_path 已经在 out/ 目录下，使用 out/logos/
-            if os.path.basename(base_dir) == "out":
-                ldir = os.path.join(base_dir, "logos")
-            else:
-                # 如果 out_path 不在 out/ 目录下，使用 base_dir/out/logos/
-                ldir = os.path.join(base_dir, "out", "logos")
-
-    fn = logo_filename_from_url(url, fallback_stem=channel_id)
-    local_path = os.path.join(ldir, fn)
-    if not (os.path.exists(local_path) and os.path.getsize(local_path) > 0):
-        return url
-
-    base = (web_base_url or "").rstrip("/")
-    # 确保路径以 /out/logos 开头（Flask 路由是 /out/<path:filename>）
-    ldir_str = str(ldir)
-    # 查找 /out/logos 在路径中的位置
-    out_logos_idx = ldir_str.find("/out/logos")
-    if out_logos_idx >= 0:
-        # 直接使用 /out/logos 作为 URL 路径
-        web_dir = "/out/logos"
-    else:
-        # 回退到原来的逻辑
-        web_dir = _www_path_to_url_path(ldir).rstrip("/")
-    return f"{base}{web_dir}/{fn}" if base else f"{web_dir}/{fn}"
+    if logos is None:
+        logos = get_logo_urls(out_path, logo_dir, web_base_url)
+    # 与 M3U 的 tvg-logo 查同一张表（缩略图 > 内容寻址原图 > 旧文件名）
+    return logos.resolve(icon_url, channel_id=channel_id)
 
 
 def extract_epg_channels(categories: List[Dict[str, Any]]) -> List[Dict[str, str]]:
@@ -395,51 +355,27 @@ def extract_epg_channels(categories: List[Dict[str, Any]]) -> List[Dict[str, str
     return channels
 
 
-def build_xmltv(
-    *,
-    channels: List[Dict[str, str]],
+XMLTV_ROOT_ATTRS = {
+    "generator-info-name": "iptv_sever-xmltv",
+    "source-info-name": "cms.99tv.com.cn",
+    "source-info-url": "http://cms.99tv.com.cn:99/",
+}
+
+
+def iter_programmes(
     epg_by_channel: Dict[str, Dict[str, Any]],
-    out_path: str,
-    logo_dir: str,
-    web_base_url: str,
-) -> ET.ElementTree:
+) -> Iterator[Tuple[str, Dict[str, str], str]]:
     """
     作用：
-    - 构建 XMLTV 的 ElementTree（tv/channel/programme）。
+    - 逐条产出 <programme> 所需数据（跳过无标题/时间非法的条目），供树构建和流式写出共用。
 
     输入：
-    - channels: 频道列表（id/name/icon）
     - epg_by_channel: 每个频道的节目 JSON（按日期分组）
-    - out_path/logo_dir/web_base_url: 用于 icon 本地化
 
     输出：
-    - ElementTree: 可直接 write() 成 epg.xml
+    - 迭代 (channelId, programme 属性 dict, 节目标题)
     """
 
-    tv = ET.Element(
-        "tv",
-        {
-            "generator-info-name": "iptv_sever-xmltv",
-            "source-info-name": "cms.99tv.com.cn",
-            "source-info-url": "http://cms.99tv.com.cn:99/",
-        },
-    )
-
-    for ch in channels:
-        ce = ET.SubElement(tv, "channel", {"id": ch["id"]})
-        dn = ET.SubElement(ce, "display-name")
-        dn.text = str(ch.get("name") or ch["id"])
-        icon = (ch.get("icon") or "").strip()
-        if icon:
-            src = local_icon_src(
-                icon,
-                channel_id=ch["id"],
-                out_path=out_path,
-                logo_dir=logo_dir,
-                web_base_url=web_base_url,
-            )
-            ET.SubElement(ce, "icon", {"src": src})
-
     for cid, data in (epg_by_channel or {}).items():
         for date_key, items in (data or {}).items():
             if not isinstance(items, list):
@@ -469,37 +405,119 @@ def build_xmltv(
                 attrs = {"channel": cid, "start": xmltv_ts(start_dt)}
                 if stop_dt is not None:
                     attrs["stop"] = xmltv_ts(stop_dt)
-                pe = ET.SubElement(tv, "programme", attrs)
-                title = ET.SubElement(pe, "title", {"lang": "zh"})
-                title.text = program_name
-
-    return ET.ElementTree(tv)
-
-
-def indent(elem: ET.Element, level: int = 0) -> None:
+                yield cid, attrs, program_name
+
+
+def _channel_icon_src(ch: Dict[str, str], logos: LogoUrls) -> str:
+    icon = (ch.get("icon") or "").strip()
+    if not icon:
+        return ""
+    return logos.resolve(icon, channel_id=ch["id"])
+
+
+def _xml_text(s: str) -> str:
+    # 与 ElementTree 的文本转义一致
+    if "&" in s:
+        s = s.replace("&", "&amp;")
+    if "<" in s:
+        s = s.replace("<", "&lt;")
+    if ">" in s:
+        s = s.replace(">", "&gt;")
+    return s
+
+
+def _xml_attrs(attrs: Dict[str, str]) -> str:
+    # 与 ElementTree 的属性转义一致（含换行/制表符）
+    out = []
+    for k, v in attrs.items():
+        v = _xml_text(str(v))
+        if '"' in v:
+            v = v.replace('"', "&quot;")
+        if "\r" in v:
+            v = v.replace("\r", "&#13;")
+        if "\n" in v:
+            v = v.replace("\n", "&#10;")
+        if "\t" in v:
+            v = v.replace("\t", "&#09;")
+        out.append(f' {k}="{v}"')
+    return "".join(out)
+
+
+def write_xmltv(
+    *,
+    channels: List[Dict[str, str]],
+    epg_by_channel: Dict[str, Dict[str, Any]],
+    out_path: str,
+    logo_dir: str,
+    web_base_url: str,
+    pretty: bool = True,
+) -> int:
     """
     作用：
-    - 对 ElementTree 做缩进美化（Python 3.8 兼容）。
+    - 流式写出 XMLTV：频道和节目逐条写入同目录临时文件，完成后提交到 out_path：
+      内容与现有文件相同则跳过（不 rename、不改 mtime），否则原子 rename 并记录哈希。
+      不构建 ElementTree，峰值内存与节目数无关；转义规则与 ElementTree 相同，标准 XMLTV 解析器可直接读取。
+    - 记录里附带每个频道节目的摘要（index）和节目总数，供下次生成给出变化摘要。
 
     输入：
-    - elem: 根元素
-    - level: 缩进层级
+    - channels: 频道列表（id/name/icon）
+    - epg_by_channel: 每个频道的节目 JSON（按日期分组）
+    - out_path: 输出 epg.xml 路径
+    - logo_dir/web_base_url: 用于 icon 本地化
+    - pretty: 是否缩进换行（False 时输出紧凑 XML，体积更小）
 
     输出：
-    - None（原地修改 elem）
+    - int: 写出的 programme 条数
     """
 
-    i = "\n" + level * "  "
-    if len(elem):
-        if not elem.text or not elem.text.strip():
-            elem.text = i + "  "
-        for e in elem:
-            indent(e, level + 1)
-        if not elem.tail or not elem.tail.strip():
-            elem.tail = i
-    else:
-        if level and (not elem.tail or not elem.tail.strip()):
-            elem.tail = i
+    nl1 = "\n  " if pretty else ""
+    nl2 = "\n    " if pretty else ""
+    count = 0
+    digests: Dict[str, Any] = {ch["id"]: None for ch in channels}
+    logos = get_logo_urls(out_path, logo_dir, web_base_url)
+
+    out_dir = os.path.dirname(out_path) or "."
+    os.makedirs(out_dir, exist_ok=True)
+    tmp = f"{out_path}.tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8", newline="\n", buffering=256 * 1024) as f:
+            w = f.write
+            w("<?xml version='1.0' encoding='utf-8'?>\n")
+            w(f"<tv{_xml_attrs(XMLTV_ROOT_ATTRS)}>")
+            for ch in channels:
+                name = _xml_text(str(ch.get("name") or ch["id"]))
+                src = _channel_icon_src(ch, logos)
+                w(f'{nl1}<channel{_xml_attrs({"id": ch["id"]})}>{nl2}<display-name>{name}</display-name>')
+                if src:
+                    w(f'{nl2}<icon{_xml_attrs({"src": src})} />')
+                w(f"{nl1}</channel>")
+            for cid, attrs, program_name in iter_programmes(epg_by_channel):
+                text = (
+                    f'{nl1}<programme{_xml_attrs(attrs)}>{nl2}<title lang="zh">{_xml_text(program_name)}</title>'
+                    f"{nl1}</programme>"
+                )
+                w(text)
+                h = digests.get(cid)
+                if h is None:
+                    h = digests[cid] = hashlib.sha1()
+                h.update(text.encode("utf-8"))
+                count += 1
+            w("\n</tv>\n" if pretty else "</tv>")
+        index = {cid: (h.hexdigest()[:16] if h is not None else "") for cid, h in digests.items()}
+        commit_output(tmp, out_path, extra={"index": index, "programmes": count})
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    return count
+
+
+def _retryable(meta: str) -> bool:
+    """HTTP 4xx（参数/鉴权错误）重试也没用；超时、连接错误、5xx、非 JSON 响应值得再试。"""
+
+    return not str(meta or "").startswith("HTTPError 4")
 
 
 def run_epg(
@@ -514,51 +532,113 @@ def run_epg(
     opener: Optional[urllib.request.OpenerDirector],
     sleep_s: float,
     max_channels: int,
-) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, int]]:
+    workers: int = DEFAULT_EPG_WORKERS,
+    rate_per_s: Optional[float] = None,
+    retries: int = DEFAULT_EPG_RETRIES,
+    backoff_s: float = 0.5,
+    progress_every_s: float = 5.0,
+    cancel: Optional[threading.Event] = None,
+) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, Any]]:
     """
     作用：
-    - 批量抓取频道节目单（EPG JSON）。
+    - 并发抓取频道节目单（EPG JSON）：线程池 + 共享令牌桶限速 + 单频道失败重试。
 
     输入：
     - channels: 频道列表
     - base_url/riddle/time_ms/extra_params: EPG 请求参数
     - ua/timeout_s/opener: 请求参数
-    - sleep_s: 每个频道请求间隔
+    - sleep_s: 旧的“每个频道请求间隔”；未指定 rate_per_s 时折算为 1/sleep_s 次/秒
     - max_channels: 0=不限制
+    - workers: 并发线程数（1 = 串行）
+    - rate_per_s: 全局请求速率上限（次/秒，含重试；0 = 不限速）
+    - retries: 单频道失败后的重试次数（HTTP 4xx 不重试）
+    - backoff_s: 首次重试前等待秒数，之后每次翻倍
+    - progress_every_s: 进度输出间隔秒数（同时每 50 个频道输出一次）
+    - cancel: 取消事件；置位后尚未开始的频道直接跳过（不计入 ok/fail）
 
     输出：
     - (epg_by_channel, stats)
+      - epg_by_channel 按频道列表原顺序排列
+      - stats: ok/fail/retried/elapsed_s
     """
 
-    epg_by_channel: Dict[str, Dict[str, Any]] = {}
-    stats = {"ok": 0, "fail": 0}
-
     use_list = channels[: max_channels] if max_channels and max_channels > 0 else channels
-    for idx, ch in enumerate(use_list, 1):
-        cid = ch["id"]
-        data, meta = fetch_program_list(
-            base_url=base_url,
-            channel_id=cid,
-            riddle=riddle,
-            time_ms=time_ms,
-            extra_params=extra_params,
-            ua=ua,
-            timeout_s=timeout_s,
-            opener=opener,
-        )
-        if isinstance(data, dict):
-            epg_by_channel[cid] = data
-            stats["ok"] += 1
-        else:
-            stats["fail"] += 1
-            print(f"[WARN] channelId={cid} fetch_failed: {meta}", file=sys.stderr)
-
-        if sleep_s and sleep_s > 0:
-            time.sleep(float(sleep_s))
-
-        if idx % 50 == 0:
-            print(f"[INFO] progress {idx}/{len(use_list)} ok={stats['ok']} fail={stats['fail']}", file=sys.stderr)
+    total = len(use_list)
+
+    if rate_per_s is None:
+        rate_per_s = (1.0 / float(sleep_s)) if sleep_s and sleep_s > 0 else 0.0
+    n_workers = max(1, min(int(workers or 1), total or 1))
+    # 突发上限跟并发数一致：开始时每个线程都能立刻发出第一个请求
+    bucket = TokenBucket(rate_per_s, burst=n_workers)
+
+    results: Dict[str, Dict[str, Any]] = {}
+    stats: Dict[str, Any] = {"ok": 0, "fail": 0, "retried": 0}
+    lock = threading.Lock()
+    t0 = time.monotonic()
+    last_report = [t0]
+
+    def _fetch_one(cid: str) -> None:
+        attempt = 0
+        while True:
+            if cancel is not None and cancel.is_set():
+                return
+            bucket.acquire()
+            data, meta = fetch_program_list(
+                base_url=base_url,
+                channel_id=cid,
+                riddle=riddle,
+                time_ms=time_ms,
+                extra_params=extra_params,
+                ua=ua,
+                timeout_s=timeout_s,
+                opener=opener,
+            )
+            if isinstance(data, dict):
+                break
+            if attempt >= retries or not _retryable(meta):
+                break
+            delay = float(backoff_s) * (2 ** attempt)
+            attempt += 1
+            with lock:
+                stats["retried"] += 1
+            print(f"[WARN] channelId={cid} 第 {attempt} 次重试（{delay:.1f}s 后）: {meta}", file=sys.stderr)
+            time.sleep(delay)
+
+        with lock:
+            if isinstance(data, dict):
+                results[cid] = data
+                stats["ok"] += 1
+            else:
+                stats["fail"] += 1
+                print(f"[WARN] channelId={cid} fetch_failed: {meta}", file=sys.stderr)
+
+            done = stats["ok"] + stats["fail"]
+            now = time.monotonic()
+            if done % 50 == 0 or now - last_report[0] >= progress_every_s:
+                last_report[0] = now
+                print(
+                    f"[INFO] progress {done}/{total} ok={stats['ok']} fail={stats['fail']} "
+                    f"retried={stats['retried']} elapsed={now - t0:.1f}s",
+                    file=sys.stderr,
+                )
+
+    if n_workers == 1:
+        for ch in use_list:
+            _fetch_one(ch["id"])
+    else:
+        with ThreadPoolExecutor(max_workers=n_workers, thread_name_prefix="epg") as pool:
+            for fut in [pool.submit(_fetch_one, ch["id"]) for ch in use_list]:
+                fut.result()
+
+    stats["elapsed_s"] = round(time.monotonic() - t0, 2)
+    print(
+        f"[INFO] EPG 抓取完成 {total} 个频道 ok={stats['ok']} fail={stats['fail']} "
+        f"retried={stats['retried']} workers={n_workers} rate={rate_per_s or '不限'}/s "
+        f"耗时 {stats['elapsed_s']}s",
+        file=sys.stderr,
+    )
 
+    epg_by_channel = {ch["id"]: results[ch["id"]] for ch in use_list if ch["id"] in results}
     return epg_by_channel, stats
 
 
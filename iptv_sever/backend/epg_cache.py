@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+EPG 增量缓存（epg_cache）
+
+职责：
+- 按 (channelId, YYYYMMDD) 持久化 fetch_program_list() 返回的原始节目 JSON，附内容哈希
+- 判断哪些频道需要重新抓取：过去的日期永不过期，今天/近几天短 TTL，更远的日期长 TTL
+- 抓取失败或本次跳过的频道直接用缓存补齐，filter_epg_by_days() 从这里读
+
+说明：
+- 上游接口一次返回一个频道的全部日期，无法只拉某一天；所以“是否抓取”按频道判断，
+  但新旧数据按日期逐条比对哈希，只有变化的日期才替换内容（changed_at 记录最近一次变化）。
+- 每个频道一个 JSON 文件（<cache_dir>/<channelId>.json），写入走临时文件 + rename。
+"""
+
+from __future__ import annotations
+
+import datetime as dt
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+CACHE_VERSION = 1
+
+_SAFE_NAME_RE = re.compile(r"[^0-9A-Za-z_.-]")
+
+
+def items_hash(items: Any) -> str:
+    """
+    作用：
+    - 计算某一天节目列表的内容哈希（键排序后的紧凑 JSON 的 sha1）。
+
+    输入：
+    - items: 该日期下的节目条目（通常是 list）
+
+    输出：
+    - str: 40 位十六进制
+    """
+
+    raw = json.dumps(items, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def _date_key(d: dt.date) -> str:
+    return d.strftime("%Y%m%d")
+
+
+class EPGCache:
+    """
+    作用：
+    - 频道 × 日期粒度的 EPG 原始数据缓存（磁盘持久化，进程内全量加载）。
+
+    输入：
+    - cache_dir: 缓存目录（不存在会自动创建）
+    - hot_days: 今天之后多少天算“近期”（0 = 只有今天）
+    - hot_ttl_s: 今天及近期日期的有效秒数
+    - ttl_s: 更远日期的有效秒数
+    - keep_days: 今天之前保留多少天（更早的日期在 prune() 时删除）
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        *,
+        hot_days: int = 1,
+        hot_ttl_s: float = 43200,
+        ttl_s: float = 86400,
+        keep_days: int = 7,
+    ) -> None:
+        self.cache_dir = str(cache_dir)
+        self.hot_days = max(0, int(hot_days))
+        self.hot_ttl_s = max(0.0, float(hot_ttl_s))
+        self.ttl_s = max(0.0, float(ttl_s))
+        self.keep_days = max(0, int(keep_days))
+
+        # cid -> {"fetched_at": ts, "dates": {YYYYMMDD: {"hash", "fetched_at", "changed_at", "items"}}}
+        self._channels: Dict[str, Dict[str, Any]] = {}
+        self._dirty: set = set()
+        self.stats: Dict[str, int] = {
+            "loaded": 0,
+            "skipped": 0,
+            "fetched": 0,
+            "dates_changed": 0,
+            "dates_unchanged": 0,
+            "dates_pruned": 0,
+            "written": 0,
+        }
+        self._load()
+
+    # ---------- 磁盘 ----------
+
+    def _path(self, cid: str) -> str:
+        name = _SAFE_NAME_RE.sub("_", str(cid)) or "_"
+        return os.path.join(self.cache_dir, f"{name}.json")
+
+    def _load(self) -> None:
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            entries = list(os.scandir(self.cache_dir))
+        except OSError as e:
+            print(f"[WARN] EPG 缓存目录不可用 {self.cache_dir}: {e}", file=sys.stderr)
+            return
+        for ent in entries:
+            if not ent.name.endswith(".json") or not ent.is_file():
+                continue
+            try:
+                with open(ent.path, "r", encoding="utf-8") as f:
+                    doc = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"[WARN] 忽略损坏的 EPG 缓存 {ent.name}: {e}", file=sys.stderr)
+                continue
+            if not isinstance(doc, dict) or doc.get("v") != CACHE_VERSION or not doc.get("id"):
+                continue
+            dates = doc.get("dates")
+            if not isinstance(dates, dict):
+                continue
+            self._channels[str(doc["id"])] = {
+                "fetched_at": float(doc.get("fetched_at") or 0),
+                "dates": dates,
+            }
+        self.stats["loaded"] = len(self._channels)
+
+    def save(self) -> int:
+        """
+        作用：
+        - 把本次有变化的频道写回磁盘（临时文件 + rename）。
+
+        输出：
+        - int: 写入的文件数
+        """
+
+        n = 0
+        for cid in sorted(self._dirty):
+            entry = self._channels.get(cid)
+            path = self._path(cid)
+            if entry is None:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    print(f"[WARN] 删除 EPG 缓存失败 {path}: {e}", file=sys.stderr)
+                continue
+            doc = {"v": CACHE_VERSION, "id": cid, "fetched_at": entry["fetched_at"], "dates": entry["dates"]}
+            tmp = f"{path}.tmp"
+            try:
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(doc, f, ensure_ascii=False, separators=(",", ":"))
+                os.replace(tmp, path)
+                n += 1
+            except OSError as e:
+                print(f"[WARN] 写入 EPG 缓存失败 {path}: {e}", file=sys.stderr)
+        self._dirty.clear()
+        self.stats["written"] += n
+        return n
+
+    # ---------- 判断 / 读写 ----------
+
+    def _date_ttl(self, d: dt.date, today: dt.date) -> Optional[float]:
+        """None 表示永不过期（今天之前的日期）。"""
+
+        if d < today:
+            return None
+        if d <= today + dt.timedelta(days=self.hot_days):
+            return self.hot_ttl_s
+        return self.ttl_s
+
+    def needs_fetch(self, cid: str, *, today: dt.date, days_forward: int, now: Optional[float] = None) -> bool:
+        """
+        作用：
+        - 判断某频道本次是否需要请求上游。
+
+        规则：
+        - 从没抓过：要
+        - [today, today+days_forward] 内任一日期缓存过期：要
+        - 窗口内缺某个日期（上游可能本来就只给几天）：距上次抓取超过 hot_ttl_s 才再要
+        - 今天之前的日期不参与判断
+        """
+
+        now_ts = time.time() if now is None else now
+        entry = self._channels.get(str(cid))
+        if entry is None:
+            return True
+        dates = entry["dates"]
+        channel_age = now_ts - float(entry.get("fetched_at") or 0)
+        for i in range(max(0, int(days_forward)) + 1):
+            d = today + dt.timedelta(days=i)
+            rec = dates.get(_date_key(d))
+            if rec is None:
+                if channel_age > self.hot_ttl_s:
+                    return True
+                continue
+            ttl = self._date_ttl(d, today)
+            if ttl is not None and now_ts - float(rec.get("fetched_at") or 0) > ttl:
+                return True
+        return False
+
+    def select_stale(
+        self,
+        channel_ids: Iterable[str],
+        *,
+        today: dt.date,
+        days_forward: int,
+    ) -> List[str]:
+        """返回需要抓取的频道 ID（保持输入顺序），并记录跳过数。"""
+
+        now_ts = time.time()
+        ids = [str(c) for c in channel_ids]
+        out = [c for c in ids if self.needs_fetch(c, today=today, days_forward=days_forward, now=now_ts)]
+        self.stats["skipped"] += len(ids) - len(out)
+        return out
+
+    def update(self, cid: str, data: Dict[str, Any], *, now: Optional[float] = None) -> int:
+        """
+        作用：
+        - 合并一次成功抓取的结果：逐日期比对哈希，只有内容变化的日期才替换。
+
+        输入：
+        - cid: 频道 ID
+        - data: fetch_program_list() 返回的 {YYYYMMDD: [items...]}
+
+        输出：
+        - int: 内容有变化的日期数
+        """
+
+        now_ts = time.time() if now is None else now
+        cid = str(cid)
+        entry = self._channels.setdefault(cid, {"fetched_at": 0.0, "dates": {}})
+        dates = entry["dates"]
+        changed = 0
+        for date_key, items in (data or {}).items():
+            key = str(date_key)
+            if len(key) != 8 or not key.isdigit():
+                continue
+            h = items_hash(items)
+            rec = dates.get(key)
+            if rec is not None and rec.get("hash") == h:
+                rec["fetched_at"] = now_ts
+                self.stats["dates_unchanged"] += 1
+                continue
+            dates[key] = {"hash": h, "fetched_at": now_ts, "changed_at": now_ts, "items": items}
+            changed += 1
+        entry["fetched_at"] = now_ts
+        self.stats["fetched"] += 1
+        self.stats["dates_changed"] += changed
+        # fetched_at 变了也要落盘，否则下次仍会判定过期
+        self._dirty.add(cid)
+        return changed
+
+    def dates_for(self, cid: str) -> Dict[str, Any]:
+        """某频道缓存中的 {YYYYMMDD: items}（没有则为空 dict）。"""
+
+        entry = self._channels.get(str(cid))
+        if entry is None:
+            return {}
+        return {k: rec.get("items") for k, rec in entry["dates"].items()}
+
+    def prune(self, *, today: dt.date, keep_channels: Optional[Iterable[str]] = None) -> int:
+        """
+        作用：
+        - 删除 today-keep_days 之前的日期；给了 keep_channels 时顺带删除已下线频道的缓存。
+
+        输出：
+        - int: 删除的日期条目数
+        """
+
+        cutoff = _date_key(today - dt.timedelta(days=self.keep_days))
+        keep = {str(c) for c in keep_channels} if keep_channels is not None else None
+        removed = 0
+        for cid in list(self._channels):
+            if keep is not None and cid not in keep:
+                removed += len(self._channels[cid]["dates"])
+                del self._channels[cid]
+                self._dirty.add(cid)
+                continue
+            dates = self._channels[cid]["dates"]
+            old = [k for k in dates if k < cutoff]
+            for k in old:
+                del dates[k]
+            if old:
+                removed += len(old)
+                self._dirty.add(cid)
+        self.stats["dates_pruned"] += removed
+        return removed
+
+    def __contains__(self, cid: object) -> bool:
+        return str(cid) in self._channels
+
+    def __len__(self) -> int:
+        return len(self._channels)
@@ -5,20 +5,62 @@
 Logo 下载与本地化（logo）
 
 职责：
-- 下载频道 logo 到本地目录
+- 下载频道 logo 到本地目录（线程池并发 + 按源站限速）
+- 已有 logo 按 ETag / Last-Modified 条件请求重新验证（元数据在 <logo_dir>/.logo_index.json）
+- 内容寻址存储：图片按内容哈希存到 <logo_dir>/sha/<哈希>.<扩展名>，多个频道同图只存一份
+- 可选缩略图（装了 Pillow 时）：<哈希>.<边长>.<png|webp>，tvg-logo / XMLTV icon 优先指向它
 - 把 tvg-logo 重写成可访问的本地 URL
+
+说明：
+- 开始时只扫描一次 logo 目录，之后不再逐个 stat
+- 下载写临时文件 + rename，播放器不会拿到写了一半的图片
+- 升级前按 URL 文件名存的旧 logo 会硬链接进 sha/（不占额外空间），旧文件本身不删
 """
 
 from __future__ import annotations
 
+import dataclasses
+import hashlib
+import json
+import shutil
 import os
+import sys
+import threading
 import time
+import urllib.error
+import urllib.parse
 import urllib.request
-from typing import Dict, List, Optional, Tuple, TYPE_CHECKING
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Tuple, TYPE_CHECKING
+
+from iptv_sever.backend.conf import (
+    DEFAULT_LOGO_REVALIDATE_S,
+    DEFAULT_LOGO_VARIANT,
+    DEFAULT_LOGO_VARIANT_SIZE,
+    DEFAULT_LOGO_WORKERS,
+)
+from iptv_sever.backend.net import TokenBucket
+
+try:
+    from PIL import Image  # type: ignore
+except ImportError:  # 可选依赖：没装就不生成缩略图，直接用原图
+    Image = None
 
 if TYPE_CHECKING:
     from iptv_sever.backend.core import Channel
 
+LOGO_INDEX_NAME = ".logo_index.json"
+LOGO_STORE_DIRNAME = "sha"
+LOGO_VARIANT_FORMATS = ("png", "webp")
+
+# 按文件头判断图片类型（内容寻址后文件名不再沿用 URL 的扩展名）
+_MAGIC = (
+    (b"\x89PNG\r\n\x1a\n", ".png"),
+    (b"\xff\xd8\xff", ".jpg"),
+    (b"GIF87a", ".gif"),
+    (b"GIF89a", ".gif"),
+)
+
 
 def _safe_filename(name: str) -> str:
     """
@@ -85,82 +127,119 @@ def _www_path_to_url_path(p: str) -> str:
     return x
 
 
-def download_logo(
+def _sniff_ext(data: bytes, fallback_name: str) -> str:
+    for magic, ext in _MAGIC:
+        if data.startswith(magic):
+            return ext
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return ".webp"
+    head = data[:256].lstrip().lower()
+    if head.startswith(b"<svg") or (head.startswith(b"<?xml") and b"<svg" in head):
+        return ".svg"
+    ext = os.path.splitext(fallback_name)[1].lower()
+    return ext if ext and len(ext) <= 5 else ".png"
+
+
+def fetch_logo(
     logo_url: str,
     *,
-    save_path: str,
     opener: Optional[urllib.request.OpenerDirector],
     timeout_s: float,
     user_agent: str,
-) -> bool:
+    etag: str = "",
+    last_modified: str = "",
+) -> Tuple[str, Dict[str, Any], bytes]:
     """
     作用：
-    - 下载单个 logo 到指定路径。
+    - 下载（或条件请求重新验证）单个 logo，只返回内容，不落盘。
 
     输入：
     - logo_url: logo 的 http URL
-    - save_path: 本地保存路径（完整路径）
-    - opener: urllib opener（可选）
-    - timeout_s: 超时秒数
-    - user_agent: 请求 UA
+    - opener/timeout_s/user_agent: 请求参数
+    - etag/last_modified: 上次响应的校验头（非空时发 If-None-Match / If-Modified-Since）
 
     输出：
-    - bool: 下载成功 True，否则 False
+    - (status, meta, data)：status 为 downloaded / not_modified / failed；
+      meta 含本次响应的 etag/last_modified（failed 时含 error）
     """
 
     u = (logo_url or "").strip()
     if not u:
-        return False
+        return "failed", {"error": "empty url"}, b""
 
-    os.makedirs(os.path.dirname(save_path) or ".", exist_ok=True)
+    headers = {"User-Agent": user_agent}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
     op = opener or urllib.request.build_opener()
-    req = urllib.request.Request(u, headers={"User-Agent": user_agent})
+    req = urllib.request.Request(u, headers=headers)
     try:
         with op.open(req, timeout=timeout_s) as resp:
             data = resp.read()
-        with open(save_path, "wb") as f:
+            meta = {
+                "etag": resp.headers.get("ETag", "") or "",
+                "last_modified": resp.headers.get("Last-Modified", "") or "",
+            }
+    except urllib.error.HTTPError as e:
+        if e.code == 304 and (etag or last_modified):
+            return "not_modified", {}, b""
+        return "failed", {"error": f"HTTP {e.code}"}, b""
+    except Exception as e:
+        return "failed", {"error": f"{type(e).__name__}: {e}"}, b""
+    if not data:
+        return "failed", {"error": "empty body"}, b""
+    return "downloaded", meta, data
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    tmp = f"{path}.tmp.{threading.get_ident()}"
+    try:
+        with open(tmp, "wb") as f:
             f.write(data)
-        return True
-    except Exception:
-        return False
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
 
 
-def localize_logos(
-    channels: List["Channel"],
+def download_logo(
+    logo_url: str,
     *,
-    out_path: str,
-    logo_dir: str,
-    web_base_url: str,
+    save_path: str,
     opener: Optional[urllib.request.OpenerDirector],
     timeout_s: float,
-    delay_s: float,
-    skip_existing: bool,
-    download_missing: bool,
     user_agent: str,
-) -> Tuple[List["Channel"], Dict[str, int]]:
+) -> bool:
     """
     作用：
-    - 下载频道 logo 到本地目录，并把每个 Channel.tvg_logo 重写为本地可访问 URL。
-
-    输入：
-    - channels: 频道列表
-    - out_path: m3u 输出路径（用于自动推导 logo_dir）
-    - logo_dir: logo 目录；为空表示自动使用“out_path 同目录下 logos/”
-    - web_base_url: Web 基础地址（例如 http://192.168.1.250）
-    - opener/timeout_s/user_agent: 下载用的请求参数
-    - delay_s: 两次下载之间 sleep 秒数
-    - skip_existing: 已存在同名文件时是否跳过下载
-    - download_missing: 本地缺失时是否下载（False=只重写不下载）
+    - 下载单个 logo 到指定路径（无条件下载，不进内容寻址存储）。
 
     输出：
-    - (new_channels, stats):
-      - new_channels: tvg_logo 已替换成本地 URL 的频道列表
-      - stats: 统计信息（downloaded/skipped/failed/rewritten）
+    - bool: 下载成功 True，否则 False
     """
 
-    from iptv_sever.backend.core import Channel  # 避免循环 import（仅在运行时需要）
+    status, _meta, data = fetch_logo(logo_url, opener=opener, timeout_s=timeout_s, user_agent=user_agent)
+    if status != "downloaded":
+        return False
+    try:
+        os.makedirs(os.path.dirname(save_path) or ".", exist_ok=True)
+        _write_atomic(save_path, data)
+        return True
+    except OSError:
+        return False
+
+
+def resolve_logo_dir(out_path: str, logo_dir: str) -> str:
+    """
+    作用：
+    - 确定 logo 目录：为空时自动使用 out_path 同目录下 logos/；并确保目录位于 out/ 下
+      （/out 静态服务只暴露 out/）。
+    """
 
-    # 自动推导 logo_dir：与 out_path 同目录，但确保在 out/ 目录下
     ldir = (logo_dir or "").strip()
     if not ldir:
         # logo_dir 为空，自动推导
@@ -179,7 +258,6 @@ def localize_logos(
         # logo_dir 不为空，但需要确保在 out/ 目录下
         # 如果传入的路径不在 out/ 目录下，强制转换
         ldir_abs = os.path.abspath(ldir)
-        out_dir_abs = os.path.dirname(os.path.abspath(out_path)) or "."
         # 检查 logo_dir 是否在 out/ 目录下
         if "out" not in ldir_abs.split(os.sep) or os.path.basename(os.path.dirname(ldir_abs)) != "out":
             # 如果不在 out/ 目录下，强制使用 out/logos/
@@ -190,80 +268,536 @@ def localize_logos(
             else:
                 # 如果 out_path 不在 out/ 目录下，使用 base_dir/out/logos/
                 ldir = os.path.join(base_dir, "out", "logos")
+    return ldir
+
+
+def logo_url_prefix(ldir: str, web_base_url: str) -> str:
+    """
+    作用：
+    - logo 目录对应的本地 URL 前缀（web_base_url + /out/logos）。
+    """
 
-    # 本地 URL 前缀：web_base_url + 映射后的路径
-    # 确保路径以 /out/ 开头（Flask 路由是 /out/<path:filename>）
+    # 确保路径以 /out/ 开头（路由是 /out/<path:filename>）
     base = (web_base_url or "").rstrip("/")
     # 从 logo_dir 中提取 /out/logos 部分
-    ldir_str = str(ldir)
-    # 查找 /out/logos 在路径中的位置
-    out_logos_idx = ldir_str.find("/out/logos")
-    if out_logos_idx >= 0:
+    if str(ldir).find("/out/logos") >= 0:
         # 直接使用 /out/logos 作为 URL 路径
         url_path = "/out/logos"
     else:
         # 回退到原来的逻辑
         url_path = _www_path_to_url_path(ldir)
-    url_prefix = base + url_path
-    url_prefix = url_prefix.rstrip("/")
+    return (base + url_path).rstrip("/")
+
+
+def scan_logo_dir(ldir: str) -> Dict[str, int]:
+    """
+    作用：
+    - 一次扫描 logo 目录，返回 {文件名: 字节数}（只含非空普通文件，忽略隐藏/临时文件）。
+    """
+
+    present: Dict[str, int] = {}
+    try:
+        with os.scandir(ldir) as it:
+            for e in it:
+                if e.name.startswith(".") or ".tmp" in e.name:
+                    continue
+                try:
+                    if e.is_file():
+                        size = e.stat().st_size
+                        if size > 0:
+                            present[e.name] = size
+                except OSError:
+                    continue
+    except FileNotFoundError:
+        pass
+    return present
+
+
+class LogoIndex:
+    """
+    作用：
+    - logo 目录的内存视图：一次扫描（旧文件名 + sha/ 存储）+ .logo_index.json。
+
+    说明：
+    - files: {URL 文件名: {url, etag, last_modified, checked_at, file, variant, variant_spec}}
+      file / variant 是 sha/ 下的内容寻址文件名
+    - channels: {频道 id（channel_logo_key）: sha/ 下的文件名}，M3U 与 XMLTV 按频道直接查
+    """
+
+    def __init__(self, ldir: str) -> None:
+        self.ldir = ldir
+        self.store_dir = os.path.join(ldir, LOGO_STORE_DIRNAME)
+        self.legacy = scan_logo_dir(ldir)
+        self.stored = scan_logo_dir(self.store_dir)
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self.channels: Dict[str, str] = {}
+        self.dirty = False
+        self._load()
+
+    def _load(self) -> None:
+        try:
+            with open(os.path.join(self.ldir, LOGO_INDEX_NAME), "r", encoding="utf-8") as f:
+                doc = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"[WARN] 忽略损坏的 logo 索引: {e}", file=sys.stderr)
+            return
+        if not isinstance(doc, dict):
+            return
+        if isinstance(doc.get("files"), dict):
+            self.files = doc["files"]
+        if isinstance(doc.get("channels"), dict):
+            self.channels = doc["channels"]
+
+    def original_name(self, fn: str) -> str:
+        """fn 对应的 sha/ 原图文件名（不存在返回空串）。"""
+
+        name = str((self.files.get(fn) or {}).get("file") or "")
+        return name if name in self.stored else ""
+
+    def served_name(self, fn: str) -> str:
+        """
+        作用：
+        - fn 应该对外提供的文件（相对 logo 目录）：缩略图 > 原图 > 升级前的旧文件名；都没有返回空串。
+        """
+
+        entry = self.files.get(fn) or {}
+        for key in ("variant", "file"):
+            name = str(entry.get(key) or "")
+            if name and name in self.stored:
+                return f"{LOGO_STORE_DIRNAME}/{name}"
+        return fn if fn in self.legacy else ""
+
+    def put(self, data: bytes, *, fallback_name: str) -> Tuple[str, bool]:
+        """
+        作用：
+        - 按内容哈希写入 sha/；同内容已存在则不写。
+
+        输出：
+        - (文件名, 是否新写入)
+        """
+
+        name = hashlib.sha256(data).hexdigest()[:20] + _sniff_ext(data, fallback_name)
+        if name in self.stored:
+            return name, False
+        os.makedirs(self.store_dir, exist_ok=True)
+        _write_atomic(os.path.join(self.store_dir, name), data)
+        self.stored[name] = len(data)
+        return name, True
+
+    def adopt_legacy(self, fn: str) -> str:
+        """
+        作用：
+        - 把升级前按 URL 文件名存的 logo 收进 sha/（优先硬链接，不占额外空间）。
+        """
+
+        src = os.path.join(self.ldir, fn)
+        with open(src, "rb") as f:
+            data = f.read()
+        name = hashlib.sha256(data).hexdigest()[:20] + _sniff_ext(data, fn)
+        if name not in self.stored:
+            os.makedirs(self.store_dir, exist_ok=True)
+            dst = os.path.join(self.store_dir, name)
+            try:
+                os.link(src, dst)
+            except OSError:
+                shutil.copyfile(src, dst)
+            self.stored[name] = len(data)
+        return name
+
+    def make_variant(self, name: str, *, size: int, fmt: str) -> str:
+        """
+        作用：
+        - 为 sha/ 下的原图生成缩略图（最长边 size，fmt=png/webp）；结果不比原图小则不要。
+
+        输出：
+        - 缩略图文件名；未生成返回空串
+        """
+
+        if Image is None:
+            return ""
+        stem = name.rsplit(".", 1)[0]
+        vname = f"{stem}.{int(size)}.{fmt}"
+        if vname in self.stored:
+            return vname
+        src = os.path.join(self.store_dir, name)
+        dst = os.path.join(self.store_dir, vname)
+        tmp = f"{dst}.tmp.{threading.get_ident()}"
+        try:
+            with Image.open(src) as img:
+                img.load()
+                im = img.convert("RGBA") if img.mode not in ("RGB", "RGBA", "L", "LA", "P") or fmt == "webp" else img
+                im.thumbnail((int(size), int(size)))
+                if fmt == "webp":
+                    im.save(tmp, format="WEBP", quality=80, method=6)
+                else:
+                    im.save(tmp, format="PNG", optimize=True)
+            vsize = os.path.getsize(tmp)
+            if vsize >= self.stored.get(name, 0):
+                os.remove(tmp)
+                return ""
+            os.replace(tmp, dst)
+            self.stored[vname] = vsize
+            return vname
+        except Exception as e:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            print(f"[WARN] 生成 logo 缩略图失败 {name}: {e}", file=sys.stderr)
+            return ""
+
+    def save(self, keep: Optional[Iterable[str]] = None) -> int:
+        """
+        作用：
+        - 写回索引；keep 给出时只保留这些 URL 文件名的记录，并删掉 sha/ 里不再被引用的文件。
+
+        输出：
+        - int: 删除的 sha/ 文件数
+        """
+
+        removed = 0
+        if keep is not None:
+            keep_set = set(keep)
+            self.files = {fn: e for fn, e in self.files.items() if fn in keep_set}
+            used = set()
+            for e in self.files.values():
+                used.update(str(e.get(k) or "") for k in ("file", "variant"))
+            for name in list(self.stored):
+                if name not in used:
+                    try:
+                        os.remove(os.path.join(self.store_dir, name))
+                        removed += 1
+                    except OSError:
+                        pass
+                    self.stored.pop(name, None)
+        path = os.path.join(self.ldir, LOGO_INDEX_NAME)
+        tmp = f"{path}.tmp"
+        try:
+            os.makedirs(self.ldir, exist_ok=True)
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(
+                    {"v": 2, "files": self.files, "channels": self.channels},
+                    f,
+                    ensure_ascii=False,
+                    separators=(",", ":"),
+                )
+            os.replace(tmp, path)
+            self.dirty = False
+        except OSError as e:
+            print(f"[WARN] 写入 logo 索引失败 {path}: {e}", file=sys.stderr)
+        return removed
+
+
+def channel_logo_key(ch: "Channel") -> str:
+    """频道在 logo 索引里的 id（也是 URL 取不到文件名时的兜底文件名）：primaryid，没有则 tvg-id / 频道名。"""
+
+    return ch.primaryid or ch.tvg_id or ch.name
+
+
+class LogoUrls:
+    """
+    作用：
+    - 一次生成用的 logo 查找表（M3U 的 tvg-logo 与 XMLTV 的 icon 共用）：
+      by_channel: {频道 id: 本地 URL}，by_file: {URL 文件名: 本地 URL}。
+
+    说明：
+    - 由 LogoIndex 一次性算好，查找只是 dict 操作，不碰文件系统
+    - 频道 id 是 channel_logo_key()（默认即 primaryid，也就是 XMLTV 的 channel id），两边按同一个键查到同一个文件
+    - by_channel 由最近一次 M3U 任务记录；不在其中的频道（只有 EPG 的频道等）再按 URL 文件名查
+    """
+
+    def __init__(self, idx: LogoIndex, prefix: str) -> None:
+        self.ldir = idx.ldir
+        self.prefix = prefix
+        self.by_file: Dict[str, str] = {}
+        for fn in set(idx.legacy) | set(idx.files):
+            served = idx.served_name(fn)
+            if served:
+                self.by_file[fn] = f"{prefix}/{served}"
+        self.by_channel: Dict[str, str] = {
+            cid: f"{prefix}/{served}" for cid, served in idx.channels.items() if served
+        }
+
+    def lookup(self, logo_url: str, *, channel_id: str = "") -> str:
+        """频道的本地 logo URL：先按频道 id，再按 logo_url 的文件名；本地没有返回空串。"""
+
+        u = (logo_url or "").strip()
+        if not u:
+            return ""
+        hit = self.by_channel.get(channel_id) if channel_id else None
+        if hit:
+            return hit
+        return self.by_file.get(logo_filename_from_url(u, fallback_stem=channel_id), "")
+
+    def resolve(self, logo_url: str, *, channel_id: str = "") -> str:
+        """本地有就返回本地 URL，否则原样返回 logo_url。"""
+
+        return self.lookup(logo_url, channel_id=channel_id) or (logo_url or "").strip()
 
-    stats = {"downloaded": 0, "skipped": 0, "failed": 0, "rewritten": 0, "missing": 0}
-    new_list: List[Channel] = []
 
+# 进程内共享：M3U 任务刚生成的查找表直接给随后的 EPG 任务用；目录或索引变了才重建
+_logo_urls: Dict[Tuple[str, str], Tuple[Tuple[int, ...], LogoUrls]] = {}
+_logo_urls_lock = threading.Lock()
+
+
+def _logo_dir_signature(ldir: str) -> Tuple[int, ...]:
+    sig: List[int] = []
+    for p in (ldir, os.path.join(ldir, LOGO_STORE_DIRNAME), os.path.join(ldir, LOGO_INDEX_NAME)):
+        try:
+            st = os.stat(p)
+            sig.extend((st.st_mtime_ns, st.st_size))
+        except OSError:
+            sig.extend((0, -1))
+    return tuple(sig)
+
+
+def _publish_logo_urls(idx: LogoIndex, prefix: str) -> LogoUrls:
+    urls = LogoUrls(idx, prefix)
+    with _logo_urls_lock:
+        _logo_urls[(idx.ldir, prefix)] = (_logo_dir_signature(idx.ldir), urls)
+    return urls
+
+
+def get_logo_urls(out_path: str, logo_dir: str, web_base_url: str) -> LogoUrls:
+    """
+    作用：
+    - 取 logo 查找表：同一目录内容没变时复用（只 stat 三次），否则扫描一次目录重建。
+
+    输入：
+    - out_path/logo_dir/web_base_url: 与 localize_logos() 相同的参数
+    """
+
+    ldir = resolve_logo_dir(out_path, logo_dir)
+    prefix = logo_url_prefix(ldir, web_base_url)
+    sig = _logo_dir_signature(ldir)
+    with _logo_urls_lock:
+        hit = _logo_urls.get((ldir, prefix))
+    if hit is not None and hit[0] == sig:
+        return hit[1]
+    return _publish_logo_urls(LogoIndex(ldir), prefix)
+
+
+def localize_logos(
+    channels: List["Channel"],
+    *,
+    out_path: str,
+    logo_dir: str,
+    web_base_url: str,
+    opener: Optional[urllib.request.OpenerDirector],
+    timeout_s: float,
+    delay_s: float,
+    skip_existing: bool,
+    download_missing: bool,
+    user_agent: str,
+    workers: int = DEFAULT_LOGO_WORKERS,
+    rate_per_host: Optional[float] = None,
+    revalidate_s: float = DEFAULT_LOGO_REVALIDATE_S,
+    variant: str = DEFAULT_LOGO_VARIANT,
+    variant_size: int = DEFAULT_LOGO_VARIANT_SIZE,
+    cancel: Optional[threading.Event] = None,
+) -> Tuple[List["Channel"], Dict[str, int]]:
+    """
+    作用：
+    - 下载频道 logo 到本地内容寻址存储，并把每个 Channel.tvg_logo 重写为本地可访问 URL。
+
+    输入：
+    - channels: 频道列表
+    - out_path: m3u 输出路径（用于自动推导 logo_dir）
+    - logo_dir: logo 目录；为空表示自动使用“out_path 同目录下 logos/”
+    - web_base_url: Web 基础地址（例如 http://192.168.1.250）
+    - opener/timeout_s/user_agent: 下载用的请求参数
+    - delay_s: 旧参数；未指定 rate_per_host 时按 1/delay_s 折算每个源站的请求速率
+    - skip_existing: True = 已有文件只在索引记录超过 revalidate_s 后才重新验证；
+      False = 已有文件每次都发条件请求重新验证（304 不重新下载）
+    - download_missing: 是否访问网络（False=只按本地已有文件重写 URL，不下载也不验证）
+    - workers: 并发下载线程数
+    - rate_per_host: 每个源站的请求速率上限（次/秒，0 = 不限速）
+    - revalidate_s: 已有 logo 的重新验证间隔（秒）
+    - variant: 缩略图格式（"" = 不生成；png / webp，需要 Pillow）
+    - variant_size: 缩略图最长边像素
+    - cancel: 取消事件（进程内任务引擎传入；被取消时尚未开始的下载直接跳过）
+
+    输出：
+    - (new_channels, stats):
+      - new_channels: tvg_logo 已替换成本地 URL 的频道列表
+      - stats: 统计信息（downloaded/updated/not_modified/skipped/failed/missing/rewritten/
+        deduped/variants/pruned）
+    """
+
+    ldir = resolve_logo_dir(out_path, logo_dir)
+    url_prefix = logo_url_prefix(ldir, web_base_url)
+
+    stats = {
+        "downloaded": 0,
+        "updated": 0,
+        "not_modified": 0,
+        "skipped": 0,
+        "failed": 0,
+        "rewritten": 0,
+        "missing": 0,
+        "deduped": 0,
+        "variants": 0,
+        "pruned": 0,
+    }
+
+    # 1) 一次扫描目录 + 读索引；同名文件（多个频道共用一个 logo URL）只处理一次
+    idx = LogoIndex(ldir)
+    old_channels = dict(idx.channels)
+    now = time.time()
+
+    wanted: Dict[str, str] = {}
     for ch in channels:
         logo = (ch.tvg_logo or "").strip()
-        if not logo:
-            new_list.append(ch)
+        if logo:
+            # 用 primaryid 做 fallback（更稳定，与 XMLTV 一致）；没有则用 tvg_id / name
+            fn = logo_filename_from_url(logo, fallback_stem=channel_logo_key(ch))
+            wanted.setdefault(fn, logo)
+
+    # 2) 升级前的旧文件收进 sha/（只在本地操作）
+    for fn, url in wanted.items():
+        if fn in idx.legacy and not idx.original_name(fn):
+            try:
+                name = idx.adopt_legacy(fn)
+            except OSError as e:
+                print(f"[WARN] 收录旧 logo 失败 {fn}: {e}", file=sys.stderr)
+                continue
+            entry = idx.files.setdefault(fn, {"url": url, "checked_at": now})
+            entry["file"] = name
+            idx.dirty = True
+
+    # 3) 决定哪些要请求：缺失的下载；已有的按索引决定是否条件请求
+    tasks: List[Tuple[str, str, Dict[str, Any]]] = []
+    for fn, url in wanted.items():
+        have = bool(idx.original_name(fn))
+        if not download_missing:
+            if not have and not idx.served_name(fn):
+                stats["missing"] += 1
             continue
-
-        # 用 tvg_id 做 fallback（更稳定）；没有则用 name
-        fn = logo_filename_from_url(logo, fallback_stem=ch.tvg_id or ch.name)
-        save_path = os.path.join(ldir, fn)
-
-        if os.path.exists(save_path) and os.path.getsize(save_path) > 0 and skip_existing:
+        entry = idx.files.get(fn) or {}
+        if not have or entry.get("url") != url:
+            tasks.append((fn, url, {}))
+        elif skip_existing and now - float(entry.get("checked_at") or 0) < revalidate_s:
             stats["skipped"] += 1
-        elif os.path.exists(save_path) and os.path.getsize(save_path) > 0:
-            # 文件已存在但不跳过：允许后续 download_missing=True 时覆盖下载
-            pass
-        elif not download_missing:
-            # 默认模式：不下载，只在本地有文件时才改 URL
-            stats["missing"] += 1
         else:
-            ok = download_logo(
-                logo,
-                save_path=save_path,
+            tasks.append((fn, url, entry))
+
+    # 4) 线程池并发请求；每个源站一个令牌桶
+    if tasks:
+        if rate_per_host is None:
+            rate_per_host = (1.0 / float(delay_s)) if delay_s and delay_s > 0 else 0.0
+        buckets: Dict[str, TokenBucket] = {}
+        for _fn, url, _entry in tasks:
+            host = urllib.parse.urlsplit(url).netloc.lower()
+            if host not in buckets:
+                buckets[host] = TokenBucket(rate_per_host, burst=max(1, int(workers)))
+        store_lock = threading.Lock()
+
+        def _one(task: Tuple[str, str, Dict[str, Any]]) -> Tuple[str, str, Dict[str, Any]]:
+            fn, url, entry = task
+            if cancel is not None and cancel.is_set():
+                return fn, "cancelled", {}
+            buckets[urllib.parse.urlsplit(url).netloc.lower()].acquire()
+            status, meta, data = fetch_logo(
+                url,
                 opener=opener,
                 timeout_s=timeout_s,
                 user_agent=user_agent,
+                etag=str(entry.get("etag") or ""),
+                last_modified=str(entry.get("last_modified") or ""),
             )
-            if ok:
-                stats["downloaded"] += 1
-            else:
-                stats["failed"] += 1
-
-            if delay_s and delay_s > 0:
-                time.sleep(float(delay_s))
-
-        # 只要本地文件存在，就改成本地 URL；否则保留原 logo
-        if os.path.exists(save_path) and os.path.getsize(save_path) > 0:
-            local_url = f"{url_prefix}/{fn}"
+            if status == "downloaded":
+                try:
+                    with store_lock:
+                        meta["file"], meta["created"] = idx.put(data, fallback_name=fn)
+                except OSError as e:
+                    return fn, "failed", {"error": str(e)}
+            return fn, status, meta
+
+        t0 = time.monotonic()
+        with ThreadPoolExecutor(max_workers=max(1, min(int(workers), len(tasks))), thread_name_prefix="logo") as pool:
+            for fn, status, meta in pool.map(_one, tasks):
+                url = wanted[fn]
+                if status == "downloaded":
+                    old = idx.files.get(fn) or {}
+                    stats["updated" if old.get("file") else "downloaded"] += 1
+                    if not meta["created"]:
+                        stats["deduped"] += 1
+                    entry = {
+                        "url": url,
+                        "etag": meta.get("etag") or "",
+                        "last_modified": meta.get("last_modified") or "",
+                        "checked_at": time.time(),
+                        "file": meta["file"],
+                    }
+                    if old.get("file") == meta["file"]:
+                        # 内容没变：沿用已生成的缩略图
+                        entry.update({k: old[k] for k in ("variant", "variant_spec") if k in old})
+                    idx.files[fn] = entry
+                    idx.dirty = True
+                elif status == "not_modified":
+                    stats["not_modified"] += 1
+                    idx.files[fn] = {**idx.files.get(fn, {}), "url": url, "checked_at": time.time()}
+                    idx.dirty = True
+                elif status == "failed":
+                    stats["failed"] += 1
+        print(
+            f"[INFO] logo 请求 {len(tasks)} 个（新下载 {stats['downloaded']} 更新 {stats['updated']} "
+            f"未变 {stats['not_modified']} 重复内容 {stats['deduped']} 失败 {stats['failed']}）"
+            f"workers={workers} 耗时 {time.monotonic() - t0:.2f}s",
+            file=sys.stderr,
+        )
+
+    # 5) 缩略图：按 (原图, 规格) 生成一次，记录在索引里
+    fmt = (variant or "").strip().lower()
+    if fmt not in LOGO_VARIANT_FORMATS:
+        fmt = ""
+    if fmt and Image is None:
+        print("[WARN] 未安装 Pillow，不生成 logo 缩略图（tvg-logo 使用原图）", file=sys.stderr)
+    spec = f"{int(variant_size)}.{fmt}" if fmt else ""
+    existed = set(idx.stored)
+    for fn in wanted:
+        entry = idx.files.get(fn)
+        if not entry or not idx.original_name(fn):
+            continue
+        if not spec:
+            if entry.pop("variant", None) is not None or entry.pop("variant_spec", None) is not None:
+                idx.dirty = True
+            continue
+        vname = str(entry.get("variant") or "")
+        if entry.get("variant_spec") == spec and (not vname or vname in idx.stored):
+            continue
+        if Image is None:
+            continue
+        vname = idx.make_variant(entry["file"], size=int(variant_size), fmt=fmt)
+        entry["variant"], entry["variant_spec"] = vname, spec
+        idx.dirty = True
+        if vname and vname not in existed:
+            existed.add(vname)
+            stats["variants"] += 1
+
+    # 6) 索引写回后建好查找表（同时留给随后的 EPG 任务）；本地有文件就改成本地 URL，否则保留原 logo
+    idx.channels = {}
+    for ch in channels:
+        logo = (ch.tvg_logo or "").strip()
+        if logo:
+            key = channel_logo_key(ch)
+            served = idx.served_name(logo_filename_from_url(logo, fallback_stem=key))
+            if served:
+                idx.channels[key] = served
+    if idx.dirty or idx.channels != old_channels:
+        # 只保留本次频道用到的记录；sha/ 中不再被引用的文件一并删除
+        stats["pruned"] = idx.save(keep=wanted.keys())
+    urls = _publish_logo_urls(idx, url_prefix)
+
+    new_list: List["Channel"] = []
+    for ch in channels:
+        local = urls.lookup(ch.tvg_logo, channel_id=channel_logo_key(ch))
+        if local:
             stats["rewritten"] += 1
-            new_list.append(
-                Channel(
-                    name=ch.name,
-                    group=ch.group,
-                    tvg_id=ch.tvg_id,
-                    tvg_name=ch.tvg_name,
-                    tvg_logo=local_url,
-                    chno=ch.chno,
-                    stream_url=ch.stream_url,
-                    catchup_source=ch.catchup_source,
-                    catchup_path=ch.catchup_path,
-                )
-            )
+            new_list.append(dataclasses.replace(ch, tvg_logo=local))
         else:
             new_list.append(ch)
 
     return new_list, stats
-
-
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+输出文件校验信息（manifest）
+
+职责：
+- 生成 m3u / epg.xml 时顺带计算内容哈希，写到同目录 .meta/<文件名>.json
+- /out 静态服务据此给出强 ETag（内容不变 ETag 不变，播放器刷新直接 304）
+- 状态 / MQTT 发布同一个哈希，HA 卡片据此判断内容是否真的变了
+- 生成器先写临时文件，commit_output() 比对哈希：内容完全相同就丢弃临时文件，
+  不 rename、不改 mtime（播放器缓存、ETag、MQTT 状态都保持不变）
+- 记录里可附带索引（频道 → 名称 / 节目摘要），diff_index() 据此给出变化摘要
+
+说明：
+- 记录里保存生成时的 size + mtime_ns；文件被别的途径改过（对不上）就视为没有记录
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sys
+from typing import Any, Dict, Optional
+
+META_DIRNAME = ".meta"
+
+_CHUNK = 256 * 1024
+
+
+def file_digest(path: str) -> str:
+    """
+    作用：
+    - 流式计算文件 sha256（十六进制）。
+    """
+
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(_CHUNK)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _meta_path(path: str) -> str:
+    d, name = os.path.split(path)
+    return os.path.join(d or ".", META_DIRNAME, f"{name}.json")
+
+
+def _write_meta(path: str, meta: Dict[str, Any]) -> None:
+    mp = _meta_path(path)
+    os.makedirs(os.path.dirname(mp), exist_ok=True)
+    tmp = f"{mp}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp, mp)
+
+
+def record_output(
+    path: str,
+    *,
+    sha256: Optional[str] = None,
+    extra: Optional[Dict[str, Any]] = None,
+) -> Optional[Dict[str, Any]]:
+    """
+    作用：
+    - 计算 path 的内容哈希并写入 .meta/<文件名>.json（临时文件 + rename）。
+
+    输入：
+    - path: 刚生成完的输出文件
+    - sha256: 已知的内容哈希（可选，省一次读文件）
+    - extra: 附带写入记录的字段（例如 index）
+
+    输出：
+    - 记录 dict（sha256/size/mtime_ns + extra），失败返回 None（只打印警告）
+    """
+
+    try:
+        st = os.stat(path)
+        meta = dict(extra or {})
+        meta.update({"sha256": sha256 or file_digest(path), "size": st.st_size, "mtime_ns": st.st_mtime_ns})
+        _write_meta(path, meta)
+        return meta
+    except OSError as e:
+        print(f"[WARN] 记录输出校验信息失败 {path}: {e}", file=sys.stderr)
+        return None
+
+
+def commit_output(tmp: str, path: str, *, extra: Optional[Dict[str, Any]] = None) -> bool:
+    """
+    作用：
+    - 把生成好的临时文件提交为 path：内容与现有 path（有有效记录）完全相同时删掉临时文件，
+      保留旧文件和 mtime；否则原子 rename 并记录新哈希。
+
+    输入：
+    - tmp: 已写完并关闭的临时文件
+    - path: 目标输出文件
+    - extra: 附带写入记录的字段（见 record_output）
+
+    输出：
+    - bool: True = 已替换；False = 内容未变，跳过写入
+    """
+
+    digest = file_digest(tmp)
+    old = read_output_meta(path)
+    if old is not None and old.get("sha256") == digest:
+        os.remove(tmp)
+        if extra and any(old.get(k) != v for k, v in extra.items()):
+            # 旧记录缺少索引（升级前生成的）：只补记录，不动文件
+            try:
+                _write_meta(path, {**old, **extra})
+            except OSError as e:
+                print(f"[WARN] 记录输出校验信息失败 {path}: {e}", file=sys.stderr)
+        return False
+    os.replace(tmp, path)
+    record_output(path, sha256=digest, extra=extra)
+    return True
+
+
+def read_output_meta(path: str, st: Optional[os.stat_result] = None) -> Optional[Dict[str, Any]]:
+    """
+    作用：
+    - 读取 path 的校验记录；记录与文件当前 size/mtime 对不上时返回 None。
+
+    输入：
+    - path: 输出文件
+    - st: 已有的 os.stat 结果（可选，省一次 stat）
+    """
+
+    try:
+        if st is None:
+            st = os.stat(path)
+        with open(_meta_path(path), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(meta, dict) or not meta.get("sha256"):
+        return None
+    if meta.get("size") != st.st_size or meta.get("mtime_ns") != st.st_mtime_ns:
+        return None
+    return meta
+
+
+def strong_etag(meta: Dict[str, Any], encoding: str = "") -> str:
+    """
+    作用：
+    - 由内容哈希得到强 ETag；同一内容的不同编码（gzip/br）用不同 ETag。
+    """
+
+    tag = str(meta["sha256"])[:32]
+    return f'"{tag}-{encoding}"' if encoding else f'"{tag}"'
+
+
+def diff_index(
+    old: Optional[Dict[str, str]],
+    new: Dict[str, str],
+    *,
+    limit: int = 10,
+) -> Dict[str, Any]:
+    """
+    作用：
+    - 比较两次生成记录里的索引（键 → 值），给出新增 / 删除 / 值变化的键。
+
+    输入：
+    - old: 上一次的索引（None = 没有记录，视为首次生成）
+    - new: 本次的索引
+    - limit: 每类最多列出多少个键（计数不受影响）
+
+    输出：
+    - Dict: baseline/total/added/removed/changed（计数）+ keys（各类的前 limit 个键）
+    """
+
+    if old is None:
+        return {"baseline": True, "total": len(new), "added": 0, "removed": 0, "changed": 0, "keys": {}}
+    added = [k for k in new if k not in old]
+    removed = [k for k in old if k not in new]
+    changed = [k for k, v in new.items() if k in old and old[k] != v]
+    return {
+        "baseline": False,
+        "total": len(new),
+        "added": len(added),
+        "removed": len(removed),
+        "changed": len(changed),
+        "keys": {"added": added[:limit], "removed": removed[:limit], "changed": changed[:limit]},
+    }
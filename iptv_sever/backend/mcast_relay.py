@@ -0,0 +1,956 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+原生组播 → HTTP 中继（udpxy.engine: native）
+
+职责：
+- 与 udpxy 相同的 URL：GET /rtp/<组播地址>:<端口>、/udp/<组播地址>:<端口>
+  （convert_multicast_to_udpxy() 生成的 M3U 不用改）
+- 每个组播组在 source_iface 上只加入一次：一次 IGMP join、内核只拷贝一份，
+  数据分发给所有正在看这个频道的 HTTP 客户端
+- 每个客户端一个有界环形缓冲：慢客户端只丢自己最旧的数据，不拖慢同频道的其他人
+- HEAD/OPTIONS 直接 200（APTV 探测），与 udpxy_head_proxy 一致
+
+说明：
+- 最后一个客户端断开即退出组播组（关闭 socket，内核发 IGMP leave）
+- /rtp/ 去掉 RTP 头只发 MPEG-TS 负载（与 udpxy 一致）；数据本身就是 TS 时原样转发
+- 加入新组时才取 source_iface 当前 IPv4，专网 DHCP 换地址不需要重启
+- 快速换台：每个组保留从最近一个关键帧（TS 随机访问点）开始的数据，前面补上最新的 PAT/PMT；
+  新客户端加入已在播的频道时先收到这段，播放器不用等下一个关键帧
+- 可选保温：最后一个客户端断开后继续留在组里 keep_warm_s 秒，切回来也能秒开
+- 本地自检（loopback 组播发送端 + 多个 HTTP 客户端）：
+  python3 iptv_sever/backend/mcast_relay.py --selftest
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import http
+import ipaddress
+import logging
+import os
+import re
+import socket
+import struct
+import sys
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Set, Tuple
+
+# 允许直接跑脚本文件（与 build_m3u.py 相同的自举）
+if __package__ in (None, ""):
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    repo_root = os.path.dirname(os.path.dirname(script_dir))
+    if repo_root not in sys.path:
+        sys.path.insert(0, repo_root)
+
+from iptv_sever.backend.net import get_ipv4_from_iface_cached
+from iptv_sever.backend.udpxy_head_proxy import _HEAD_OK, _read_headers
+
+logger = logging.getLogger(__name__)
+
+_PATH_RE = re.compile(r"^/(rtp|udp)/(\d{1,3}(?:\.\d{1,3}){3}):(\d{1,5})/?$")
+
+# 一次可读事件最多收多少个数据报（合并成一块再分发，减少每个客户端的 write 次数）
+_READ_BATCH = 64
+_DGRAM_MAX = 65536
+
+DEFAULT_CLIENT_BUFFER = 1024 * 1024
+DEFAULT_RCVBUF = 2 * 1024 * 1024
+DEFAULT_BURST_BUFFER = 2 * 1024 * 1024
+
+TS_PACKET = 188
+
+
+def parse_size(value: Any, default: int) -> int:
+    """
+    作用：
+    - 解析 udpxy 风格的大小（"2Mb" / "512Kb" / 1048576），未配置（None/空串）或格式不对返回 default；
+      0 / "0" 返回 0（用于关闭缓冲）。
+    """
+
+    if value is None:
+        return default
+    s = str(value).strip().lower()
+    if not s:
+        return default
+    m = re.match(r"^(\d+)\s*([km]?)b?$", s)
+    if not m:
+        return default
+    n = int(m.group(1))
+    return n * {"": 1, "k": 1024, "m": 1024 * 1024}[m.group(2)]
+
+
+def parse_relay_path(path: str) -> Optional[Tuple[str, str, int]]:
+    """
+    作用：
+    - 解析 /rtp/239.1.1.1:5140 这类路径。
+
+    输出：
+    - (proto, group, port)；不是合法的组播地址返回 None
+    """
+
+    m = _PATH_RE.match((path or "").split("?", 1)[0])
+    if not m:
+        return None
+    proto, group, port_s = m.group(1), m.group(2), int(m.group(3))
+    try:
+        if not ipaddress.IPv4Address(group).is_multicast:
+            return None
+    except ValueError:
+        return None
+    if not 0 < port_s < 65536:
+        return None
+    return proto, group, port_s
+
+
+def rtp_payload(data: bytes) -> bytes:
+    """
+    作用：
+    - 去掉 RTP 头（含 CSRC、扩展头、填充），返回 MPEG-TS 负载；不是 RTP（以 0x47 开头的裸 TS）原样返回。
+    """
+
+    if not data or data[0] == 0x47 or len(data) < 12 or data[0] >> 6 != 2:
+        return data
+    off = 12 + 4 * (data[0] & 0x0F)
+    if data[0] & 0x10:
+        if len(data) < off + 4:
+            return b""
+        off += 4 + 4 * int.from_bytes(data[off + 2 : off + 4], "big")
+    end = len(data)
+    if data[0] & 0x20:
+        end -= data[-1]
+    if off >= end:
+        return b""
+    return data[off:end]
+
+
+def _pat_pmt_pids(pkt: bytes) -> Set[int]:
+    """从一个（单包）PAT 里取出 PMT 的 PID。"""
+
+    pids: Set[int] = set()
+    if not pkt[1] & 0x40:
+        return pids
+    off = 4
+    if pkt[3] & 0x20:
+        off += 1 + pkt[4]
+    if off >= TS_PACKET:
+        return pids
+    off += 1 + pkt[off]  # pointer_field
+    if off + 8 > TS_PACKET or pkt[off] != 0x00:
+        return pids
+    section_len = ((pkt[off + 1] & 0x0F) << 8) | pkt[off + 2]
+    end = min(off + 3 + section_len - 4, TS_PACKET)  # 去掉 CRC32
+    i = off + 8
+    while i + 4 <= end:
+        program = (pkt[i] << 8) | pkt[i + 1]
+        if program != 0:
+            pids.add(((pkt[i + 2] & 0x1F) << 8) | pkt[i + 3])
+        i += 4
+    return pids
+
+
+# PMT 里的视频 stream_type：MPEG-1/2、MPEG-4、H.264、HEVC、AVS/AVS2/AVS3、VC-1
+_VIDEO_STREAM_TYPES = frozenset((0x01, 0x02, 0x10, 0x1B, 0x24, 0x42, 0xD2, 0xD4, 0xEA))
+
+
+def _pmt_streams(pkt: bytes) -> Dict[int, int]:
+    """从一个 PMT 包（只看第一个包内的部分）取出 {elementary_PID: stream_type}。"""
+
+    streams: Dict[int, int] = {}
+    off = 4
+    if pkt[3] & 0x20:
+        off += 1 + pkt[4]
+    if off >= TS_PACKET:
+        return streams
+    off += 1 + pkt[off]  # pointer_field
+    if off + 12 > TS_PACKET or pkt[off] != 0x02:
+        return streams
+    section_len = ((pkt[off + 1] & 0x0F) << 8) | pkt[off + 2]
+    end = min(off + 3 + section_len - 4, TS_PACKET)  # 去掉 CRC32
+    i = off + 12 + (((pkt[off + 10] & 0x0F) << 8) | pkt[off + 11])  # 跳过 program_info
+    while i + 5 <= end:
+        streams[((pkt[i + 1] & 0x1F) << 8) | pkt[i + 2]] = pkt[i]
+        i += 5 + (((pkt[i + 3] & 0x0F) << 8) | pkt[i + 4])
+    return streams
+
+
+class BurstBuffer:
+    """
+    作用：
+    - 快速换台缓冲：保存从最近一个视频关键帧（视频 PID 上 PUSI + random_access_indicator）开始的 TS，
+      前面补上最新的 PAT/PMT。
+
+    说明：
+    - 只扫 TS 包头（每 188 字节看几个字节），不解析 PES；PAT/PMT 内容变化时才解析
+    - 视频 PID 取自 PMT 的 stream_type：很多 DVB 复用在每个音频 PES 上都置 RAI，不能当关键帧
+    - PMT 里没有视频流（广播频道）时，任何基本流的随机访问点都算；还没收到 PMT 时不缓冲
+    - 一个 GOP 超过 limit 时清空，等下一个随机访问点（宁可没有也不发不能解码的开头）
+    """
+
+    def __init__(self, limit: int) -> None:
+        self.limit = limit
+        self.chunks: Deque[bytes] = deque()
+        self.size = 0
+        self.pat = b""
+        self.pmt_pids: Set[int] = set()
+        self.pmt: Dict[int, bytes] = {}
+        self.pmt_streams: Dict[int, Dict[int, int]] = {}
+        self.rap_pids: Set[int] = set()
+
+    def _update_pmt(self, pid: int, pkt: bytes) -> None:
+        old = self.pmt.get(pid)
+        self.pmt[pid] = pkt
+        # continuity_counter 每包都变，只比较包头之后的内容
+        if old is not None and old[4:] == pkt[4:]:
+            return
+        streams = _pmt_streams(pkt)
+        if not streams:
+            return
+        self.pmt_streams[pid] = streams
+        merged: Dict[int, int] = {}
+        for pmt_pid in self.pmt_pids:
+            merged.update(self.pmt_streams.get(pmt_pid) or {})
+        video = {es for es, st in merged.items() if st in _VIDEO_STREAM_TYPES}
+        self.rap_pids = video or set(merged)
+
+    def feed(self, chunk: bytes) -> None:
+        n = len(chunk)
+        rap = -1
+        if n % TS_PACKET == 0 and chunk[:1] == b"\x47":
+            for i in range(0, n, TS_PACKET):
+                b1 = chunk[i + 1]
+                if not b1 & 0x40:
+                    # 只有 PUSI 包可能是 PAT/PMT 起始或关键帧起始
+                    continue
+                pid = ((b1 & 0x1F) << 8) | chunk[i + 2]
+                if pid == 0:
+                    self.pat = chunk[i : i + TS_PACKET]
+                    self.pmt_pids = _pat_pmt_pids(self.pat) or self.pmt_pids
+                elif pid in self.pmt_pids:
+                    self._update_pmt(pid, chunk[i : i + TS_PACKET])
+                elif pid in self.rap_pids and chunk[i + 3] & 0x20 and chunk[i + 4] and chunk[i + 5] & 0x40:
+                    rap = i
+        if rap >= 0:
+            head = self.pat + b"".join(self.pmt.get(pid, b"") for pid in sorted(self.pmt_pids))
+            self.chunks.clear()
+            self.size = 0
+            if head:
+                self.chunks.append(head)
+                self.size += len(head)
+            chunk = chunk[rap:]
+        elif not self.chunks:
+            return
+        self.chunks.append(chunk)
+        self.size += len(chunk)
+        if self.size > self.limit:
+            self.chunks.clear()
+            self.size = 0
+
+    def snapshot(self) -> bytes:
+        return b"".join(self.chunks)
+
+
+class RelayError(Exception):
+    """加入组播组失败（HTTP 状态码 + 原因）。"""
+
+    def __init__(self, status: int, reason: str) -> None:
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+
+
+class _Client:
+    """一个 HTTP 客户端的有界环形缓冲（按字节计，满了丢最旧的块）。"""
+
+    __slots__ = ("peer", "limit", "queue", "size", "event", "closed", "sent", "dropped", "since")
+
+    def __init__(self, peer: str, limit: int) -> None:
+        self.peer = peer
+        self.limit = limit
+        self.queue: Deque[bytes] = deque()
+        self.size = 0
+        self.event = asyncio.Event()
+        self.closed = False
+        self.sent = 0
+        self.dropped = 0
+        self.since = time.time()
+
+    def push(self, chunk: bytes) -> None:
+        self.queue.append(chunk)
+        self.size += len(chunk)
+        while self.size > self.limit and len(self.queue) > 1:
+            old = self.queue.popleft()
+            self.size -= len(old)
+            self.dropped += len(old)
+        self.event.set()
+
+    def take(self) -> bytes:
+        data = self.queue[0] if len(self.queue) == 1 else b"".join(self.queue)
+        self.queue.clear()
+        self.size = 0
+        self.event.clear()
+        return data
+
+
+class _Group:
+    """一个已加入的组播组：一个 UDP socket，数据分发给 clients。"""
+
+    def __init__(self, proto: str, group: str, port: int, source_ip: str, burst_limit: int = 0) -> None:
+        self.proto = proto
+        self.group = group
+        self.port = port
+        self.source_ip = source_ip
+        self.key = f"{proto}/{group}:{port}"
+        self.clients: Set[_Client] = set()
+        self.sock: Optional[socket.socket] = None
+        self.bytes = 0
+        self.datagrams = 0
+        self.since = time.time()
+        self.burst = BurstBuffer(burst_limit) if burst_limit > 0 else None
+        self.burst_served = 0
+        # 没有客户端、处于保温期的开始时间（0 = 有人在看）
+        self.idle_since = 0.0
+
+    def open(self, loop: asyncio.AbstractEventLoop, rcvbuf: int) -> None:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if rcvbuf > 0:
+                try:
+                    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+                except OSError:
+                    pass
+            try:
+                # 绑定组播地址：只收这个组的包（同端口不同组的频道不会串台）
+                sock.bind((self.group, self.port))
+            except OSError:
+                sock.bind(("", self.port))
+            mreq = struct.pack("4s4s", socket.inet_aton(self.group), socket.inet_aton(self.source_ip))
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+            sock.setblocking(False)
+            loop.add_reader(sock.fileno(), self._on_readable)
+        except BaseException:
+            sock.close()
+            raise
+        self.sock = sock
+
+    def close(self, loop: asyncio.AbstractEventLoop) -> None:
+        sock, self.sock = self.sock, None
+        if sock is None:
+            return
+        try:
+            loop.remove_reader(sock.fileno())
+        except Exception:
+            pass
+        sock.close()
+        for c in self.clients:
+            c.closed = True
+            c.event.set()
+
+    def _on_readable(self) -> None:
+        sock = self.sock
+        if sock is None:
+            return
+        parts = []
+        strip = self.proto == "rtp"
+        for _ in range(_READ_BATCH):
+            try:
+                data = sock.recv(_DGRAM_MAX)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as e:
+                logger.debug("组播接收出错 %s: %s", self.key, e)
+                break
+            self.datagrams += 1
+            if strip:
+                data = rtp_payload(data)
+            if data:
+                parts.append(data)
+        if not parts:
+            return
+        # 同一块 bytes 分给所有客户端（只引用，不再复制）
+        chunk = parts[0] if len(parts) == 1 else b"".join(parts)
+        self.bytes += len(chunk)
+        if self.burst is not None:
+            self.burst.feed(chunk)
+        for c in self.clients:
+            c.push(chunk)
+
+    def attach(self, client: "_Client") -> None:
+        """新客户端加入：先给它快速换台缓冲（同一轮事件循环里加入，之后的直播数据不重不漏）。"""
+
+        if self.burst is not None and self.burst.size:
+            client.push(self.burst.snapshot())
+            self.burst_served += 1
+        self.clients.add(client)
+        self.idle_since = 0.0
+
+
+class McastRelay:
+    """
+    作用：
+    - 在独立线程的 asyncio 事件循环里监听 HTTP，把组播按需中继给客户端。
+      线程模型与 UdpxyHeadProxy 相同（start/stop 可在任意线程调用）。
+    """
+
+    def __init__(self) -> None:
+        self._thread: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._ready = threading.Event()
+        self._error = ""
+        self._groups: Dict[str, _Group] = {}
+        self._joining: Dict[str, asyncio.Future] = {}
+        self._started_at = 0.0
+        self.listen = ("", 0)
+        self.source_iface = ""
+        self.max_groups = 0
+        self.client_buffer = DEFAULT_CLIENT_BUFFER
+        self.rcvbuf = DEFAULT_RCVBUF
+        self.burst_buffer = DEFAULT_BURST_BUFFER
+        self.keep_warm_s = 0.0
+
+    def start(
+        self,
+        listen_host: str,
+        listen_port: int,
+        *,
+        source_iface: str,
+        max_groups: int = 0,
+        client_buffer: int = DEFAULT_CLIENT_BUFFER,
+        rcvbuf: int = DEFAULT_RCVBUF,
+        burst_buffer: int = DEFAULT_BURST_BUFFER,
+        keep_warm_s: float = 0.0,
+    ) -> tuple[bool, str]:
+        """
+        作用：
+        - 启动中继（已在运行则先停掉）。
+
+        输入：
+        - listen_host/listen_port: HTTP 监听地址（一般 0.0.0.0:4022）
+        - source_iface: 接收组播的网卡（IPTV 专网口）
+        - max_groups: 同时加入的组播组上限（0 = 不限；限制的是专网带宽，不限同频道客户端数）
+        - client_buffer: 每个客户端环形缓冲字节数
+        - rcvbuf: 每个组播 socket 的内核接收缓冲（SO_RCVBUF）
+        - burst_buffer: 快速换台缓冲上限（字节，0 = 关闭）
+        - keep_warm_s: 最后一个客户端断开后继续留在组里的秒数（0 = 立即退出）；
+          保温中的组也占 max_groups 名额，名额不够时先退出最久没人看的保温组
+
+        输出：
+        - (ok, message)
+        """
+
+        self.stop()
+        self._ready.clear()
+        self._error = ""
+        self.source_iface = (source_iface or "").strip()
+        self.max_groups = max(0, int(max_groups or 0))
+        self.client_buffer = max(64 * 1024, int(client_buffer))
+        self.rcvbuf = int(rcvbuf)
+        self.burst_buffer = max(0, int(burst_buffer))
+        self.keep_warm_s = max(0.0, float(keep_warm_s or 0))
+        self._thread = threading.Thread(
+            target=self._thread_main,
+            args=(listen_host, int(listen_port)),
+            name="mcast-relay",
+            daemon=True,
+        )
+        self._thread.start()
+        if not self._ready.wait(timeout=5):
+            self.stop()
+            return False, self._error or "组播中继启动超时"
+        if self._error:
+            return False, self._error
+        self._started_at = time.time()
+        logger.info("组播中继: %s:%s（组播网卡 %s）", listen_host, self.listen[1], self.source_iface)
+        return True, f"组播中继监听 {listen_host}:{self.listen[1]}"
+
+    def stop(self) -> None:
+        loop = self._loop
+        if loop and loop.is_running():
+            try:
+                asyncio.run_coroutine_threadsafe(self._shutdown(), loop).result(timeout=3)
+            except Exception:
+                pass
+            try:
+                loop.call_soon_threadsafe(loop.stop)
+            except RuntimeError:
+                # server 关闭后 _run() 已经结束，事件循环已关闭
+                pass
+        if self._thread and self._thread.is_alive() and threading.current_thread() is not self._thread:
+            self._thread.join(timeout=3)
+        self._thread = None
+        self._loop = None
+        self._server = None
+        self._groups = {}
+        self._joining = {}
+        self._started_at = 0.0
+        self._ready.clear()
+
+    def running(self) -> bool:
+        return bool(self._thread and self._thread.is_alive() and self._server is not None)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        作用：
+        - 当前状态（在事件循环线程里取快照，可从任意线程调用）。
+        """
+
+        loop = self._loop
+        base: Dict[str, Any] = {
+            "running": self.running(),
+            "source_iface": self.source_iface,
+            "uptime": int(time.time() - self._started_at) if self._started_at else 0,
+            "clients": 0,
+            "groups": [],
+        }
+        if not base["running"] or loop is None:
+            return base
+        try:
+            snap = asyncio.run_coroutine_threadsafe(self._snapshot(), loop).result(timeout=2)
+        except Exception:
+            return base
+        base.update(snap)
+        return base
+
+    async def _snapshot(self) -> Dict[str, Any]:
+        now = time.time()
+        groups = []
+        for g in self._groups.values():
+            groups.append(
+                {
+                    "group": g.key,
+                    "source_ip": g.source_ip,
+                    "clients": len(g.clients),
+                    "bytes": g.bytes,
+                    "datagrams": g.datagrams,
+                    "dropped": sum(c.dropped for c in g.clients),
+                    "age_s": int(now - g.since),
+                    "burst_bytes": g.burst.size if g.burst is not None else 0,
+                    "burst_served": g.burst_served,
+                    "warm_s": int(now - g.idle_since) if g.idle_since else 0,
+                }
+            )
+        return {"clients": sum(x["clients"] for x in groups), "groups": groups}
+
+    async def _shutdown(self) -> None:
+        server = self._server
+        if server is not None:
+            server.close()
+        loop = asyncio.get_running_loop()
+        for g in list(self._groups.values()):
+            g.close(loop)
+        self._groups.clear()
+
+    def _thread_main(self, listen_host: str, listen_port: int) -> None:
+        loop = asyncio.new_event_loop()
+        self._loop = loop
+        asyncio.set_event_loop(loop)
+
+        async def _run() -> None:
+            try:
+                self._server = await asyncio.start_server(
+                    self._handle,
+                    host=listen_host if listen_host not in ("0.0.0.0", "") else "0.0.0.0",
+                    port=listen_port,
+                    reuse_address=True,
+                )
+                self.listen = self._server.sockets[0].getsockname()[:2]
+            except Exception as e:
+                self._error = str(e)
+                logger.error("组播中继监听失败: %s", e)
+            finally:
+                self._ready.set()
+            if self._server:
+                try:
+                    async with self._server:
+                        await self._server.serve_forever()
+                except asyncio.CancelledError:
+                    # stop() 里 server.close() 会取消 serve_forever
+                    pass
+
+        try:
+            loop.run_until_complete(_run())
+        except RuntimeError:
+            # loop.stop() 会走到这里
+            pass
+        except Exception as e:
+            self._error = str(e)
+            logger.error("组播中继退出: %s", e)
+            self._ready.set()
+        finally:
+            try:
+                loop.close()
+            except Exception:
+                pass
+
+    # ---------- 组播组 ----------
+
+    async def _join(self, proto: str, group: str, port: int) -> _Group:
+        key = f"{proto}/{group}:{port}"
+        g = self._groups.get(key)
+        if g is not None:
+            return g
+        pending = self._joining.get(key)
+        if pending is not None:
+            # 同一频道的多个请求同时到达：等第一个加入完成
+            return await asyncio.shield(pending)
+        if self.max_groups and len(self._groups) + len(self._joining) >= self.max_groups:
+            # 先让出最久没人看的保温组
+            warm = [x for x in self._groups.values() if x.idle_since]
+            if not warm:
+                raise RelayError(503, f"同时观看的频道数已达上限 {self.max_groups}")
+            self._close_group(min(warm, key=lambda x: x.idle_since))
+
+        loop = asyncio.get_running_loop()
+        fut: asyncio.Future = loop.create_future()
+        self._joining[key] = fut
+        try:
+            # ioctl 取不到时会退回执行 `ip`，放到线程池里，避免卡住其它频道
+            source_ip = await loop.run_in_executor(None, get_ipv4_from_iface_cached, self.source_iface)
+            if not source_ip:
+                raise RelayError(500, f"网卡 {self.source_iface!r} 没有 IPv4")
+            g = _Group(proto, group, port, source_ip, self.burst_buffer)
+            try:
+                g.open(loop, self.rcvbuf)
+            except OSError as e:
+                raise RelayError(500, f"加入组播 {group}:{port} 失败: {e}") from e
+            self._groups[key] = g
+            logger.info("加入组播 %s（%s）", key, source_ip)
+            fut.set_result(g)
+            return g
+        except Exception as e:
+            fut.set_exception(e)
+            # 没有其他等待者时避免 "exception was never retrieved"
+            fut.exception()
+            raise
+        except BaseException:
+            fut.cancel()
+            raise
+        finally:
+            self._joining.pop(key, None)
+
+    def _close_group(self, g: _Group) -> None:
+        if self._groups.get(g.key) is g:
+            self._groups.pop(g.key, None)
+        g.close(asyncio.get_running_loop())
+        logger.info("退出组播 %s（%.0f 秒，%d 字节）", g.key, time.time() - g.since, g.bytes)
+
+    def _leave_if_idle(self, g: _Group) -> None:
+        if g.clients or self._groups.get(g.key) is not g:
+            return
+        if self.keep_warm_s <= 0:
+            self._close_group(g)
+            return
+        # 保温：到期时仍没人看才退出
+        idle_since = g.idle_since = time.time()
+
+        def _expire() -> None:
+            if not g.clients and g.idle_since == idle_since:
+                self._close_group(g)
+
+        asyncio.get_running_loop().call_later(self.keep_warm_s, _expire)
+
+    # ---------- HTTP ----------
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            req = await _read_headers(reader)
+            if not req:
+                return
+            first = req.split(b"\r\n", 1)[0].decode("latin-1", errors="ignore")
+            parts = first.split(" ")
+            method = (parts[0] or "").upper()
+            path = parts[1] if len(parts) > 1 else ""
+            if method in ("HEAD", "OPTIONS"):
+                writer.write(_HEAD_OK)
+                await writer.drain()
+                return
+            if method != "GET":
+                await _send_error(writer, 405, "Method Not Allowed")
+                return
+            target = parse_relay_path(path)
+            if target is None:
+                await _send_error(writer, 404, "Not Found")
+                return
+            try:
+                g = await self._join(*target)
+            except RelayError as e:
+                logger.warning("组播中继拒绝 %s: %s", path, e.reason)
+                await _send_error(writer, e.status, e.reason)
+                return
+            peer = writer.get_extra_info("peername")
+            await self._serve(g, reader, writer, f"{peer[0]}:{peer[1]}" if peer else "")
+        except Exception as e:
+            logger.debug("组播中继连接结束: %s", e)
+        finally:
+            try:
+                writer.close()
+                await writer.wait_closed()
+            except Exception:
+                pass
+
+    async def _serve(
+        self,
+        g: _Group,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        peer: str,
+    ) -> None:
+        # 环形缓冲至少放得下一整段快速换台数据
+        client = _Client(peer, max(self.client_buffer, self.burst_buffer))
+
+        async def _watch_eof() -> None:
+            # 播放器断开时 read 返回 b""；组播暂时没数据时也能及时退出
+            try:
+                while await reader.read(4096):
+                    pass
+            except Exception:
+                pass
+            client.closed = True
+            client.event.set()
+
+        watcher = asyncio.ensure_future(_watch_eof())
+        try:
+            writer.write(_HEAD_OK)
+            g.attach(client)
+            await writer.drain()
+            while True:
+                await client.event.wait()
+                if client.closed:
+                    break
+                data = client.take()
+                if data:
+                    writer.write(data)
+                    client.sent += len(data)
+                    await writer.drain()
+        finally:
+            watcher.cancel()
+            g.clients.discard(client)
+            if client.dropped:
+                logger.info("客户端 %s 太慢，%s 丢弃 %d 字节", peer, g.key, client.dropped)
+            self._leave_if_idle(g)
+
+
+async def _send_error(writer: asyncio.StreamWriter, status: int, reason: str) -> None:
+    body = f"{status} {reason}\n".encode("utf-8")
+    writer.write(
+        f"HTTP/1.1 {status} {http.HTTPStatus(status).phrase}\r\n"
+        "Content-Type: text/plain; charset=utf-8\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        "Connection: close\r\n"
+        "\r\n".encode("latin-1")
+        + body
+    )
+    await writer.drain()
+
+
+_relay = McastRelay()
+
+
+def start_relay(
+    listen_host: str,
+    listen_port: int,
+    *,
+    source_iface: str,
+    max_groups: int = 0,
+    client_buffer: int = DEFAULT_CLIENT_BUFFER,
+    rcvbuf: int = DEFAULT_RCVBUF,
+    burst_buffer: int = DEFAULT_BURST_BUFFER,
+    keep_warm_s: float = 0.0,
+) -> tuple[bool, str]:
+    return _relay.start(
+        listen_host,
+        listen_port,
+        source_iface=source_iface,
+        max_groups=max_groups,
+        client_buffer=client_buffer,
+        rcvbuf=rcvbuf,
+        burst_buffer=burst_buffer,
+        keep_warm_s=keep_warm_s,
+    )
+
+
+def stop_relay() -> None:
+    _relay.stop()
+
+
+def relay_running() -> bool:
+    return _relay.running()
+
+
+def get_relay_stats() -> Dict[str, Any]:
+    return _relay.stats()
+
+
+# ---------- 命令行：单独运行 / loopback 自检 ----------
+
+
+def _ts_packet(pid: int, cc: int, *, pusi: bool = False, rai: bool = False, fill: int = 0) -> bytes:
+    b1 = (0x40 if pusi else 0x00) | (pid >> 8)
+    if rai:
+        # 带 adaptation field（random_access_indicator）的关键帧起始包
+        return bytes([0x47, b1, pid & 0xFF, 0x30 | cc % 16, 7, 0x40]) + b"\xff" * 6 + bytes([fill]) * 176
+    return bytes([0x47, b1, pid & 0xFF, 0x10 | cc % 16]) + bytes([fill]) * 184
+
+
+def _selftest(clients: int, seconds: float) -> int:
+    """
+    作用：
+    - 在 lo 上起中继和一个 RTP 组播发送端（每 200 个数据报插一组 PAT/PMT/关键帧，其余每个数据报带一个置 RAI 的
+      音频 PES 起始包），多个 HTTP 客户端看同一频道：校验只加入一次组播、每个客户端都收到连续的 TS 包；
+      中途加入的客户端立刻收到以 PAT/PMT/视频关键帧开头的快速换台数据；全部断开后保温一段时间再退出组播。
+    """
+
+    import urllib.request
+
+    group, port = "239.255.42.1", 5140
+    pmt_pid, video_pid, audio_pid = 0x1000, 0x0100, 0x0101
+    warm_s = 1.0
+    relay = McastRelay()
+    ok, msg = relay.start("127.0.0.1", 0, source_iface="lo", keep_warm_s=warm_s)
+    if not ok:
+        print(f"❌ 启动失败: {msg}", file=sys.stderr)
+        return 1
+    base = f"http://127.0.0.1:{relay.listen[1]}"
+
+    # PAT：program 1 → PMT PID 0x1000（CRC 不校验，填 0）
+    pat_section = bytes([0x00, 0xB0, 0x0D, 0x00, 0x01, 0xC1, 0x00, 0x00, 0x00, 0x01, 0xE0 | pmt_pid >> 8, pmt_pid & 0xFF])
+    pat = bytes([0x47, 0x40, 0x00, 0x10, 0x00]) + pat_section + b"\x00" * 4
+    pat += b"\xff" * (TS_PACKET - len(pat))
+    # PMT：H.264 视频 + AAC 音频（音频每个 PES 都置 RAI，不能被当成关键帧）
+    pmt_section = bytes([0x02, 0xB0, 0x17, 0x00, 0x01, 0xC1, 0x00, 0x00, 0xE0 | video_pid >> 8, video_pid & 0xFF, 0xF0, 0x00])
+    pmt_section += bytes([0x1B, 0xE0 | video_pid >> 8, video_pid & 0xFF, 0xF0, 0x00])
+    pmt_section += bytes([0x0F, 0xE0 | audio_pid >> 8, audio_pid & 0xFF, 0xF0, 0x00])
+    pmt = bytes([0x47, 0x40 | pmt_pid >> 8, pmt_pid & 0xFF, 0x10, 0x00]) + pmt_section + b"\x00" * 4
+    pmt += b"\xff" * (TS_PACKET - len(pmt))
+    stop = threading.Event()
+
+    def _sender() -> None:
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        s.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton("127.0.0.1"))
+        s.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        seq = 0
+        while not stop.is_set():
+            if seq % 200 == 0:
+                pkts = [pat, pmt, _ts_packet(video_pid, seq, pusi=True, rai=True)]
+            else:
+                pkts = [_ts_packet(audio_pid, seq, pusi=True, rai=True)]
+            pkts += [_ts_packet(video_pid, seq + i, fill=seq % 256) for i in range(7 - len(pkts))]
+            rtp = struct.pack("!BBHII", 0x80, 33, seq % 65536, seq * 3600, 0x1234)
+            s.sendto(rtp + b"".join(pkts), (group, port))
+            seq += 1
+            time.sleep(0.001)
+        s.close()
+
+    results: Dict[int, bytes] = {}
+    late: Dict[str, Any] = {}
+
+    def _client(i: int) -> None:
+        with urllib.request.urlopen(f"{base}/rtp/{group}:{port}", timeout=5) as resp:
+            buf = b""
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                buf += resp.read(TS_PACKET * 70)
+            results[i] = buf
+
+    def _late_client() -> None:
+        t0 = time.monotonic()
+        with urllib.request.urlopen(f"{base}/rtp/{group}:{port}", timeout=5) as resp:
+            head = resp.read(TS_PACKET * 3)
+            late["first_ms"] = (time.monotonic() - t0) * 1000
+            late["head"] = head
+
+    sender = threading.Thread(target=_sender, daemon=True)
+    sender.start()
+    threads = [threading.Thread(target=_client, args=(i,), daemon=True) for i in range(clients)]
+    for t in threads:
+        t.start()
+    time.sleep(seconds / 2)
+    mid = relay.stats()
+    _late_client()
+    for t in threads:
+        t.join(timeout=seconds + 5)
+    time.sleep(0.3)
+    warm = relay.stats()
+    time.sleep(warm_s + 0.3)
+    end = relay.stats()
+    stop.set()
+    relay.stop()
+
+    def _pid(pkt: bytes) -> int:
+        return ((pkt[1] & 0x1F) << 8) | pkt[2] if len(pkt) >= 4 else -1
+
+    groups = mid.get("groups") or []
+    # RTP 头去掉后应是连续的 188 字节 TS 包
+    aligned = all(
+        len(b) >= TS_PACKET * 7 and b[0 : len(b) - len(b) % TS_PACKET : TS_PACKET].count(0x47) == len(b) // TS_PACKET
+        for b in results.values()
+    )
+    head = late.get("head") or b""
+    pkts = [head[i : i + TS_PACKET] for i in range(0, len(head), TS_PACKET)]
+    burst_ok = len(pkts) == 3 and [_pid(x) for x in pkts] == [0, pmt_pid, video_pid] and bool(pkts[2][5] & 0x40)
+    print(f"客户端={clients} 收到字节={[len(b) for b in results.values()]}")
+    print(f"运行中: 组播组={len(groups)} 客户端={mid.get('clients')}")
+    print(f"中途加入: 首包 {late.get('first_ms', 0):.1f} ms，开头 PID={[hex(_pid(x)) for x in pkts]}")
+    print(f"全部断开后: 保温中组播组={len(warm.get('groups') or [])}  {warm_s:g}s 后={len(end.get('groups') or [])}")
+    if (
+        len(results) != clients
+        or not aligned
+        or len(groups) != 1
+        or mid.get("clients") != clients
+        or not burst_ok
+        or len(warm.get("groups") or []) != 1
+        or end.get("groups")
+    ):
+        print("❌ 自检失败", file=sys.stderr)
+        return 1
+    print("✅ 单次加入、多客户端分发、快速换台缓冲、保温后退出组播均正常")
+    return 0
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="原生组播 → HTTP 中继（/rtp/ /udp/，与 udpxy URL 相同）")
+    ap.add_argument("--listen", default="0.0.0.0", help="HTTP 监听地址")
+    ap.add_argument("--port", type=int, default=4022, help="HTTP 监听端口")
+    ap.add_argument("--iface", default="eth1", help="接收组播的网卡（source_iface）")
+    ap.add_argument("--max-groups", type=int, default=0, help="同时加入的组播组上限（0=不限）")
+    ap.add_argument("--client-buffer", default="1Mb", help="每个客户端的环形缓冲（如 1Mb / 512Kb）")
+    ap.add_argument("--burst-buffer", default="2Mb", help="快速换台缓冲上限（0=关闭）")
+    ap.add_argument("--keep-warm", type=float, default=0.0, help="最后一个客户端断开后保温秒数")
+    ap.add_argument("--selftest", action="store_true", help="在 lo 上跑一次组播自检后退出")
+    ap.add_argument("--selftest-clients", type=int, default=3, help="自检时的客户端数")
+    ap.add_argument("--selftest-seconds", type=float, default=2.0, help="自检时每个客户端读多久")
+    args = ap.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    if args.selftest:
+        return _selftest(max(1, args.selftest_clients), max(0.5, args.selftest_seconds))
+
+    ok, msg = start_relay(
+        args.listen,
+        args.port,
+        source_iface=args.iface,
+        max_groups=args.max_groups,
+        client_buffer=parse_size(args.client_buffer, DEFAULT_CLIENT_BUFFER),
+        burst_buffer=parse_size(args.burst_buffer, DEFAULT_BURST_BUFFER),
+        keep_warm_s=args.keep_warm,
+    )
+    print(msg, file=sys.stderr)
+    if not ok:
+        return 1
+    try:
+        while relay_running():
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    stop_relay()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -11,12 +11,28 @@
 
 from __future__ import annotations
 
+import errno
 import http.client
+import logging
 import re
+import socket
+import struct
 import subprocess
+import threading
+import time
 import urllib.request
 from functools import partial
-from typing import Optional
+from typing import Dict, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # 非 Linux/Unix：退回 `ip` 命令
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Linux <linux/sockios.h>
+_SIOCGIFADDR = 0x8915
 
 
 def is_url(s: str) -> bool:
@@ -125,3 +141,105 @@ def get_ipv4_from_iface(iface: str) -> str:
 
     return ""
 
+
+def _ioctl_ipv4(ifname: str) -> Optional[str]:
+    """
+    作用：
+    - 用 ioctl(SIOCGIFADDR) 读网卡主 IPv4（不 fork 子进程，微秒级）。
+
+    输出：
+    - str: IPv4；网卡不存在/没有 IPv4 返回 ""
+    - None: 当前平台不支持 ioctl（调用方退回 `ip` 命令）
+    """
+
+    if fcntl is None:
+        return None
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            packed = struct.pack("256s", ifname.encode("utf-8")[:15])
+            res = fcntl.ioctl(s.fileno(), _SIOCGIFADDR, packed)
+        return socket.inet_ntoa(res[20:24])
+    except OSError as e:
+        if e.errno in (errno.EADDRNOTAVAIL, errno.ENODEV, errno.ENXIO):
+            return ""
+        return None
+
+
+# iface -> (ipv4, 读取时间)
+_iface_ip_cache: Dict[str, Tuple[str, float]] = {}
+_iface_ip_lock = threading.Lock()
+
+
+def get_ipv4_from_iface_cached(iface: str, *, max_age_s: float = 5.0) -> str:
+    """
+    作用：
+    - 带缓存的网卡 IPv4 查询，给回看反代这类每个请求都要取源地址的热路径用。
+      缓存超过 max_age_s 秒重新用 ioctl 读一次（DHCP 换地址几秒内生效），
+      ioctl 不可用时才退回 get_ipv4_from_iface()（会 fork `ip`）。
+
+    输入：
+    - iface: 网卡名，例如 "eth1"
+    - max_age_s: 缓存有效秒数
+
+    输出：
+    - str: 成功返回 IPv4，失败返回 ""
+    """
+
+    ifname = (iface or "").strip()
+    if not ifname:
+        return ""
+
+    now = time.monotonic()
+    cached = _iface_ip_cache.get(ifname)
+    if cached is not None and now - cached[1] < max_age_s:
+        return cached[0]
+
+    with _iface_ip_lock:
+        cached = _iface_ip_cache.get(ifname)
+        if cached is not None and now - cached[1] < max_age_s:
+            return cached[0]
+        ip = _ioctl_ipv4(ifname)
+        if ip is None:
+            ip = get_ipv4_from_iface(ifname)
+        old = cached[0] if cached is not None else None
+        if old is not None and old != ip:
+            logger.info(f"网卡 {ifname} IPv4 变化: {old or '-'} → {ip or '-'}")
+        _iface_ip_cache[ifname] = (ip, time.monotonic())
+        return ip
+
+
+class TokenBucket:
+    """
+    作用：
+    - 线程安全的令牌桶限速：平均每秒 rate 个请求，允许瞬时突发 burst 个。
+      多个工作线程共用一个桶，比每个请求后固定 sleep 更能吃满允许的速率。
+
+    输入：
+    - rate: 每秒补充的令牌数（<=0 = 不限速）
+    - burst: 桶容量（至少 1）
+    """
+
+    def __init__(self, rate: float, burst: int = 1) -> None:
+        self.rate = max(0.0, float(rate))
+        self.burst = max(1, int(burst))
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """取一个令牌，不够时阻塞等待；返回本次等待的秒数。"""
+
+        if self.rate <= 0:
+            return 0.0
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(float(self.burst), self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return waited
+                delay = (1.0 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
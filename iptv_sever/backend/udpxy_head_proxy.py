@@ -4,12 +4,19 @@
 """
 对外 :4022 的薄代理：APTV 探测用 HEAD，udpxy 只认 GET。
 HEAD/OPTIONS 直接 200；其它请求流式转到 127.0.0.1:backend_port。
+
+Linux 上 udpxy → 播放器方向默认走 os.splice()（socket → 管道 → socket，数据不进 Python），
+不支持时退回 read/write 循环。对比：python3 iptv_sever/backend/bench_head_proxy.py
 """
 
 from __future__ import annotations
 
 import asyncio
+import errno
 import logging
+import os
+import socket
+import sys
 import threading
 import time
 from typing import Optional
@@ -24,6 +31,15 @@ _HEAD_OK = (
     b"\r\n"
 )
 
+_PIPE_CHUNK = 64 * 1024
+# 管道容量调到 1MB（F_SETPIPE_SZ），一次 splice 能搬更多数据；失败就用内核默认的 64KB
+_PIPE_SIZE = 1024 * 1024
+_F_SETPIPE_SZ = 1031
+
+SPLICE_SUPPORTED = sys.platform.startswith("linux") and hasattr(os, "splice")
+# 内核不支持 splice（EINVAL/ENOSYS）时置位，之后的连接直接走普通循环
+_splice_broken = False
+
 
 class UdpxyHeadProxy:
     def __init__(self) -> None:
@@ -32,6 +48,8 @@ class UdpxyHeadProxy:
         self._server: Optional[asyncio.AbstractServer] = None
         self._ready = threading.Event()
         self._error = ""
+        self._splice = SPLICE_SUPPORTED
+        self.listen_port = 0
 
     def start(
         self,
@@ -39,10 +57,13 @@ class UdpxyHeadProxy:
         listen_port: int,
         backend_host: str,
         backend_port: int,
+        *,
+        splice: bool = True,
     ) -> tuple[bool, str]:
         self.stop()
         self._ready.clear()
         self._error = ""
+        self._splice = bool(splice) and SPLICE_SUPPORTED
         self._thread = threading.Thread(
             target=self._thread_main,
             args=(listen_host, listen_port, backend_host, backend_port),
@@ -56,13 +77,14 @@ class UdpxyHeadProxy:
         if self._error:
             return False, self._error
         logger.info(
-            "UDPXY HEAD 代理: %s:%s → %s:%s",
+            "UDPXY HEAD 代理: %s:%s → %s:%s（%s）",
             listen_host,
-            listen_port,
+            self.listen_port,
             backend_host,
             backend_port,
+            "splice" if self._splice else "read/write",
         )
-        return True, f"HEAD 代理监听 {listen_host}:{listen_port}"
+        return True, f"HEAD 代理监听 {listen_host}:{self.listen_port}"
 
     def stop(self) -> None:
         loop = self._loop
@@ -100,6 +122,7 @@ class UdpxyHeadProxy:
                     port=listen_port,
                     reuse_address=True,
                 )
+                self.listen_port = self._server.sockets[0].getsockname()[1]
             except Exception as e:
                 self._error = str(e)
                 logger.error("UDPXY HEAD 代理监听失败: %s", e)
@@ -141,10 +164,26 @@ class UdpxyHeadProxy:
                 writer.write(_HEAD_OK)
                 await writer.drain()
                 return
-            b_reader, b_writer = await asyncio.open_connection(backend_host, backend_port)
-            try:
+            if self._splice and not _splice_broken:
+                loop = asyncio.get_running_loop()
+                b_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                b_sock.setblocking(False)
+                try:
+                    await loop.sock_connect(b_sock, (backend_host, backend_port))
+                    await loop.sock_sendall(b_sock, req)
+                    if await _splice_relay(loop, b_sock, writer):
+                        b_sock.close()
+                        return
+                    # splice 不可用：同一条后端连接退回普通循环
+                    b_reader, b_writer = await asyncio.open_connection(sock=b_sock)
+                except BaseException:
+                    b_sock.close()
+                    raise
+            else:
+                b_reader, b_writer = await asyncio.open_connection(backend_host, backend_port)
                 b_writer.write(req)
                 await b_writer.drain()
+            try:
                 await asyncio.gather(
                     _pipe(reader, b_writer),
                     _pipe(b_reader, writer),
@@ -198,6 +237,115 @@ async def _pipe(src: asyncio.StreamReader, dst: asyncio.StreamWriter) -> None:
         pass
 
 
+async def _splice_relay(
+    loop: asyncio.AbstractEventLoop,
+    b_sock: socket.socket,
+    writer: asyncio.StreamWriter,
+) -> bool:
+    """
+    作用：
+    - 后端 → 客户端方向在内核里搬运：splice(后端 socket → 管道) + splice(管道 → 客户端 socket)，
+      由事件循环的可读/可写回调驱动；客户端发来的少量数据照常转给后端。
+
+    输出：
+    - True：连接已处理完；False：内核不支持 splice 且还没搬过数据（调用方退回普通循环）
+    """
+
+    transport = writer.transport
+    c_sock = writer.get_extra_info("socket")
+    if c_sock is None:
+        return False
+    # 事件循环不允许在 transport 占用的 fd 上再注册回调，用 dup 出来的 fd（同一个 socket）；
+    # transport 暂停读、写缓冲为空，期间不会与下面的回调抢同一个 socket
+    cfd = os.dup(c_sock.fileno())
+    bfd = b_sock.fileno()
+    transport.pause_reading()
+
+    pr, pw = os.pipe()
+    try:
+        import fcntl
+
+        fcntl.fcntl(pw, _F_SETPIPE_SZ, _PIPE_SIZE)
+    except (ImportError, OSError):
+        pass
+    os.set_blocking(pr, False)
+    os.set_blocking(pw, False)
+
+    done: asyncio.Future = loop.create_future()
+    state = {"pending": 0, "moved": 0, "waiting": ""}
+    flags = os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK
+
+    def _finish(result: bool) -> None:
+        if not done.done():
+            done.set_result(result)
+
+    def _wait(what: str) -> None:
+        if state["waiting"] == what:
+            return
+        if what == "client":
+            loop.remove_reader(bfd)
+            loop.add_writer(cfd, _pump)
+        else:
+            loop.remove_writer(cfd)
+            loop.add_reader(bfd, _pump)
+        state["waiting"] = what
+
+    def _pump() -> None:
+        try:
+            while True:
+                if state["pending"]:
+                    n = os.splice(pr, cfd, state["pending"], flags=flags)
+                    state["pending"] -= n
+                    continue
+                n = os.splice(bfd, pw, _PIPE_CHUNK, flags=flags)
+                if n == 0:
+                    _finish(True)
+                    return
+                state["pending"] += n
+                state["moved"] += n
+        except (BlockingIOError, InterruptedError):
+            _wait("client" if state["pending"] else "backend")
+        except OSError as e:
+            if e.errno in (errno.EINVAL, errno.ENOSYS) and not state["moved"]:
+                global _splice_broken
+                _splice_broken = True
+                logger.warning("内核不支持 splice（%s），HEAD 代理改用普通循环", e)
+                _finish(False)
+                return
+            _finish(True)
+
+    def _on_client() -> None:
+        # 播放器一般不再发数据；断开时读到 b""
+        try:
+            data = os.read(cfd, 65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            _finish(True)
+            return
+        if not data:
+            _finish(True)
+            return
+        try:
+            b_sock.send(data)
+        except OSError:
+            pass
+
+    loop.add_reader(cfd, _on_client)
+    _pump()
+    try:
+        return await done
+    finally:
+        loop.remove_reader(cfd)
+        loop.remove_reader(bfd)
+        loop.remove_writer(cfd)
+        os.close(pr)
+        os.close(pw)
+        os.close(cfd)
+        if done.done() and not done.cancelled() and done.result() is False:
+            transport.resume_reading()
+
+
 _proxy = UdpxyHeadProxy()
 
 
@@ -206,8 +354,10 @@ def start_head_proxy(
     listen_port: int,
     backend_host: str,
     backend_port: int,
+    *,
+    splice: bool = True,
 ) -> tuple[bool, str]:
-    return _proxy.start(listen_host, listen_port, backend_host, backend_port)
+    return _proxy.start(listen_host, listen_port, backend_host, backend_port, splice=splice)
 
 
 def stop_head_proxy() -> None:
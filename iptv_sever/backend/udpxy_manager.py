@@ -44,6 +44,54 @@ class UdpxyManager:
     def backend_bind(self) -> str:
         return str(self.config.get("backend_bind") or "127.0.0.1")
 
+    def engine(self) -> str:
+        """udpxy = 外部 udpxy 进程 + HEAD 代理；native = 进程内组播中继（backend/mcast_relay.py）"""
+        return "native" if str(self.config.get("engine") or "").strip().lower() == "native" else "udpxy"
+
+    def _start_native(self) -> Tuple[bool, str, Optional[int]]:
+        from backend.mcast_relay import parse_size, start_relay
+        from backend.udpxy_head_proxy import stop_head_proxy
+
+        # 之前用 udpxy 引擎时 :4022 是 HEAD 代理，先让出来（外部 udpxy 进程只占 14022，不影响）
+        stop_head_proxy()
+        ok, msg = start_relay(
+            self.config.get("bind_address") or "0.0.0.0",
+            self.public_port(),
+            source_iface=str(self.config.get("source_iface") or "eth1"),
+            max_groups=int(self.config.get("max_connections") or 0),
+            client_buffer=parse_size(self.config.get("client_buffer"), 1024 * 1024),
+            rcvbuf=parse_size(self.config.get("buffer_size"), 2 * 1024 * 1024),
+            burst_buffer=parse_size(self.config.get("burst_buffer"), 2 * 1024 * 1024),
+            keep_warm_s=float(self.config.get("keep_warm_s") or 0),
+        )
+        if not ok:
+            return False, f"组播中继启动失败: {msg}", None
+        return True, f"组播中继启动成功（对外 :{self.public_port()}）", os.getpid()
+
+    def _native_status(self) -> Dict:
+        from backend.mcast_relay import get_relay_stats
+        from backend.net import get_ipv4_from_iface_cached
+
+        st = get_relay_stats()
+        groups = st.get("groups") or []
+        # 已加入的组用旧地址时报旧地址，让 ensure_udpxy_bound_to_source_ip() 触发重启重新加入
+        bind_ip = groups[0]["source_ip"] if groups else get_ipv4_from_iface_cached(str(self.config["source_iface"]))
+        return {
+            "running": bool(st.get("running")),
+            "engine": "native",
+            "pid": os.getpid() if st.get("running") else None,
+            "port": self.public_port(),
+            "bind_address": self.config.get("bind_address") or "0.0.0.0",
+            "backend_port": None,
+            "source_iface": self.config["source_iface"],
+            "max_connections": self.config["max_connections"],
+            "connections": int(st.get("clients") or 0),
+            "uptime": int(st.get("uptime") or 0),
+            "available": True,
+            "multicast_bind_ip": (bind_ip or None) if st.get("running") else None,
+            "groups": groups,
+        }
+
     def _pid_from_file(self) -> Optional[int]:
         try:
             return int(self.pid_file.read_text())
@@ -84,6 +132,8 @@ class UdpxyManager:
         Returns:
             (是否可用, 消息)
         """
+        if self.engine() == "native":
+            return True, "原生组播中继可用（进程内，不需要 udpxy）"
         if not self.udpxy_binary:
             return False, "未找到 UDPXY 程序，请先安装 udpxy"
         return True, "UDPXY 可用"
@@ -95,6 +145,8 @@ class UdpxyManager:
         Returns:
             (是否成功, 消息, PID)
         """
+        if self.engine() == "native":
+            return self._start_native()
         if not self.udpxy_binary:
             return False, "UDPXY 程序未安装", None
         
@@ -147,6 +199,7 @@ class UdpxyManager:
                 self.public_port(),
                 self.backend_bind(),
                 self.backend_port(),
+                splice=bool(self.config.get("splice", True)),
             )
             if not ok:
                 return False, f"UDPXY 已在运行，但 HEAD 代理失败: {msg}", None
@@ -377,6 +430,7 @@ class UdpxyManager:
                 self.public_port(),
                 self.backend_bind(),
                 self.backend_port(),
+                splice=bool(self.config.get("splice", True)),
             )
             if not pok:
                 return False, f"UDPXY 已启动但 HEAD 代理失败: {pmsg}", pid
@@ -401,6 +455,13 @@ class UdpxyManager:
         from backend.udpxy_head_proxy import stop_head_proxy
 
         stop_head_proxy()
+        if self.engine() == "native":
+            from backend.mcast_relay import relay_running, stop_relay
+
+            if not relay_running():
+                return False, "组播中继未运行"
+            stop_relay()
+            return True, "组播中继已停止"
         if not self.is_running():
             return False, "UDPXY 未运行"
         
@@ -475,6 +536,10 @@ class UdpxyManager:
         Returns:
             是否运行
         """
+        if self.engine() == "native":
+            from backend.mcast_relay import relay_running
+
+            return relay_running()
         # 首先检查端口是否被监听（更可靠的方法）
         # 在 Docker host 网络模式下，udpxy 监听主机的网络接口
         # 尝试多种方式检查端口
@@ -550,11 +615,14 @@ class UdpxyManager:
         Returns:
             状态字典
         """
+        if self.engine() == "native":
+            return self._native_status()
         available, msg = self.check_available()
         running = self.is_running()
         
         status = {
             "running": running,
+            "engine": "udpxy",
             "pid": None,
             "port": self.public_port(),
             "bind_address": self.config.get("bind_address") or "0.0.0.0",
@@ -219,6 +219,7 @@ class MqttService:
                 "unique_id": f"{self.client_id}_last_job_ok",
                 "state_topic": self.topic("job"),
                 "value_template": "{{ 'ON' if value_json.rc == 0 else 'OFF' }}",
+                "json_attributes_topic": self.topic("job"),
                 "availability": [avail],
                 "device": device,
             },
@@ -243,6 +244,8 @@ class MqttService:
             "{{ value_json.download_url }}"
             "{% else %}—{% endif %}"
         )
+        # 属性里带上内容哈希（与 /out 的 ETag 同源），卡片据此判断内容是否真的变了
+        file_attrs_tpl = "{{ {'etag': value_json.etag, 'size': value_json.size} | tojson }}"
         for key, name, template, topic_key in (
             ("m3u_mtime", "IPTV M3U MTime", mtime_tpl, "m3u"),
             ("m3u_url", "IPTV M3U URL (TiviMate)", url_tpl, "m3u"),
@@ -250,18 +253,18 @@ class MqttService:
             ("epg_mtime", "IPTV EPG MTime", mtime_tpl, "epg"),
             ("epg_url", "IPTV EPG URL", url_tpl, "epg"),
         ):
-            self._disc(
-                "sensor",
-                key,
-                {
-                    "name": name,
-                    "unique_id": f"{self.client_id}_{key}",
-                    "state_topic": self.topic(topic_key),
-                    "value_template": template,
-                    "availability": [avail],
-                    "device": device,
-                },
-            )
+            payload = {
+                "name": name,
+                "unique_id": f"{self.client_id}_{key}",
+                "state_topic": self.topic(topic_key),
+                "value_template": template,
+                "availability": [avail],
+                "device": device,
+            }
+            if key.endswith("_mtime"):
+                payload["json_attributes_topic"] = self.topic(topic_key)
+                payload["json_attributes_template"] = file_attrs_tpl
+            self._disc("sensor", key, payload)
 
         self._disc(
             "sensor",
@@ -358,6 +361,10 @@ def publish_all_status(status: Dict[str, Any]) -> None:
         "type": status.get("last_job") or "",
         "rc": status.get("last_job_rc"),
         "at": status.get("last_job_at") or 0,
+        # 本次生成的变化摘要（changed=false 表示内容未变、文件未重写）
+        "changes": status.get("last_job_changes"),
+        # 每类任务各自最近一次的 rc/at/changes（一键生成时卡片据此分别判断 M3U 和 EPG）
+        "jobs": status.get("jobs") or {},
     }
     svc.publish("job", job, retain=True)
     try: